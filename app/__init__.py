@@ -2,9 +2,21 @@
 import os
 
 from flask import Flask
-from sqlalchemy import inspect, text
-from .extensions import db, migrate, socketio
+from .archive import init_archive
+from .assets import init_assets
+from .card_cache import init_card_cache
+from .cluster import client_manager_options, init_cluster
+from .commands import register_commands
+from .compression import init_compression
+from .extensions import db, socketio
+from .hashing import init_password_hashing
+from .message_cache import init_message_cache
+from .metrics import init_metrics
+from .notifications import init_notifications, unread_count
+from .querytrack import init_query_tracking
+from .ratelimit import init_rate_limits
 from .routes import views
+from .schema import init_database, init_migrations, running_cli
 from .sockets import register_socket_handlers
 from .utils import init_session, get_current_user, media_url, get_visible_channels
 from .models import Channel
@@ -16,11 +28,31 @@ def create_app(config_object="config.Config"):
     os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
     db.init_app(app)
-    migrate.init_app(app, db)
-    socketio.init_app(app)
+    cli = running_cli()
+    if cli:
+        init_migrations(app)
+    socketio.init_app(
+        app,
+        compression_threshold=app.config["SOCKETIO_POLLING_COMPRESSION_THRESHOLD"],
+        serializer=app.config["SOCKETIO_SERIALIZER"],
+        **client_manager_options(app),
+    )
+    init_cluster(app, socketio)
     init_session(app)
+    init_password_hashing(app, socketio)
+    if app.config.get("METRICS_ENABLED"):
+        init_metrics(app, db, socketio)
+    init_query_tracking(app, db)
+    init_message_cache(app)
+    init_card_cache(app)
+    init_notifications(app, db)
+    init_archive(app)
+    init_rate_limits(app)
 
     app.register_blueprint(views.bp)
+    init_compression(app, socketio)
+    init_assets(app)
+    register_commands(app)
 
     @app.context_processor
     def inject_globals():
@@ -31,24 +63,15 @@ def create_app(config_object="config.Config"):
         return {
             "current_user": current_user,
             "channels": channels,
+            "unread_notifications": unread_count(current_user.id) if current_user else 0,
         }
 
     @app.template_filter("media")
     def media_filter(value):
         return media_url(value)
 
-    with app.app_context():
-        db.create_all()
-        inspector = inspect(db.engine)
-        emoji_columns = {column["name"] for column in inspector.get_columns("emojis")}
-        if "is_public" not in emoji_columns:
-            db.session.execute(
-                text("ALTER TABLE emojis ADD COLUMN is_public BOOLEAN NOT NULL DEFAULT 0")
-            )
-            db.session.commit()
-        if not Channel.query.first():
-            db.session.add(Channel(slug="general", name="# general", description="기본 채널"))
-            db.session.commit()
+    if app.config.get("AUTO_INIT_DB") and not cli:
+        init_database(app)
 
     register_socket_handlers(socketio)
 
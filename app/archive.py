@@ -0,0 +1,350 @@
+"""Tiered archival of old messages into compressed segment files.
+
+Messages older than a channel's ``archive_after_days`` (default
+``MESSAGE_ARCHIVE_AFTER_DAYS``) move out of the ``messages`` table into
+JSON Lines files under ``MESSAGE_ARCHIVE_FOLDER``, one or more per channel
+and month (``<channel id>/<YYYY-MM>/<first id>-<last id>.jsonl.gz``), gzip
+compressed or zstd with ``MESSAGE_ARCHIVE_CODEC=zstd`` and the
+``zstandard`` package. Each channel's newest ``MESSAGE_ARCHIVE_KEEP_RECENT``
+messages always stay hot, so the chat page and reconnect catch-up never
+leave the table. ``message_archive_segments`` indexes every file by channel
+and id range: history pages continue into the archive once the table runs
+out, and reply previews and thread roots resolve archived ids through it.
+
+Archived messages are read-only; editing or deleting one reports it as not
+found. Replies keep the archived id, which is why ``messages.reply_to_id``
+has no foreign key, and message ids are AUTOINCREMENT, so an archived id is
+never handed to a new message. Segment files never change once written, so each worker keeps the
+last few decoded segments in memory without any cross-worker invalidation.
+A run writes one segment and deletes its rows per transaction, pausing in
+between; a segment whose transaction fails is removed again.
+"""
+import gzip
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import takewhile
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from .extensions import db, socketio
+from .metrics import gauge, inc
+from .models import Channel, Message, MessageArchiveSegment, User
+from .periodic import start_periodic
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+CODEC_EXTENSIONS = {"gzip": "gz", "zstd": "zst"}
+_DATETIME_FIELDS = ("created_at", "updated_at")
+
+
+def _compress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("reading zstd archive segments needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def archive_codec(config):
+    codec = config.get("MESSAGE_ARCHIVE_CODEC", "gzip")
+    if codec == "zstd" and zstandard is None:
+        current_app.logger.warning("MESSAGE_ARCHIVE_CODEC=zstd needs the zstandard package; using gzip")
+        return "gzip"
+    return codec if codec in CODEC_EXTENSIONS else "gzip"
+
+
+def _encode_row(message):
+    return {
+        "id": message.id,
+        "user_id": message.user_id,
+        "content": message.content,
+        "reply_to_id": message.reply_to_id,
+        "is_deleted": bool(message.is_deleted),
+        "created_at": message.created_at.isoformat() if message.created_at else None,
+        "updated_at": message.updated_at.isoformat() if message.updated_at else None,
+        "client_id": message.client_id,
+    }
+
+
+def _to_message(row, channel_id):
+    """A transient ``Message`` for an archived row; never added to the session."""
+    values = dict(row)
+    for field in _DATETIME_FIELDS:
+        if values.get(field):
+            values[field] = datetime.fromisoformat(values[field])
+    return Message(channel_id=channel_id, **values)
+
+
+def read_segment(segment):
+    """Decode a segment file into its rows, oldest first, bypassing the cache."""
+    path = os.path.join(current_app.config["MESSAGE_ARCHIVE_FOLDER"], segment.path)
+    with open(path, "rb") as handle:
+        data = _decompress(handle.read(), segment.codec)
+    return [json.loads(line) for line in data.splitlines() if line]
+
+
+class SegmentCache:
+    def __init__(self, max_segments=16):
+        self.max_segments = max_segments
+        self._rows = OrderedDict()
+
+    def configure(self, max_segments):
+        self.max_segments = max_segments
+        self._rows.clear()
+
+    def rows(self, segment):
+        """The decoded rows of ``segment``, oldest first."""
+        rows = self._rows.get(segment.id)
+        inc("kjb_archive_segment_reads_total", result="miss" if rows is None else "hit")
+        if rows is not None:
+            self._rows.move_to_end(segment.id)
+            return rows
+        rows = read_segment(segment)
+        if self.max_segments > 0:
+            self._rows[segment.id] = rows
+            while len(self._rows) > self.max_segments:
+                self._rows.popitem(last=False)
+        return rows
+
+    def size(self):
+        return len(self._rows)
+
+
+segment_cache = SegmentCache()
+
+
+def _with_live_authors(rows):
+    """Drop archived rows whose author has since been deleted."""
+    user_ids = {row["user_id"] for row in rows}
+    if not user_ids:
+        return rows
+    live = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+    return [row for row in rows if row["user_id"] in live]
+
+
+def archived_before(channel_id, before_id=None, limit=200, after_id=None):
+    """Up to ``limit`` archived messages of a channel with ids between ``after_id`` and ``before_id``, newest first."""
+    query = MessageArchiveSegment.query.filter(MessageArchiveSegment.channel_id == channel_id)
+    if before_id is not None:
+        query = query.filter(MessageArchiveSegment.first_id < before_id)
+    if after_id is not None:
+        query = query.filter(MessageArchiveSegment.last_id > after_id)
+    found = []
+    for segment in query.order_by(MessageArchiveSegment.last_id.desc()):
+        rows = [
+            row
+            for row in segment_cache.rows(segment)
+            if (before_id is None or row["id"] < before_id) and (after_id is None or row["id"] > after_id)
+        ]
+        found.extend(reversed(_with_live_authors(rows)))
+        if len(found) >= limit:
+            break
+    return [_to_message(row, channel_id) for row in found[:limit]]
+
+
+def archived_by_ids(message_ids):
+    """Archived messages by id, as ``{id: Message}``."""
+    message_ids = set(message_ids)
+    if not message_ids:
+        return {}
+    # One query for the segments holding any of the ids, each id a range
+    # probe on the segment index.
+    segments = MessageArchiveSegment.query.filter(
+        or_(
+            *(
+                and_(MessageArchiveSegment.first_id <= message_id, MessageArchiveSegment.last_id >= message_id)
+                for message_id in message_ids
+            )
+        )
+    ).all()
+    channel_ids = {}
+    rows = []
+    for segment in segments:
+        for row in segment_cache.rows(segment):
+            if row["id"] in message_ids:
+                channel_ids[row["id"]] = segment.channel_id
+                rows.append(row)
+    return {row["id"]: _to_message(row, channel_ids[row["id"]]) for row in _with_live_authors(rows)}
+
+
+def channel_history(channel_id, before_id=None, limit=200):
+    """A history page: ``(messages oldest first, next_before)``.
+
+    Reads the hot table and merges in archived messages from segments whose
+    id range reaches into the page; normally those only exist once the table
+    has nothing older. ``next_before`` is None when there is nothing more.
+    """
+    query = Message.query.filter(Message.channel_id == channel_id)
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    messages = query.order_by(Message.id.desc()).limit(limit).all()
+    # A full hot page only needs archived ids newer than its oldest message.
+    after_id = messages[-1].id if len(messages) == limit else None
+    archived = archived_before(channel_id, before_id, limit, after_id=after_id)
+    if archived:
+        messages = sorted(messages + archived, key=lambda message: message.id, reverse=True)[:limit]
+    messages.reverse()
+    next_before = messages[0].id if len(messages) == limit else None
+    return messages, next_before
+
+
+def _segment_path(channel_id, rows, codec):
+    month = rows[0].created_at.strftime("%Y-%m")
+    return os.path.join(str(channel_id), month, f"{rows[0].id}-{rows[-1].id}.jsonl.{CODEC_EXTENSIONS[codec]}")
+
+
+def _write_segment(folder, channel_id, rows, codec):
+    relative = _segment_path(channel_id, rows, codec)
+    path = os.path.join(folder, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = b"".join(
+        json.dumps(_encode_row(row), ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        for row in rows
+    )
+    compressed = _compress(data, codec)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(compressed)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+    segment = MessageArchiveSegment(
+        channel_id=channel_id,
+        first_id=rows[0].id,
+        last_id=rows[-1].id,
+        first_created_at=rows[0].created_at,
+        last_created_at=rows[-1].created_at,
+        message_count=len(rows),
+        path=relative,
+        codec=codec,
+        size_bytes=len(compressed),
+    )
+    return segment, path, len(data)
+
+
+class MessageArchiver:
+    def __init__(self, config):
+        self.folder = config["MESSAGE_ARCHIVE_FOLDER"]
+        self.after_days = config["MESSAGE_ARCHIVE_AFTER_DAYS"]
+        self.keep_recent = config["MESSAGE_ARCHIVE_KEEP_RECENT"]
+        self.segment_rows = max(1, config["MESSAGE_ARCHIVE_SEGMENT_ROWS"])
+        self.pause = config["MESSAGE_ARCHIVE_PAUSE"]
+        self.codec = archive_codec(config)
+
+    def run(self, now=None):
+        """Archive every channel; returns ``{"messages": n, "segments": n, "bytes": n, ...}``."""
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        report = {"channels": 0, "messages": 0, "segments": 0, "raw_bytes": 0, "bytes": 0}
+        for channel in Channel.query.order_by(Channel.id.asc()).all():
+            days = self.after_days if channel.archive_after_days is None else channel.archive_after_days
+            if days > 0 and self._archive_channel(channel.id, now - timedelta(days=days), report):
+                report["channels"] += 1
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+    def _hot_from(self, channel_id):
+        """Id of the oldest message that stays hot regardless of age, or None."""
+        return (
+            db.session.query(Message.id)
+            .filter(Message.channel_id == channel_id)
+            .order_by(Message.id.desc())
+            .offset(self.keep_recent - 1)
+            .limit(1)
+            .scalar()
+        )
+
+    def _archive_channel(self, channel_id, cutoff, report):
+        query = Message.query.filter(Message.channel_id == channel_id, Message.created_at < cutoff)
+        if self.keep_recent > 0:
+            hot_from = self._hot_from(channel_id)
+            if hot_from is None:
+                return False
+            query = query.filter(Message.id < hot_from)
+        archived = False
+        while True:
+            rows = query.order_by(Message.id.asc()).limit(self.segment_rows).all()
+            if not rows:
+                return archived
+            month = rows[0].created_at.strftime("%Y-%m")
+            # One segment never spans months, so a month's files hold one id range each.
+            rows = list(takewhile(lambda row: row.created_at.strftime("%Y-%m") == month, rows))
+            segment, path, raw_bytes = _write_segment(self.folder, channel_id, rows, self.codec)
+            try:
+                db.session.add(segment)
+                Message.query.filter(Message.id.in_([row.id for row in rows])).delete(
+                    synchronize_session=False
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                os.remove(path)
+                raise
+            inc("kjb_messages_archived_total", len(rows))
+            report["messages"] += len(rows)
+            report["segments"] += 1
+            report["raw_bytes"] += raw_bytes
+            report["bytes"] += segment.size_bytes
+            archived = True
+            if self.pause:
+                socketio.sleep(self.pause)
+
+
+def run_message_archival(app=None):
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        return MessageArchiver(app.config).run()
+
+
+def drop_channel_archive(channel_id):
+    """Delete a channel's segments; call before committing the channel's deletion.
+
+    Returns the files to remove once the commit went through.
+    """
+    folder = current_app.config["MESSAGE_ARCHIVE_FOLDER"]
+    segments = MessageArchiveSegment.query.filter_by(channel_id=channel_id).all()
+    paths = [os.path.join(folder, segment.path) for segment in segments]
+    for segment in segments:
+        db.session.delete(segment)
+    return paths
+
+
+def remove_segment_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _summary(report):
+    return (
+        f"{report['messages']} messages from {report['channels']} channels into "
+        f"{report['segments']} segments ({report['raw_bytes']} -> {report['bytes']} bytes) "
+        f"in {report['seconds']:.2f}s"
+    )
+
+
+def start_message_archival(app):
+    """Archive old messages every ``MESSAGE_ARCHIVE_INTERVAL`` seconds."""
+    start_periodic(
+        app, "message archival", app.config.get("MESSAGE_ARCHIVE_INTERVAL", 0), run_message_archival, _summary
+    )
+
+
+def init_archive(app):
+    segment_cache.configure(app.config.get("MESSAGE_ARCHIVE_CACHE_SEGMENTS", 16))
+    gauge("kjb_archive_segments_cached", segment_cache.size)
@@ -0,0 +1,116 @@
+"""Content-fingerprinted static asset URLs with immutable caching.
+
+Templates call ``asset_url("js/chat.js")`` and get
+``/static/js/chat.<hash>.js``. The static endpoint maps fingerprinted names
+back to the real file and marks the response ``immutable`` when the hash
+matches the current content. ``flask build-assets`` writes the manifest
+ahead of time so workers don't hash files at boot.
+"""
+import hashlib
+import json
+import os
+import re
+
+from flask import current_app, url_for
+
+
+MANIFEST_NAME = "manifest.json"
+FINGERPRINT_PATTERN = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[A-Za-z0-9]+)$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+FINGERPRINT_EXTENSIONS = (".css", ".js", ".svg", ".png", ".woff2")
+
+_manifest = {}
+_mtimes = {}
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def fingerprinted_name(filename, digest):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{digest}{ext}"
+
+
+def _load_manifest(static_folder):
+    path = os.path.join(static_folder, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return
+    with open(path, encoding="utf-8") as handle:
+        _manifest.update(json.load(handle))
+
+
+def _digest_for(filename):
+    app = current_app
+    path = os.path.join(app.static_folder, filename)
+    digest = _manifest.get(filename)
+    if digest is not None and not app.debug:
+        return digest
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if digest is None or _mtimes.get(filename) != mtime:
+        digest = _manifest[filename] = file_digest(path)
+        _mtimes[filename] = mtime
+    return digest
+
+
+def asset_url(filename):
+    digest = _digest_for(filename)
+    if digest is None:
+        return url_for("static", filename=filename)
+    return url_for("static", filename=fingerprinted_name(filename, digest))
+
+
+def resolve_fingerprint(filename):
+    """Return ``(real_filename, immutable)`` for a requested static path."""
+    match = FINGERPRINT_PATTERN.match(filename)
+    if not match:
+        return filename, False
+    real = match.group("stem") + match.group("ext")
+    if not os.path.isfile(os.path.join(current_app.static_folder, real)):
+        return filename, False
+    # A stale hash (old HTML after a deploy) still gets the current file, but
+    # must not be cached forever under that URL.
+    return real, _digest_for(real) == match.group("hash")
+
+
+def build_manifest(static_folder):
+    manifest = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            if not name.endswith(FINGERPRINT_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            manifest[relative] = file_digest(path)
+    with open(os.path.join(static_folder, MANIFEST_NAME), "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    _manifest.clear()
+    _manifest.update(manifest)
+    return manifest
+
+
+def init_assets(app):
+    _load_manifest(app.static_folder)
+    app.add_template_global(asset_url)
+    static_view = app.view_functions.get("static")
+    if static_view is None:
+        return
+
+    def fingerprinted_static(filename):
+        real, immutable = resolve_fingerprint(filename)
+        response = static_view(real)
+        if immutable:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    app.view_functions["static"] = fingerprinted_static
@@ -0,0 +1,101 @@
+"""Per-worker cache of user display cards.
+
+A card is what the chat needs to draw an author: name, email prefix, avatar
+URL and the active accessory's image and text colour (see
+``sockets.serialize_user_cards``). Building one costs a user lookup and a
+join over accessory permissions, and the same few cards are asked for on
+every page load, online-list update and ``user_cards`` call, so they are
+kept here. Profile edits and accessory permission changes invalidate the
+affected user; with several workers, invalidations are replayed on the
+others over the cluster bus. At most ``USER_CARD_CACHE_SIZE`` cards are
+kept, least recently used first out.
+"""
+from collections import OrderedDict
+
+from .cluster import on_cluster_event, publish
+from .metrics import gauge
+
+
+class UserCardCache:
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._cards = OrderedDict()
+        # Bumped by every invalidation, so a card built from rows read
+        # before it isn't stored afterwards.
+        self.version = 0
+        self._remote = False
+
+    def configure(self, max_entries):
+        self.max_entries = max_entries
+        self._reset()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _replicate(self, op, *args):
+        if not self._remote:
+            publish("cards", op=op, args=args)
+
+    def apply_remote(self, op, args):
+        """Replay an invalidation made on another worker."""
+        if op not in ("invalidate", "clear"):
+            return
+        self._remote = True
+        try:
+            getattr(self, op)(*args)
+        finally:
+            self._remote = False
+
+    def _reset(self):
+        self._cards.clear()
+        self.version += 1
+
+    def clear(self):
+        self._replicate("clear")
+        self._reset()
+
+    def invalidate(self, user_ids):
+        self._replicate("invalidate", list(user_ids))
+        for user_id in user_ids:
+            self._cards.pop(user_id, None)
+        self.version += 1
+
+    def get_many(self, user_ids):
+        """``({user_id: card}, missing_ids)`` for ``user_ids``."""
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            card = self._cards.get(user_id)
+            if card is None:
+                missing.append(user_id)
+            else:
+                self._cards.move_to_end(user_id)
+                found[user_id] = card
+        return found, missing
+
+    def store(self, cards, version):
+        """Keep ``cards`` unless something was invalidated since ``version`` was read."""
+        if version != self.version or not self.enabled:
+            return
+        for card in cards:
+            self._cards[card["id"]] = card
+            self._cards.move_to_end(card["id"])
+        while len(self._cards) > self.max_entries:
+            self._cards.popitem(last=False)
+
+    def size(self):
+        return len(self._cards)
+
+
+user_cards = UserCardCache()
+
+
+@on_cluster_event("cards")
+def _remote_card_change(node, op, args):
+    user_cards.apply_remote(op, args)
+
+
+def init_card_cache(app):
+    user_cards.configure(app.config.get("USER_CARD_CACHE_SIZE", 4096))
+    gauge("kjb_user_cards_cached", user_cards.size)
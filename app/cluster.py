@@ -0,0 +1,166 @@
+"""Running several workers behind one message queue.
+
+With ``SOCKETIO_MESSAGE_QUEUE`` set, every worker subscribes to the same
+queue channel: Socket.IO emits reach clients connected to any worker, and
+the workers use the same channel as a small bus to keep per-worker state in
+step (the recent-message cache and who is online). Bus messages ride next to
+python-socketio's own and are filtered out before its listener sees them.
+
+``WORKER_ID`` (set by ``serve.py``) prefixes every Engine.IO session id so
+the local balancer can route a session's polling requests and its WebSocket
+upgrade back to the worker that owns it.
+"""
+import json
+import pickle
+
+import socketio as python_socketio
+
+from .metrics import inc
+
+BUS_METHOD = "kjb"
+
+_handlers = {}
+_state = {"manager": None, "node": None}
+
+
+def on_cluster_event(kind):
+    """Register ``handler(node, **data)`` for bus messages of ``kind`` from other workers.
+
+    Handlers run in the queue listener greenlet, outside any app context, so
+    they may only touch in-process state.
+    """
+
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+
+    return decorator
+
+
+def publish(kind, **data):
+    """Send ``kind`` to the other workers; a no-op without a message queue."""
+    manager = _state["manager"]
+    if manager is None:
+        return
+    inc("kjb_cluster_events_total", kind=kind, direction="out")
+    manager._publish(
+        {
+            "method": BUS_METHOD,
+            "host_id": manager.host_id,
+            "node": _state["node"],
+            "kind": kind,
+            "data": data,
+        }
+    )
+
+
+def _decode(message):
+    if isinstance(message, dict):
+        return message
+    if isinstance(message, bytes):
+        try:
+            return pickle.loads(message)
+        except Exception:
+            pass
+    try:
+        return json.loads(message)
+    except Exception:
+        return None
+
+
+def _dispatch(message):
+    kind = message.get("kind")
+    handler = _handlers.get(kind)
+    if handler is None:
+        return
+    inc("kjb_cluster_events_total", kind=kind, direction="in")
+    handler(message.get("node"), **(message.get("data") or {}))
+
+
+class _ClusterBusMixin:
+    def initialize(self):
+        super().initialize()
+        self._subscribe_now()
+        # Peers answer with their state, so a restarted worker starts coherent.
+        publish("hello")
+
+    def _subscribe_now(self):
+        """Subscribe before the listener greenlet first runs, where the queue allows it."""
+
+    def _listen(self):
+        for message in super()._listen():
+            data = _decode(message)
+            if not isinstance(data, dict):
+                yield message
+                continue
+            if data.get("method") != BUS_METHOD:
+                # Already decoded; the pubsub thread accepts dicts as they are.
+                yield data
+                continue
+            if data.get("host_id") == self.host_id:
+                continue
+            try:
+                _dispatch(data)
+            except Exception:
+                self.server.logger.exception("Handler error for cluster event %s", data.get("kind"))
+
+
+class ClusterRedisManager(_ClusterBusMixin, python_socketio.RedisManager):
+    def _subscribe_now(self):
+        # The listener subscribes again when it starts (retrying if Redis is
+        # down); replies to our hello wait on this connection meanwhile.
+        try:
+            self.pubsub.subscribe(self.channel)
+        except Exception:
+            self.server.logger.warning("Cannot subscribe to the message queue yet")
+
+
+class ClusterKombuManager(_ClusterBusMixin, python_socketio.KombuManager):
+    pass
+
+
+def client_manager_options(app):
+    """``socketio.init_app`` kwargs for the configured message queue, if any."""
+    url = app.config.get("SOCKETIO_MESSAGE_QUEUE")
+    if not url:
+        return {}
+    if url.startswith(("redis://", "rediss://")):
+        manager_class = ClusterRedisManager
+    else:
+        manager_class = ClusterKombuManager
+    channel = app.config.get("SOCKETIO_CHANNEL", "flask-socketio")
+    return {"client_manager": manager_class(url, channel=channel)}
+
+
+def init_cluster(app, socketio):
+    server = socketio.server
+    manager = server.manager if server is not None else None
+    if isinstance(manager, _ClusterBusMixin):
+        _state["manager"] = manager
+        _state["node"] = app.config.get("WORKER_ID") or manager.host_id
+    else:
+        _state["manager"] = None
+        _state["node"] = app.config.get("WORKER_ID")
+
+    prefix = app.config.get("WORKER_ID")
+    if server is not None and prefix:
+        eio = server.eio
+        generate_id = type(eio).generate_id
+
+        def prefixed_id():
+            return f"{prefix}.{generate_id(eio)}"
+
+        eio.generate_id = prefixed_id
+
+
+def start_cluster(socketio):
+    """Start listening to the queue now rather than on the first connection.
+
+    Bus messages published before the listener runs are lost, so workers
+    call this before warming their caches.
+    """
+    server = socketio.server
+    if _state["manager"] is None or server.manager_initialized:
+        return
+    server.manager_initialized = True
+    server.manager.initialize()
@@ -0,0 +1,96 @@
+"""Flask CLI commands (``flask --app run <command>``)."""
+import os
+
+import click
+
+from .archive import run_message_archival
+from .assets import build_manifest
+from .compression import precompress_static
+from .models import Channel
+from .retention import run_notification_retention
+from .schema import init_database
+from .transfer import export_channel, import_channel, read_checkpoint
+
+
+def register_commands(app):
+    @app.cli.command("init")
+    def init_command():
+        """Migrate the database to the latest revision and seed defaults."""
+        init_database(app)
+        click.echo("database is up to date")
+
+    @app.cli.command("compress-static")
+    def compress_static_command():
+        """Write .gz/.br siblings for static CSS, JS and SVG files."""
+        for path, original, compressed in precompress_static(app.static_folder):
+            click.echo(f"{path}: {original} -> {compressed} bytes")
+
+    @app.cli.command("build-assets")
+    def build_assets_command():
+        """Fingerprint static assets into manifest.json and precompress them."""
+        manifest = build_manifest(app.static_folder)
+        for filename, digest in sorted(manifest.items()):
+            click.echo(f"{filename} -> {digest}")
+        for path, original, compressed in precompress_static(app.static_folder):
+            click.echo(f"{path}: {original} -> {compressed} bytes")
+
+    @app.cli.command("prune-notifications")
+    def prune_notifications_command():
+        """Apply notification retention once and report the rows reclaimed."""
+        report = run_notification_retention(app)
+        click.echo(
+            f"expired {report['expired']}, capped {report['capped']}, "
+            f"compacted {report['compacted']} rows in {report['batches']} batches "
+            f"({report['seconds']:.2f}s); {report['unread_users']} unread counts refreshed"
+        )
+
+    @app.cli.command("archive-messages")
+    def archive_messages_command():
+        """Move old messages into compressed archive segments and report what moved."""
+        report = run_message_archival(app)
+        click.echo(
+            f"archived {report['messages']} messages from {report['channels']} channels into "
+            f"{report['segments']} segments ({report['raw_bytes']} -> {report['bytes']} bytes, "
+            f"{report['seconds']:.2f}s)"
+        )
+
+    def _progress(stats):
+        click.echo(stats.summary(), err=True)
+
+    @app.cli.command("export-channel")
+    @click.argument("slug")
+    @click.option("--output", "-o", type=click.Path(dir_okay=False), required=True, help="NDJSON file to write.")
+    @click.option("--checkpoint", type=click.Path(dir_okay=False), help="Resume from / record progress here.")
+    @click.option("--batch-size", default=5000, show_default=True)
+    def export_channel_command(slug, output, checkpoint, batch_size):
+        """Stream a channel's messages, archived ones included, as NDJSON."""
+        channel = Channel.query.filter_by(slug=slug).first()
+        if channel is None:
+            raise click.ClickException(f"no channel {slug!r}")
+        resuming = read_checkpoint(checkpoint) is not None and os.path.exists(output)
+        with open(output, "r+b" if resuming else "wb") as handle:
+            stats = export_channel(channel, handle, checkpoint, batch_size=batch_size, progress=_progress)
+        click.echo(f"exported {slug}: {stats.summary()}")
+
+    @app.cli.command("import-channel")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--slug", help="Channel to create; defaults to the exported slug.")
+    @click.option("--append", is_flag=True, help="Import into the channel if it already exists.")
+    @click.option("--checkpoint", type=click.Path(dir_okay=False), help="Resume from / record progress here.")
+    @click.option("--batch-size", default=5000, show_default=True)
+    @click.option("--defer-indexes", is_flag=True, help="Drop message indexes during the load (offline only).")
+    def import_channel_command(path, slug, append, checkpoint, batch_size, defer_indexes):
+        """Bulk load an NDJSON channel export."""
+        try:
+            channel, stats = import_channel(
+                path,
+                slug=slug,
+                append=append,
+                checkpoint_path=checkpoint,
+                batch_size=batch_size,
+                defer_indexes=defer_indexes,
+                progress=_progress,
+            )
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+        click.echo(f"imported into {channel.slug}: {stats.summary()}")
@@ -0,0 +1,217 @@
+"""Bounded compression for WebSocket frames, HTTP responses and static files.
+
+* WebSocket: permessage-deflate is negotiated with a capped window size and
+  frames smaller than ``WS_COMPRESSION_THRESHOLD`` bytes are sent raw (the
+  RSV1 bit is per message, so mixing is allowed by RFC 7692).
+* HTTP: HTML/JSON responses are gzip or brotli encoded depending on
+  ``Accept-Encoding``.
+* Static: ``flask compress-static`` writes ``.gz``/``.br`` siblings for CSS
+  and JS; the static endpoint serves them when the client accepts them.
+"""
+import gzip
+import mimetypes
+import os
+import zlib
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+COMPRESSIBLE_MIMETYPES = {"text/html", "application/json", "text/plain", "text/css", "application/javascript"}
+PRECOMPRESS_EXTENSIONS = (".css", ".js", ".svg")
+
+
+def _accepted_encodings():
+    header = request.headers.get("Accept-Encoding", "")
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def choose_encoding(accepted=None):
+    accepted = _accepted_encodings() if accepted is None else accepted
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_bytes(data, encoding, level):
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _compress_response(response):
+    config = current_app.config
+    if not config.get("HTTP_COMPRESSION"):
+        return response
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < config.get("HTTP_COMPRESSION_THRESHOLD", 1024):
+        return response
+    encoding = choose_encoding()
+    response.vary.add("Accept-Encoding")
+    if encoding is None:
+        return response
+    level = config.get("BROTLI_QUALITY", 5) if encoding == "br" else config.get("GZIP_LEVEL", 6)
+    response.set_data(compress_bytes(data, encoding, level))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def _precompressed_static(filename):
+    static_folder = current_app.static_folder
+    max_age = current_app.get_send_file_max_age(filename)
+    encoding = choose_encoding() if filename.endswith(PRECOMPRESS_EXTENSIONS) else None
+    if encoding:
+        source = os.path.join(static_folder, filename)
+        suffix = ".br" if encoding == "br" else ".gz"
+        candidate = source + suffix
+        if (
+            os.path.isfile(source)
+            and os.path.isfile(candidate)
+            and os.path.getmtime(candidate) >= os.path.getmtime(source)
+        ):
+            response = send_from_directory(
+                static_folder,
+                filename + suffix,
+                max_age=max_age,
+                mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            )
+            response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+            return response
+    response = send_from_directory(static_folder, filename, max_age=max_age)
+    if filename.endswith(PRECOMPRESS_EXTENSIONS):
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def precompress_static(static_folder, level=9):
+    """Write ``.gz`` (and ``.br`` when brotli is installed) next to text assets."""
+    written = []
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            if not name.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as handle:
+                data = handle.read()
+            encodings = [("gzip", ".gz", level)]
+            if brotli is not None:
+                encodings.append(("br", ".br", 11))
+            for encoding, suffix, encoding_level in encodings:
+                compressed = compress_bytes(data, encoding, encoding_level)
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, "wb") as handle:
+                    handle.write(compressed)
+                written.append((path + suffix, len(data), len(compressed)))
+    return written
+
+
+def _bounded_websocket_class(base, threshold, level, window_bits, context_takeover):
+    from eventlet import websocket as eventlet_websocket
+
+    class BoundedDeflateWebSocket(eventlet_websocket.RFC6455WebSocket):
+        def _get_permessage_deflate_enc(self):
+            options = self.extensions.get("permessage-deflate")
+            if options is None:
+                return None
+            if options.get("server_no_context_takeover"):
+                return zlib.compressobj(level, zlib.DEFLATED, -options["server_max_window_bits"])
+            if self._deflate_enc is None:
+                self._deflate_enc = zlib.compressobj(
+                    level, zlib.DEFLATED, -options["server_max_window_bits"]
+                )
+            return self._deflate_enc
+
+        def _pack_message(self, message, masked=False, continuation=False, final=True, control_code=None):
+            size = len(message.encode("utf-8") if isinstance(message, str) else message)
+            if size < threshold and "permessage-deflate" in self.extensions:
+                # Send small frames raw; RSV1 is set per message so this is legal.
+                extensions = self.extensions
+                self.extensions = {}
+                try:
+                    return super()._pack_message(message, masked, continuation, final, control_code)
+                finally:
+                    self.extensions = extensions
+            return super()._pack_message(message, masked, continuation, final, control_code)
+
+    class BoundedDeflateWSGI(base):
+        def _negotiate_permessage_deflate(self, extensions):
+            config = super()._negotiate_permessage_deflate(extensions)
+            if config is None:
+                return None
+            # The server may always lower its own window and drop context
+            # takeover; both bound per-connection compressor memory.
+            config["server_max_window_bits"] = min(
+                config.get("server_max_window_bits", window_bits), window_bits
+            )
+            if not context_takeover:
+                config["server_no_context_takeover"] = True
+            return config
+
+        def _handle_hybi_request(self, environ):
+            ws = super()._handle_hybi_request(environ)
+            if isinstance(ws, eventlet_websocket.RFC6455WebSocket):
+                ws.__class__ = BoundedDeflateWebSocket
+            return ws
+
+    return BoundedDeflateWSGI
+
+
+def _disabled_websocket_class(base):
+    class NoDeflateWSGI(base):
+        def _negotiate_permessage_deflate(self, extensions):
+            return None
+
+    return NoDeflateWSGI
+
+
+def init_compression(app, socketio):
+    config = app.config
+    app.after_request(_compress_response)
+    if config.get("PRECOMPRESSED_STATIC") and "static" in app.view_functions:
+        app.view_functions["static"] = _precompressed_static
+
+    server = socketio.server
+    if server is None or server.async_mode != "eventlet":
+        return
+    eio = server.eio
+    base = eio._async.get("websocket")
+    if base is None or getattr(base, "_kjb_compression", False):
+        return
+    if config.get("WS_COMPRESSION"):
+        websocket_class = _bounded_websocket_class(
+            base,
+            threshold=config.get("WS_COMPRESSION_THRESHOLD", 256),
+            level=config.get("WS_COMPRESSION_LEVEL", 6),
+            # zlib cannot produce raw deflate streams with a 256-byte window.
+            window_bits=max(9, min(15, config.get("WS_COMPRESSION_WINDOW_BITS", 12))),
+            context_takeover=config.get("WS_COMPRESSION_CONTEXT_TAKEOVER", True),
+        )
+    else:
+        websocket_class = _disabled_websocket_class(base)
+    websocket_class._kjb_compression = True
+    # engine.io picks its WebSocket implementation from this per-driver table;
+    # copy it so other Server instances keep the stock class.
+    eio._async = dict(eio._async, websocket=websocket_class)
@@ -1,10 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
-from flask_migrate import Migrate
 from flask_socketio import SocketIO
+from .metrics import MeteredJSON
 
 
 db = SQLAlchemy()
 jwt = JWTManager()
-migrate = Migrate()
-socketio = SocketIO(cors_allowed_origins="*")
+socketio = SocketIO(cors_allowed_origins="*", json=MeteredJSON)
@@ -0,0 +1,64 @@
+"""Password hashing off the eventlet hub.
+
+werkzeug's scrypt/pbkdf2 hashing takes tens of milliseconds of CPU. Run
+inline under eventlet it freezes every greenlet in the worker, so socket
+fan-out stalls during a burst of logins. When the Socket.IO server runs on
+eventlet, hashing goes to eventlet's native thread pool instead (hashlib
+releases the GIL while it works). At most ``PASSWORD_HASH_MAX_PENDING``
+hashes may be queued or running; callers past that get
+``PasswordHashingBusy``.
+"""
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .metrics import gauge, observe
+
+_state = {"offload": False, "max_pending": 0, "pending": 0}
+
+
+class PasswordHashingBusy(RuntimeError):
+    """Too many password hashes are already queued; retry shortly."""
+
+
+def _run(func, *args):
+    started = time.perf_counter()
+    if not _state["offload"]:
+        result = func(*args)
+    else:
+        if _state["max_pending"] and _state["pending"] >= _state["max_pending"]:
+            raise PasswordHashingBusy()
+        from eventlet import tpool
+
+        _state["pending"] += 1
+        try:
+            result = tpool.execute(func, *args)
+        finally:
+            _state["pending"] -= 1
+    observe("kjb_password_hash_seconds", time.perf_counter() - started, op=func.__name__)
+    return result
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password)
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def init_password_hashing(app, socketio):
+    server = socketio.server
+    offload = (
+        app.config.get("PASSWORD_HASH_OFFLOAD", True)
+        and server is not None
+        and server.async_mode == "eventlet"
+    )
+    _state["offload"] = offload
+    _state["max_pending"] = app.config.get("PASSWORD_HASH_MAX_PENDING", 32)
+    if offload:
+        from eventlet import tpool
+
+        # Only takes effect before the pool's first use.
+        tpool.set_num_threads(app.config.get("PASSWORD_HASH_THREADS", 4))
+    gauge("kjb_password_hash_pending", lambda: _state["pending"])
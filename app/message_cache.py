@@ -0,0 +1,202 @@
+"""Per-channel ring buffer of recently serialized messages.
+
+Each channel keeps its newest ``RECENT_MESSAGES_PER_CHANNEL`` payloads (the
+compact v2 ``serialize_message`` shape) in id order. A buffer is only used
+once it has been loaded from the database, so it is known to hold the tail
+of the channel with no gaps; after that, sends append to it and edits and
+deletes patch it in place. At most ``RECENT_MESSAGES_MAX_CHANNELS`` channels
+are buffered, least recently used first out.
+
+The cache lives in the worker process, like ``online_users``. When workers
+share a message queue, appends, updates and invalidations are replayed on
+the other workers over the cluster bus.
+"""
+from collections import OrderedDict
+
+from .cluster import on_cluster_event, publish
+from .extensions import db
+from .metrics import gauge
+from .models import Message
+
+
+class _ChannelBuffer:
+    __slots__ = ("entries", "replies")
+
+    def __init__(self):
+        # message id -> (payload, reply_to_id)
+        self.entries = OrderedDict()
+        # reply_to_id -> ids of buffered messages replying to it
+        self.replies = {}
+
+
+class RecentMessageCache:
+    def __init__(self, per_channel=200, max_channels=64):
+        self.per_channel = per_channel
+        self.max_channels = max_channels
+        self._channels = OrderedDict()
+        # channel id -> True once it changed while a load was reading the database
+        self._loading = {}
+        self._remote = False
+
+    def configure(self, per_channel, max_channels):
+        self.per_channel = per_channel
+        self.max_channels = max_channels
+        self._reset()
+
+    @property
+    def enabled(self):
+        return self.per_channel > 0 and self.max_channels > 0
+
+    def _replicate(self, op, *args):
+        if not self._remote:
+            publish("cache", op=op, args=args)
+
+    def apply_remote(self, op, args):
+        """Replay a change another worker made to its cache."""
+        if op not in ("append", "update", "drop", "clear"):
+            return
+        self._remote = True
+        try:
+            getattr(self, op)(*args)
+        finally:
+            self._remote = False
+
+    def _reset(self):
+        self._channels.clear()
+        for channel_id in self._loading:
+            self._loading[channel_id] = True
+
+    def clear(self):
+        self._replicate("clear")
+        self._reset()
+
+    def drop(self, channel_id):
+        self._replicate("drop", channel_id)
+        self._channels.pop(channel_id, None)
+        if channel_id in self._loading:
+            self._loading[channel_id] = True
+
+    def __contains__(self, channel_id):
+        return channel_id in self._channels
+
+    def _get(self, channel_id):
+        buffer = self._channels.get(channel_id)
+        if buffer is not None:
+            self._channels.move_to_end(channel_id)
+        return buffer
+
+    def _store(self, buffer, payload, reply_to_id):
+        message_id = payload["id"]
+        buffer.entries[message_id] = (payload, reply_to_id)
+        if reply_to_id:
+            buffer.replies.setdefault(reply_to_id, set()).add(message_id)
+        while len(buffer.entries) > self.per_channel:
+            dropped_id, (_, dropped_reply_to) = buffer.entries.popitem(last=False)
+            buffer.replies.pop(dropped_id, None)
+            if dropped_reply_to in buffer.replies:
+                buffer.replies[dropped_reply_to].discard(dropped_id)
+
+    def begin_load(self, channel_id):
+        """Call before reading a channel's tail so concurrent writes can void the load."""
+        self._loading[channel_id] = False
+
+    def load(self, channel_id, rows):
+        """Replace a channel's buffer with ``(payload, reply_to_id)`` rows in id order."""
+        if self._loading.pop(channel_id, False) or not self.enabled:
+            return
+        self._channels.pop(channel_id, None)
+        buffer = self._channels[channel_id] = _ChannelBuffer()
+        for payload, reply_to_id in rows:
+            self._store(buffer, payload, reply_to_id)
+        while len(self._channels) > self.max_channels:
+            self._channels.popitem(last=False)
+
+    def append(self, channel_id, payload, reply_to_id=None):
+        self._replicate("append", channel_id, payload, reply_to_id)
+        if channel_id in self._loading:
+            self._loading[channel_id] = True
+        buffer = self._get(channel_id)
+        if buffer is None:
+            return
+        if buffer.entries and payload["id"] <= next(reversed(buffer.entries)):
+            # Out of order: something committed in between that we never saw.
+            self._channels.pop(channel_id, None)
+            return
+        self._store(buffer, payload, reply_to_id)
+
+    def update(self, channel_id, payload, preview=None):
+        """Replace a buffered message; ``preview`` refreshes replies quoting it."""
+        self._replicate("update", channel_id, payload, preview)
+        if channel_id in self._loading:
+            self._loading[channel_id] = True
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            return
+        message_id = payload["id"]
+        entry = buffer.entries.get(message_id)
+        if entry is not None:
+            buffer.entries[message_id] = (payload, entry[1])
+        if preview is None:
+            return
+        for reply_id in buffer.replies.get(message_id, ()):
+            reply_payload, reply_to_id = buffer.entries[reply_id]
+            buffer.entries[reply_id] = (dict(reply_payload, r=preview), reply_to_id)
+
+    def latest(self, channel_id, limit=None):
+        """The newest ``limit`` payloads, oldest first, or None when not buffered."""
+        buffer = self._get(channel_id)
+        if buffer is None:
+            return None
+        payloads = [payload for payload, _ in buffer.entries.values()]
+        if limit is not None:
+            payloads = payloads[-limit:]
+        return payloads
+
+    def since(self, channel_id, last_id):
+        """Payloads newer than ``last_id``, or None if the buffer doesn't reach back that far."""
+        buffer = self._get(channel_id)
+        if buffer is None:
+            return None
+        if len(buffer.entries) >= self.per_channel and next(iter(buffer.entries)) > last_id + 1:
+            return None
+        return [payload for message_id, (payload, _) in buffer.entries.items() if message_id > last_id]
+
+    def size(self):
+        return sum(len(buffer.entries) for buffer in self._channels.values())
+
+
+recent_messages = RecentMessageCache()
+
+
+@on_cluster_event("cache")
+def _remote_cache_change(node, op, args):
+    recent_messages.apply_remote(op, args)
+
+
+def init_message_cache(app):
+    recent_messages.configure(
+        app.config.get("RECENT_MESSAGES_PER_CHANNEL", 200),
+        app.config.get("RECENT_MESSAGES_MAX_CHANNELS", 64),
+    )
+    gauge("kjb_recent_messages_buffered", recent_messages.size)
+
+
+def warm_message_cache(app, channels=None):
+    """Load the most recently active channels; run once per worker before serving."""
+    from .sockets import load_recent_messages
+
+    limit = app.config.get("RECENT_MESSAGES_WARM_CHANNELS", 16) if channels is None else channels
+    if not recent_messages.enabled or limit <= 0:
+        return 0
+    with app.app_context():
+        rows = (
+            db.session.query(Message.channel_id)
+            .group_by(Message.channel_id)
+            .order_by(db.func.max(Message.id).desc())
+            .limit(min(limit, recent_messages.max_channels))
+            .all()
+        )
+        for (channel_id,) in reversed(rows):
+            load_recent_messages(channel_id)
+        db.session.remove()
+    return len(rows)
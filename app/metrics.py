@@ -0,0 +1,261 @@
+"""In-process metrics with a Prometheus text exposition.
+
+Recording is a couple of dict operations per observation; all formatting and
+gauge evaluation happen only when ``/metrics`` is scraped.
+"""
+import json as _json
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_counters = {}
+_histograms = {}
+_gauges = {}
+_help = {}
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = _Histogram(buckets)
+    histogram.observe(value)
+
+
+def gauge(name, callback):
+    """Register ``callback`` to be evaluated at scrape time.
+
+    The callback returns a number or a list of ``(labels_dict, value)`` pairs.
+    """
+    _gauges[name] = callback
+
+
+def reset():
+    _counters.clear()
+    _histograms.clear()
+
+
+def current_handler():
+    if not has_app_context():
+        return "none"
+    return g.get("metrics_handler", "none")
+
+
+def observe_event(name):
+    """Decorator timing a Socket.IO handler and tagging SQL issued inside it."""
+
+    def decorator(handler):
+        label = f"socket:{name}"
+
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            g.metrics_handler = label
+            started = time.perf_counter()
+            status = "ok"
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                observe(
+                    "kjb_handler_latency_seconds",
+                    time.perf_counter() - started,
+                    handler=label,
+                )
+                inc("kjb_handler_calls_total", handler=label, status=status)
+
+        return wrapper
+
+    return decorator
+
+
+class MeteredJSON:
+    """JSON module for Socket.IO that counts encoded packets per event.
+
+    Broadcast packets are encoded once per emit, so byte counts are per emit
+    rather than per recipient.
+    """
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        encoded = _json.dumps(obj, *args, **kwargs)
+        if isinstance(obj, list) and obj and isinstance(obj[0], str):
+            label = obj[0]
+        else:
+            label = "_ack" if isinstance(obj, list) else "_engineio"
+        inc("kjb_socket_emits_total", event=label)
+        inc("kjb_socket_emit_bytes_total", len(encoded), event=label)
+        return encoded
+
+    @staticmethod
+    def loads(*args, **kwargs):
+        return _json.loads(*args, **kwargs)
+
+
+def _before_request():
+    g.metrics_handler = f"http:{request.endpoint}"
+    g.metrics_started = time.perf_counter()
+
+
+def _teardown_request(error=None):
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+    label = g.get("metrics_handler", "none")
+    observe("kjb_handler_latency_seconds", time.perf_counter() - started, handler=label)
+    inc("kjb_handler_calls_total", handler=label, status="error" if error else "ok")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get("metrics_query_start")
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    label = current_handler()
+    inc("kjb_sql_statements_total", handler=label)
+    inc("kjb_sql_seconds_total", elapsed, handler=label)
+
+
+def init_metrics(app, db, socketio):
+    describe("kjb_handler_latency_seconds", "Latency of HTTP routes and Socket.IO handlers.")
+    describe("kjb_handler_calls_total", "Handler invocations by outcome.")
+    describe("kjb_sql_statements_total", "SQL statements executed, by handler.")
+    describe("kjb_sql_seconds_total", "Time spent executing SQL, by handler.")
+    describe("kjb_socket_emits_total", "Socket.IO packets encoded, by event.")
+    describe("kjb_socket_emit_bytes_total", "Encoded Socket.IO payload bytes, by event.")
+    describe("kjb_upload_bytes_total", "Bytes written by file uploads.")
+    describe("kjb_online_users", "Users with at least one live socket.")
+    describe("kjb_socket_rooms", "Live Socket.IO rooms, excluding per-sid rooms.")
+    describe("kjb_recent_messages_buffered", "Serialized messages held in the per-channel ring buffers.")
+    describe("kjb_recent_messages_lookups_total", "First history page lookups served from the ring buffer or not.")
+    describe("kjb_user_cards_cached", "User display cards held in the card cache.")
+    describe("kjb_user_card_lookups_total", "User display cards served from the card cache or built.")
+    describe("kjb_unread_counts_cached", "Per-user unread notification counts held in memory.")
+    describe("kjb_unread_count_lookups_total", "Unread count lookups served from memory or counted.")
+    describe("kjb_notifications_pushed_total", "Notifications pushed to per-user rooms after commit.")
+    describe("kjb_notifications_reclaimed_total", "Notification rows removed by retention, by policy.")
+    describe("kjb_notification_retention_batch_seconds", "Duration of one retention batch, including its commit.")
+    describe("kjb_messages_archived_total", "Messages moved from the messages table into archive segments.")
+    describe("kjb_archive_segment_reads_total", "Archive segment reads served from memory or decoded from disk.")
+    describe("kjb_archive_segments_cached", "Decoded archive segments held in memory.")
+    describe("kjb_duplicate_sends_total", "Retried sends answered with the original message.")
+    describe("kjb_password_hash_seconds", "Password hash and verify latency, including pool queueing.")
+    describe("kjb_password_hash_pending", "Password hashes queued or running in the native thread pool.")
+    describe("kjb_hub_lag_seconds", "How late the event loop woke the watchdog heartbeat.")
+    describe("kjb_hub_stalls_total", "Event-loop stalls over the watchdog threshold, by blocking site.")
+    describe("kjb_cluster_events_total", "Cluster bus messages sent to and received from other workers.")
+    describe("kjb_rate_limited_total", "Socket.IO events refused by the rate limiter, by event and bucket.")
+    describe("kjb_rate_limit_store_errors_total", "User bucket checks that fell back to memory because Redis failed.")
+    describe("kjb_rate_limit_buckets", "Per-connection token buckets held in memory.")
+    describe("kjb_shop_reservations_total", "Shop purchase requests that reserved stock or found the item sold out.")
+    describe("kjb_shop_decisions_total", "Shop requests approved or denied, including those denied for lack of KC.")
+    describe("kjb_shop_decision_batch_seconds", "Time to decide one batch of shop requests, before its commit.")
+
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    def _room_count():
+        server = socketio.server
+        if server is None:
+            return 0
+        rooms = server.manager.rooms.get("/", {})
+        # Every sid sits in a room named after itself; skip those.
+        return sum(1 for name, members in rooms.items() if name is not None and name not in members)
+
+    gauge("kjb_socket_rooms", _room_count)
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in items
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_metrics():
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name in typed:
+            return
+        typed.add(name)
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(_counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), histogram in sorted(_histograms.items(), key=lambda item: item[0]):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+    for name, callback in sorted(_gauges.items()):
+        header(name, "gauge")
+        value = callback()
+        if isinstance(value, list):
+            for labels, sample in value:
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(sample)}")
+        else:
+            lines.append(f"{name} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,6 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from .extensions import db
+from .hashing import hash_password, verify_password
 
 
 class Follow(db.Model):
@@ -15,7 +15,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), unique=True, nullable=False)
     email_prefix = db.Column(db.String(120), unique=True, nullable=False)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
@@ -42,10 +42,10 @@ class User(db.Model):
     )
 
     def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
 
 class Channel(db.Model):
@@ -58,6 +58,8 @@ class Channel(db.Model):
     default_can_view = db.Column(db.Boolean, default=True)
     default_can_read = db.Column(db.Boolean, default=True)
     default_can_send = db.Column(db.Boolean, default=True)
+    # Days before messages move to the archive; None uses MESSAGE_ARCHIVE_AFTER_DAYS, 0 never.
+    archive_after_days = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
@@ -71,6 +73,10 @@ class ChannelPermission(db.Model):
     can_send = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("uq_channel_permissions_channel_user", "channel_id", "user_id", unique=True),
+    )
+
     channel = db.relationship("Channel")
     user = db.relationship("User")
 
@@ -81,13 +87,51 @@ class Message(db.Model):
     channel_id = db.Column(db.Integer, db.ForeignKey("channels.id"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    reply_to_id = db.Column(db.Integer, db.ForeignKey("messages.id"))
+    # No foreign key: replies keep pointing at messages that have been archived.
+    reply_to_id = db.Column(db.Integer)
     is_deleted = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=True, onupdate=datetime.utcnow)
+    client_id = db.Column(db.String(64), nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_messages_channel_id_id", "channel_id", "id"),
+        db.Index("uq_messages_user_client_id", "user_id", "client_id", unique=True),
+        db.Index("ix_messages_channel_id_updated_at", "channel_id", "updated_at"),
+        db.Index("ix_messages_reply_to_id", "reply_to_id"),
+        # Archived ids must never be handed out again (see archive.py).
+        {"sqlite_autoincrement": True},
+    )
 
     user = db.relationship("User", backref="messages")
-    reply_to = db.relationship("Message", remote_side=[id])
+    reply_to = db.relationship(
+        "Message", primaryjoin="Message.reply_to_id == Message.id", foreign_keys=[reply_to_id], remote_side=[id]
+    )
+
+
+class MessageArchiveSegment(db.Model):
+    """One compressed file of archived messages from a channel and month."""
+
+    __tablename__ = "message_archive_segments"
+    id = db.Column(db.Integer, primary_key=True)
+    channel_id = db.Column(db.Integer, db.ForeignKey("channels.id"), nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    first_created_at = db.Column(db.DateTime, nullable=False)
+    last_created_at = db.Column(db.DateTime, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    # Relative to MESSAGE_ARCHIVE_FOLDER.
+    path = db.Column(db.String(255), nullable=False)
+    codec = db.Column(db.String(16), nullable=False)
+    size_bytes = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # History pages walk a channel's segments newest first; id lookups
+        # find the segment whose range holds an id.
+        db.Index("ix_message_archive_segments_channel_id_last_id", "channel_id", "last_id"),
+        db.Index("ix_message_archive_segments_first_id_last_id", "first_id", "last_id"),
+    )
 
 
 class UserChannelRead(db.Model):
@@ -168,6 +212,16 @@ class Notification(db.Model):
     body = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
+    # How many notifications retention compaction folded into this one.
+    merged_count = db.Column(db.Integer, default=1, server_default="1", nullable=False)
+
+    __table_args__ = (
+        # Mailbox pages (newest id first) and unread counts.
+        db.Index("ix_notifications_user_id_id", "user_id", "id"),
+        db.Index("ix_notifications_user_id_is_read", "user_id", "is_read"),
+        # Retention expiry.
+        db.Index("ix_notifications_created_at", "created_at"),
+    )
 
 
 class KCLog(db.Model):
@@ -0,0 +1,189 @@
+"""Notification push, unread counters and mailbox pages.
+
+``utils.notify`` only adds a row to the session. Once the surrounding
+transaction commits, each new notification is pushed to its owner's
+per-user Socket.IO room (joined on connect) together with the new unread
+count, so open pages update their badge without polling. Nothing is pushed
+for a rolled-back transaction.
+
+Unread counts are cached per worker. A cached count is bumped by pushes and
+dropped whenever notifications are read or deleted, and with several
+workers those changes are replayed on the others over the cluster bus. The
+mailbox is paged by id (newest first) with ``before`` as the cursor.
+"""
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from .cluster import on_cluster_event, publish
+from .extensions import socketio
+from .metrics import gauge, inc
+from .models import Notification
+from .utils import to_epoch
+
+_PENDING_KEY = "kjb_pending_notifications"
+_FLUSHED_KEY = "kjb_flushed_notifications"
+
+
+def notification_room(user_id):
+    return f"user:{user_id}"
+
+
+def serialize_notification(notification):
+    return {
+        "id": notification.id,
+        "t": notification.title,
+        "b": notification.body,
+        "ts": to_epoch(notification.created_at),
+        "rd": 1 if notification.is_read else 0,
+        "c": notification.merged_count or 1,
+    }
+
+
+class UnreadCounts:
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        # Bumped by every change, so a count read before it isn't stored after.
+        self.version = 0
+        self._remote = False
+
+    def configure(self, max_entries):
+        self.max_entries = max_entries
+        self._counts.clear()
+        self.version += 1
+
+    def _replicate(self, op, *args):
+        if not self._remote:
+            publish("unread", op=op, args=args)
+
+    def apply_remote(self, op, args):
+        """Replay a change another worker made to its counts."""
+        if op not in ("bump", "drop"):
+            return
+        self._remote = True
+        try:
+            getattr(self, op)(*args)
+        finally:
+            self._remote = False
+
+    def get(self, user_id):
+        count = self._counts.get(user_id)
+        if count is not None:
+            self._counts.move_to_end(user_id)
+        return count
+
+    def store(self, user_id, count, version):
+        if version != self.version or self.max_entries <= 0:
+            return
+        self._counts[user_id] = count
+        while len(self._counts) > self.max_entries:
+            self._counts.popitem(last=False)
+
+    def bump(self, user_id, amount=1):
+        """Add to a cached count; returns the new count or None if not cached."""
+        self._replicate("bump", user_id, amount)
+        self.version += 1
+        if user_id not in self._counts:
+            return None
+        self._counts[user_id] += amount
+        return self._counts[user_id]
+
+    def drop(self, user_id):
+        self._replicate("drop", user_id)
+        self.version += 1
+        self._counts.pop(user_id, None)
+
+    def size(self):
+        return len(self._counts)
+
+
+unread_counts = UnreadCounts()
+
+
+@on_cluster_event("unread")
+def _remote_unread_change(node, op, args):
+    unread_counts.apply_remote(op, args)
+
+
+def unread_count(user_id):
+    count = unread_counts.get(user_id)
+    inc("kjb_unread_count_lookups_total", result="miss" if count is None else "hit")
+    if count is None:
+        version = unread_counts.version
+        count = Notification.query.filter_by(user_id=user_id, is_read=False).count()
+        unread_counts.store(user_id, count, version)
+    return count
+
+
+def track_notification(session, notification):
+    """Push ``notification`` to its owner once ``session`` commits."""
+    session.info.setdefault(_PENDING_KEY, []).append(notification)
+
+
+def _after_flush_postexec(session, flush_context):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        # Ids and defaults are filled in now; after commit the rows are expired.
+        session.info.setdefault(_FLUSHED_KEY, []).extend(
+            (notification.user_id, serialize_notification(notification))
+            for notification in pending
+            if notification.id is not None
+        )
+
+
+def _after_commit(session):
+    flushed = session.info.pop(_FLUSHED_KEY, None)
+    session.info.pop(_PENDING_KEY, None)
+    for user_id, payload in flushed or ():
+        _push(user_id, payload)
+
+
+def _after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_FLUSHED_KEY, None)
+
+
+def _push(user_id, payload):
+    unread = unread_counts.bump(user_id)
+    inc("kjb_notifications_pushed_total")
+    socketio.emit("notification", {"n": payload, "unread": unread}, to=notification_room(user_id))
+
+
+def push_unread_count(user_id):
+    """Tell the user's open pages their unread count after reads or deletes."""
+    unread_counts.drop(user_id)
+    socketio.emit("notification_count", {"unread": unread_count(user_id)}, to=notification_room(user_id))
+
+
+def mailbox_page(user_id, before=None, limit=30):
+    """Newest-first notifications older than id ``before``; returns ``(rows, next_before)``."""
+    query = Notification.query.filter(Notification.user_id == user_id)
+    if before is not None:
+        query = query.filter(Notification.id < before)
+    rows = query.order_by(Notification.id.desc()).limit(limit + 1).all()
+    next_before = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_before
+
+
+def mark_read(user_id, notification_ids):
+    """Mark exactly the user's notifications in ``notification_ids`` read; returns rows changed.
+
+    Only the ids a page showed: older unread notifications on later pages
+    stay unread until they are seen.
+    """
+    return Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.id.in_(list(notification_ids)),
+        Notification.is_read.is_(False),
+    ).update({"is_read": True}, synchronize_session=False)
+
+
+def init_notifications(app, db):
+    unread_counts.configure(app.config.get("UNREAD_COUNT_CACHE_SIZE", 4096))
+    session = db.session
+    if not event.contains(session, "after_commit", _after_commit):
+        event.listen(session, "after_flush_postexec", _after_flush_postexec)
+        event.listen(session, "after_commit", _after_commit)
+        event.listen(session, "after_rollback", _after_rollback)
+    gauge("kjb_unread_counts_cached", unread_counts.size)
@@ -0,0 +1,23 @@
+"""Maintenance jobs repeated in a background greenlet.
+
+Jobs run inside their own app context, so the session (and any transaction
+a failed run left open) is discarded between runs. ``serve.py`` starts
+them on its first worker only.
+"""
+from .extensions import socketio
+
+
+def _loop(app, name, interval, job, summary):
+    while True:
+        try:
+            report = job(app)
+            app.logger.info("%s: %s", name, summary(report))
+        except Exception:
+            app.logger.exception("%s failed", name)
+        socketio.sleep(interval)
+
+
+def start_periodic(app, name, interval, job, summary=str):
+    """Run ``job(app)`` now and every ``interval`` seconds; a no-op when ``interval`` is 0."""
+    if interval > 0:
+        socketio.start_background_task(_loop, app, name, interval, job, summary)
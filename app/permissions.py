@@ -0,0 +1,270 @@
+"""Bulk emoji, accessory and channel permission changes.
+
+Onboarding a cohort one admin form per (user, item) pair means thousands of
+POSTs, each a select-then-insert followed by a full admin page render. Here
+a batch of rows, from the JSON API or an uploaded CSV, is applied in one
+transaction with set-based statements per kind: grants are
+``INSERT ... ON CONFLICT`` upserts and revokes are one ``DELETE ... WHERE
+(user_id, target_id) IN (...)``, each sent ``BATCH_ROWS`` rows at a time to
+stay under the database's bound-parameter limit.
+
+A row is ``action`` (``grant`` or ``revoke``), ``kind`` (``emoji``,
+``accessory`` or ``channel``), ``user`` (email prefix) and ``target`` (emoji
+name, accessory name or channel slug). Channel grants also take
+``can_view``, ``can_read`` and ``can_send``, and accessory grants take
+``active``; omitted flags default as in the single-row admin forms. When a
+batch names the same pair twice, the last row wins. Rows that don't resolve
+are reported with their line and skipped, with messages in Korean since the
+admin page flashes them as they are.
+
+``granted`` and ``revoked`` count rows the database actually changed: an
+upsert only touches a row whose flags differ, so applying the same batch
+twice reports nothing granted the second time.
+
+Caches are refreshed once per batch after the commit: rendered messages
+when emoji grants change, user cards of the users whose accessories
+changed, and the tier rooms of the channels and users touched.
+"""
+import csv
+import io
+from datetime import datetime
+
+from sqlalchemy import or_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .extensions import db
+from .message_cache import recent_messages
+from .models import (
+    Accessory,
+    Channel,
+    ChannelPermission,
+    Emoji,
+    User,
+    UserAccessoryPermission,
+    UserEmojiPermission,
+)
+from .sockets import refresh_channel_rooms, refresh_user_cards
+
+ACTIONS = ("grant", "revoke")
+KINDS = ("emoji", "accessory", "channel")
+CSV_COLUMNS = ("action", "kind", "user", "target", "can_view", "can_read", "can_send", "active")
+CHANNEL_FLAGS = ("can_view", "can_read", "can_send")
+# With their object particle, for "... 찾을 수 없습니다" errors.
+KIND_LABELS = {"emoji": "이모지를", "accessory": "액세서리를", "channel": "채널을"}
+BATCH_ROWS = 500
+
+_TRUE = {"1", "true", "yes", "y", "on"}
+_FALSE = {"0", "false", "no", "n", "off"}
+_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def _chunks(values, size=BATCH_ROWS):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def _flag(value, default):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if not text:
+        return default
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"예/아니오 값이 아닙니다: {value!r}")
+
+
+def _lookup(column, keys):
+    """``{key: row}`` for the rows whose ``column`` is among ``keys``."""
+    found = {}
+    for chunk in _chunks(set(keys)):
+        for row in column.class_.query.filter(column.in_(chunk)):
+            found[getattr(row, column.key)] = row
+    return found
+
+
+def _upsert(model, rows, index_elements, update_columns=()):
+    """Insert ``rows``, updating ``update_columns`` (or nothing) where the key already exists.
+
+    Existing rows are only updated when one of ``update_columns`` differs.
+    Returns how many rows were inserted or updated.
+    """
+    insert = _INSERTS.get(db.engine.dialect.name)
+    if insert is None:
+        raise RuntimeError(f"bulk permission upserts need SQLite or PostgreSQL, not {db.engine.dialect.name}")
+    changed = 0
+    for chunk in _chunks(rows):
+        statement = insert(model).values(chunk)
+        if update_columns:
+            statement = statement.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={column: statement.excluded[column] for column in update_columns},
+                where=or_(*(model.__table__.c[column] != statement.excluded[column] for column in update_columns)),
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+        changed += db.session.execute(statement).rowcount
+    return changed
+
+
+def _delete_pairs(user_column, target_column, pairs):
+    removed = 0
+    for chunk in _chunks(pairs):
+        removed += (
+            user_column.class_.query.filter(tuple_(user_column, target_column).in_(chunk))
+            .delete(synchronize_session=False)
+        )
+    return removed
+
+
+def parse_permission_csv(stream):
+    """``[(line, row)]`` from a CSV upload with a ``CSV_COLUMNS`` header; raises ValueError."""
+    text = stream.read()
+    if isinstance(text, bytes):
+        text = text.decode("utf-8-sig")
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {"action", "kind", "user", "target"} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"CSV 헤더에 {', '.join(sorted(missing))} 열이 없습니다")
+    return [(reader.line_num, row) for row in reader]
+
+
+def apply_permission_rows(rows):
+    """Apply ``[(line, row)]`` in one transaction and refresh caches; returns a report.
+
+    The report is ``{"granted": n, "revoked": n, "errors": [[line, message]]}``.
+    """
+    errors = []
+    wanted = {kind: [] for kind in KINDS}
+    for line, row in rows:
+        action = str(row.get("action") or "").strip().lower()
+        kind = str(row.get("kind") or "").strip().lower()
+        user = str(row.get("user") or "").strip()
+        target = str(row.get("target") or "").strip()
+        if action not in ACTIONS:
+            errors.append([line, f"알 수 없는 작업입니다: {action!r}"])
+        elif kind not in KINDS:
+            errors.append([line, f"알 수 없는 종류입니다: {kind!r}"])
+        elif not user or not target:
+            errors.append([line, "사용자와 대상을 입력해주세요"])
+        else:
+            try:
+                flags = {name: _flag(row.get(name), True) for name in CHANNEL_FLAGS}
+                flags["active"] = _flag(row.get("active"), False)
+            except ValueError as exc:
+                errors.append([line, str(exc)])
+                continue
+            wanted[kind].append((line, action, user, target, flags))
+
+    users = _lookup(User.email_prefix, (entry[2] for entries in wanted.values() for entry in entries))
+    targets = {
+        "emoji": _lookup(Emoji.name, (entry[3] for entry in wanted["emoji"])),
+        "accessory": _lookup(Accessory.name, (entry[3] for entry in wanted["accessory"])),
+        "channel": _lookup(Channel.slug, (entry[3] for entry in wanted["channel"])),
+    }
+    # (user id, target id) -> (action, flags) in the order of each pair's last
+    # row, so the last row for a pair wins.
+    changes = {kind: {} for kind in KINDS}
+    for kind, entries in wanted.items():
+        for line, action, user, target, flags in entries:
+            if user not in users:
+                errors.append([line, f"사용자를 찾을 수 없습니다: {user!r}"])
+            elif target not in targets[kind]:
+                errors.append([line, f"{KIND_LABELS[kind]} 찾을 수 없습니다: {target!r}"])
+            else:
+                pair = (users[user].id, targets[kind][target].id)
+                changes[kind].pop(pair, None)
+                changes[kind][pair] = (action, flags)
+
+    now = datetime.utcnow()
+    granted = revoked = 0
+
+    emoji_grants = [pair for pair, (action, _) in changes["emoji"].items() if action == "grant"]
+    granted += _upsert(
+        UserEmojiPermission,
+        [{"user_id": user_id, "emoji_id": emoji_id, "created_at": now} for user_id, emoji_id in emoji_grants],
+        ["user_id", "emoji_id"],
+    )
+    revoked += _delete_pairs(
+        UserEmojiPermission.user_id,
+        UserEmojiPermission.emoji_id,
+        [pair for pair, (action, _) in changes["emoji"].items() if action == "revoke"],
+    )
+
+    accessory_grants = [(pair, flags) for pair, (action, flags) in changes["accessory"].items() if action == "grant"]
+    # Only one accessory is worn at a time: the last activation for a user wins.
+    activations = {user_id: accessory_id for (user_id, accessory_id), flags in accessory_grants if flags["active"]}
+    granted += _upsert(
+        UserAccessoryPermission,
+        [
+            {"user_id": user_id, "accessory_id": accessory_id, "is_active": False, "created_at": now}
+            for (user_id, accessory_id), _ in accessory_grants
+            if activations.get(user_id) != accessory_id
+        ],
+        ["user_id", "accessory_id"],
+    )
+    # Take off whatever else they wear; the one being activated is left alone
+    # so that re-applying a batch changes nothing.
+    for chunk in _chunks(activations.items()):
+        UserAccessoryPermission.query.filter(
+            UserAccessoryPermission.user_id.in_([user_id for user_id, _ in chunk]),
+            UserAccessoryPermission.is_active.is_(True),
+            tuple_(UserAccessoryPermission.user_id, UserAccessoryPermission.accessory_id).notin_(chunk),
+        ).update({"is_active": False}, synchronize_session=False)
+    granted += _upsert(
+        UserAccessoryPermission,
+        [
+            {"user_id": user_id, "accessory_id": accessory_id, "is_active": True, "created_at": now}
+            for user_id, accessory_id in activations.items()
+        ],
+        ["user_id", "accessory_id"],
+        update_columns=["is_active"],
+    )
+    revoked += _delete_pairs(
+        UserAccessoryPermission.user_id,
+        UserAccessoryPermission.accessory_id,
+        [pair for pair, (action, _) in changes["accessory"].items() if action == "revoke"],
+    )
+
+    channel_grants = [(pair, flags) for pair, (action, flags) in changes["channel"].items() if action == "grant"]
+    granted += _upsert(
+        ChannelPermission,
+        [
+            {
+                "user_id": user_id,
+                "channel_id": channel_id,
+                "created_at": now,
+                **{name: flags[name] for name in CHANNEL_FLAGS},
+            }
+            for (user_id, channel_id), flags in channel_grants
+        ],
+        ["channel_id", "user_id"],
+        update_columns=CHANNEL_FLAGS,
+    )
+    revoked += _delete_pairs(
+        ChannelPermission.user_id,
+        ChannelPermission.channel_id,
+        [pair for pair, (action, _) in changes["channel"].items() if action == "revoke"],
+    )
+
+    db.session.commit()
+    _refresh(changes, targets["channel"])
+    return {"granted": granted, "revoked": revoked, "errors": sorted(errors)}
+
+
+def _refresh(changes, channels_by_slug):
+    if changes["emoji"]:
+        recent_messages.clear()
+    if changes["accessory"]:
+        refresh_user_cards(user_id for user_id, _ in changes["accessory"])
+    if changes["channel"]:
+        channel_ids = {channel_id for _, channel_id in changes["channel"]}
+        refresh_channel_rooms(
+            [channel for channel in channels_by_slug.values() if channel.id in channel_ids],
+            {user_id for user_id, _ in changes["channel"]},
+        )
@@ -0,0 +1,197 @@
+"""Per-request SQL tracking, N+1 detection and query budgets.
+
+Every statement issued while an HTTP request or Socket.IO event is being
+handled is recorded on ``g``. When the request context tears down the
+statements are grouped by shape (literal values and expanded ``IN`` lists
+collapsed), repeated shapes are flagged as likely N+1 patterns and the total
+is checked against ``QUERY_BUDGETS``. In debug mode a report with the
+``EXPLAIN QUERY PLAN`` of the slowest statements is logged.
+
+Tests can use :func:`query_budget` directly::
+
+    with query_budget(8) as tracker:
+        client.get("/chat?id=general")
+    assert not tracker.repeated()
+"""
+import re
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+
+_IN_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_POSTCOMPILE = re.compile(r"\(?__\[POSTCOMPILE_\w+\]\)?")
+_NUMBER = re.compile(r"\b\d+\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_WHITESPACE = re.compile(r"\s+")
+
+_collectors = []
+_explaining = False
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def statement_shape(statement):
+    shape = _STRING.sub("?", statement)
+    shape = _POSTCOMPILE.sub("(?)", shape)
+    shape = _IN_LIST.sub("(?)", shape)
+    shape = _NUMBER.sub("?", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class QueryTracker:
+    def __init__(self, label=None):
+        self.label = label
+        self.queries = []
+
+    def record(self, statement, parameters, elapsed):
+        self.queries.append((statement, parameters, elapsed))
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(elapsed for _, _, elapsed in self.queries)
+
+    def shapes(self):
+        counts = {}
+        for statement, _, _ in self.queries:
+            shape = statement_shape(statement)
+            counts[shape] = counts.get(shape, 0) + 1
+        return counts
+
+    def repeated(self, threshold=3):
+        return {shape: count for shape, count in self.shapes().items() if count >= threshold}
+
+    def slowest(self, limit=3):
+        return sorted(self.queries, key=lambda query: query[2], reverse=True)[:limit]
+
+
+@contextmanager
+def query_budget(max_queries=None, max_repeats=None):
+    """Collect statements issued inside the block and enforce limits on exit."""
+    tracker = QueryTracker("budget")
+    _collectors.append(tracker)
+    try:
+        yield tracker
+    finally:
+        _collectors.remove(tracker)
+    if max_queries is not None and len(tracker) > max_queries:
+        raise QueryBudgetExceeded(
+            f"{len(tracker)} queries issued, budget is {max_queries}:\n"
+            + "\n".join(statement for statement, _, _ in tracker.queries)
+        )
+    if max_repeats is not None:
+        repeated = tracker.repeated(max_repeats + 1)
+        if repeated:
+            raise QueryBudgetExceeded(
+                "repeated statements (possible N+1):\n"
+                + "\n".join(f"{count}x {shape}" for shape, count in repeated.items())
+            )
+
+
+def handler_label():
+    """``socket:<event>`` inside a Socket.IO handler, else ``http:<endpoint>``.
+
+    Worked out here rather than taken from the metrics hooks, which are only
+    installed when metrics are enabled; ``observe_event`` wraps every socket
+    handler either way.
+    """
+    label = g.get("metrics_handler") if has_app_context() else None
+    if label and label.startswith("socket:"):
+        return label
+    if has_request_context() and request.endpoint:
+        return f"http:{request.endpoint}"
+    return "none"
+
+
+def _request_tracker():
+    if not has_app_context() or not current_app.config.get("QUERY_TRACKING"):
+        return None
+    tracker = g.get("query_tracker")
+    if tracker is None:
+        tracker = g.query_tracker = QueryTracker()
+    return tracker
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _explaining:
+        return
+    conn.info.setdefault("querytrack_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _explaining:
+        return
+    stack = conn.info.get("querytrack_start")
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    for collector in _collectors:
+        collector.record(statement, parameters, elapsed)
+    tracker = _request_tracker()
+    if tracker is not None:
+        tracker.record(statement, parameters, elapsed)
+
+
+def _explain(engine, statement, parameters):
+    global _explaining
+    if engine.dialect.name != "sqlite":
+        return []
+    _explaining = True
+    try:
+        with engine.connect() as conn:
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        return [row[-1] for row in rows]
+    except Exception as exc:
+        return [f"(explain failed: {exc})"]
+    finally:
+        _explaining = False
+
+
+def _teardown(error=None):
+    tracker = g.pop("query_tracker", None)
+    if tracker is None or not tracker.queries:
+        return
+    app = current_app._get_current_object()
+    label = handler_label()
+    threshold = app.config.get("QUERY_REPEAT_THRESHOLD", 3)
+    repeated = tracker.repeated(threshold)
+    budgets = app.config.get("QUERY_BUDGETS") or {}
+    budget = budgets.get(label, app.config.get("QUERY_BUDGET_DEFAULT"))
+    over_budget = budget is not None and len(tracker) > budget
+
+    if repeated or over_budget:
+        app.logger.warning(
+            "%s issued %d queries%s; repeated: %s",
+            label,
+            len(tracker),
+            f" (budget {budget})" if budget is not None else "",
+            "; ".join(f"{count}x {shape[:120]}" for shape, count in repeated.items()) or "none",
+        )
+    if app.debug:
+        from .extensions import db
+
+        lines = [f"{label}: {len(tracker)} queries in {tracker.total_time * 1000:.1f}ms"]
+        for statement, parameters, elapsed in tracker.slowest():
+            lines.append(f"  {elapsed * 1000:.2f}ms {_WHITESPACE.sub(' ', statement)[:200]}")
+            for step in _explain(db.engine, statement, parameters):
+                lines.append(f"      plan: {step}")
+        app.logger.debug("\n".join(lines))
+    if over_budget and app.config.get("QUERY_BUDGET_STRICT"):
+        raise QueryBudgetExceeded(f"{label} issued {len(tracker)} queries, budget is {budget}")
+
+
+def init_query_tracking(app, db):
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    if app.config.get("QUERY_TRACKING"):
+        app.teardown_request(_teardown)
@@ -0,0 +1,230 @@
+"""Token-bucket rate limits on Socket.IO events.
+
+Every limited event costs ``RATE_LIMIT_COSTS[event]`` tokens (times the
+number of messages for ``send_messages``), taken from two buckets:
+
+* the connection's, refilled at ``RATE_LIMIT_CONNECTION_RATE`` tokens a
+  second up to ``RATE_LIMIT_CONNECTION_BURST``. A connection lives on one
+  worker, so these stay in process memory and are dropped on disconnect;
+* the user's, refilled at ``RATE_LIMIT_USER_RATE`` up to
+  ``RATE_LIMIT_USER_BURST`` and shared by all of a user's tabs. With a Redis
+  ``RATE_LIMIT_STORE`` (by default the Redis message queue, if that is what
+  ``SOCKETIO_MESSAGE_QUEUE`` points at) they live in Redis and are updated
+  by one script call, so every worker sees the same bucket; otherwise they
+  are per worker.
+
+The connection bucket is checked first, so a flooding socket is turned away
+without a round trip to Redis. A refused event is answered with
+``{"ok": False, "retry_after": seconds}`` and its handler doesn't run. A
+connection refused ``RATE_LIMIT_DISCONNECT_AFTER`` times in a row is
+disconnected. If Redis can't be reached, user buckets fall back to the
+worker's memory, and Redis is tried again every few seconds.
+"""
+import time
+from functools import wraps
+
+from flask import request, session
+from flask_socketio import disconnect
+
+from .metrics import gauge, inc
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+RATE_LIMITED_ERROR = "요청이 너무 많습니다. 잠시 후 다시 시도해주세요."
+# How long user buckets stay in memory after Redis fails.
+STORE_RETRY_SECONDS = 5.0
+
+# KEYS[1] bucket; ARGV rate, burst, cost. Returns the wait in seconds as a
+# string (Lua numbers come back truncated to integers), "0" when taken.
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = burst
+else
+  tokens = math.min(burst, tokens + math.max(0, now - tonumber(state[2])) * rate)
+end
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class MemoryBuckets:
+    """Token buckets in a dict; full ones are swept out now and then."""
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        # key -> (tokens, updated at, full again at)
+        self._buckets = {}
+        self._swept = clock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, rate, burst, cost):
+        """Take ``cost`` tokens; returns 0.0, or how long until they would be there."""
+        now = self.clock()
+        state = self._buckets.get(key)
+        tokens = burst if state is None else min(burst, state[0] + (now - state[1]) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        if now - self._swept > self.SWEEP_INTERVAL:
+            self._sweep(now)
+        return wait
+
+    def forget(self, key):
+        self._buckets.pop(key, None)
+
+    def _sweep(self, now):
+        self._swept = now
+        # A full bucket is the same as no bucket.
+        for key in [key for key, state in self._buckets.items() if state[2] <= now]:
+            del self._buckets[key]
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker, one hash per key in Redis."""
+
+    def __init__(self, url, prefix="kjb:rl:"):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost):
+        return float(self._take(keys=[self.prefix + key], args=[rate, burst, cost]))
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = False
+        self.costs = {}
+        self.user_rate = self.user_burst = 0
+        self.connection_rate = self.connection_burst = 0
+        self.disconnect_after = 0
+        self.connections = MemoryBuckets()
+        self.users = self.fallback = MemoryBuckets()
+        self._refused = {}
+        self._store_retry_at = 0.0
+
+    def configure(self, config):
+        self.enabled = config["RATE_LIMIT_ENABLED"]
+        self.costs = dict(config["RATE_LIMIT_COSTS"])
+        self.user_rate = config["RATE_LIMIT_USER_RATE"]
+        self.user_burst = config["RATE_LIMIT_USER_BURST"]
+        self.connection_rate = config["RATE_LIMIT_CONNECTION_RATE"]
+        self.connection_burst = config["RATE_LIMIT_CONNECTION_BURST"]
+        self.disconnect_after = config["RATE_LIMIT_DISCONNECT_AFTER"]
+        self.connections = MemoryBuckets()
+        self.users = self.fallback = MemoryBuckets()
+        self._refused = {}
+        self._store_retry_at = 0.0
+        url = rate_limit_store_url(config)
+        if self.enabled and url:
+            if redis is None:
+                raise RuntimeError("RATE_LIMIT_STORE needs the redis package")
+            self.users = RedisBuckets(url)
+
+    def check(self, event, user_id, sid, weight=1):
+        """Charge ``event`` to the connection and the user; returns 0.0 or seconds to wait."""
+        cost = self.costs.get(event, 0) * weight
+        if not self.enabled or cost <= 0:
+            return 0.0
+        wait = 0.0
+        if sid and self.connection_rate > 0:
+            wait = self.connections.take(
+                sid, self.connection_rate, self.connection_burst, min(cost, self.connection_burst)
+            )
+            scope = "connection"
+        if not wait and user_id and self.user_rate > 0:
+            wait = self._take_user(user_id, min(cost, self.user_burst))
+            scope = "user"
+        if wait:
+            inc("kjb_rate_limited_total", event=event, scope=scope)
+            if sid:
+                self._refused[sid] = self._refused.get(sid, 0) + 1
+        elif sid in self._refused:
+            del self._refused[sid]
+        return wait
+
+    def _take_user(self, user_id, cost):
+        key = f"user:{user_id}"
+        if self.users is not self.fallback and time.monotonic() >= self._store_retry_at:
+            try:
+                return self.users.take(key, self.user_rate, self.user_burst, cost)
+            except Exception:
+                # Don't wait on a dead Redis for every event; try again later.
+                self._store_retry_at = time.monotonic() + STORE_RETRY_SECONDS
+                inc("kjb_rate_limit_store_errors_total")
+        return self.fallback.take(key, self.user_rate, self.user_burst, cost)
+
+    def flooding(self, sid):
+        return 0 < self.disconnect_after <= self._refused.get(sid, 0)
+
+    def forget_connection(self, sid):
+        self.connections.forget(sid)
+        self._refused.pop(sid, None)
+
+
+rate_limiter = RateLimiter()
+
+
+def rate_limit_store_url(config):
+    """The Redis URL user buckets are kept at, or None to keep them per worker."""
+    store = config.get("RATE_LIMIT_STORE")
+    if store is None:
+        store = config.get("SOCKETIO_MESSAGE_QUEUE") or ""
+    if store.startswith(("redis://", "rediss://", "unix://")):
+        return store
+    return None
+
+
+def rate_limited(event, weight=None):
+    """Decorator refusing a Socket.IO handler's call when its buckets are empty.
+
+    ``weight(data)`` multiplies the event's cost, for events carrying
+    several items.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            if rate_limiter.enabled:
+                units = 1
+                if weight is not None:
+                    units = weight(args[0] if args else None)
+                wait = rate_limiter.check(event, session.get("user_id"), request.sid, units)
+                if wait:
+                    if rate_limiter.flooding(request.sid):
+                        disconnect()
+                    return {"ok": False, "error": RATE_LIMITED_ERROR, "retry_after": round(wait, 2)}
+            return handler(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def init_rate_limits(app):
+    rate_limiter.configure(app.config)
+    gauge("kjb_rate_limit_buckets", lambda: len(rate_limiter.connections))
@@ -0,0 +1,213 @@
+"""Notification retention: age expiry, per-user caps and compaction.
+
+Every chat message, follow and shop action leaves a notification behind, so
+the table only grows unless something trims it. A retention run applies
+three policies, each in batches of ``NOTIFICATION_RETENTION_BATCH`` rows with
+a commit and a short pause after every batch, so SQLite's write lock is held
+briefly and the hub keeps serving in between:
+
+* expiry deletes notifications older than ``NOTIFICATION_RETENTION_DAYS``;
+* the cap keeps each user's newest ``NOTIFICATION_MAX_PER_USER`` rows;
+* compaction folds a user's read notifications with the same title that are
+  older than ``NOTIFICATION_COMPACT_AFTER_HOURS`` into the newest of them,
+  whose ``merged_count`` then says how many it stands for.
+
+Users who lose unread rows get their badge count pushed again. With
+``NOTIFICATION_RETENTION_INTERVAL`` set, one process runs the policies in
+the background (``serve.py`` starts it on its first worker only);
+``flask --app run prune-notifications`` runs them once and prints a report.
+"""
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from .extensions import db, socketio
+from .metrics import inc, observe
+from .models import Notification
+from .notifications import push_unread_count
+from .periodic import start_periodic
+
+POLICIES = ("expired", "capped", "compacted")
+
+
+class NotificationRetention:
+    def __init__(self, max_age_days=90, max_per_user=1000, compact_after_hours=24, batch_size=500, pause=0.05):
+        self.max_age_days = max_age_days
+        self.max_per_user = max_per_user
+        self.compact_after_hours = compact_after_hours
+        self.batch_size = max(1, batch_size)
+        self.pause = pause
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_age_days=config["NOTIFICATION_RETENTION_DAYS"],
+            max_per_user=config["NOTIFICATION_MAX_PER_USER"],
+            compact_after_hours=config["NOTIFICATION_COMPACT_AFTER_HOURS"],
+            batch_size=config["NOTIFICATION_RETENTION_BATCH"],
+            pause=config["NOTIFICATION_RETENTION_PAUSE"],
+        )
+
+    def run(self, now=None):
+        """Apply every enabled policy; returns ``{"expired": n, "capped": n, "compacted": n, ...}``."""
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        report = dict.fromkeys(POLICIES, 0)
+        report["batches"] = 0
+        unread_changed = set()
+        if self.max_age_days > 0:
+            cutoff = now - timedelta(days=self.max_age_days)
+            self._expire(cutoff, report, unread_changed)
+        if self.max_per_user > 0:
+            self._cap(report, unread_changed)
+        if self.compact_after_hours > 0:
+            cutoff = now - timedelta(hours=self.compact_after_hours)
+            self._compact(cutoff, report)
+        for user_id in unread_changed:
+            push_unread_count(user_id)
+        report["unread_users"] = len(unread_changed)
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+    def _delete_batch(self, rows, policy, report, unread_changed):
+        """Delete ``(id, user_id, is_read)`` rows and commit."""
+        started = time.perf_counter()
+        Notification.query.filter(Notification.id.in_([row.id for row in rows])).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        self._finish_batch(policy, len(rows), started, report)
+        unread_changed.update(row.user_id for row in rows if not row.is_read)
+
+    def _finish_batch(self, policy, reclaimed, started, report):
+        observe("kjb_notification_retention_batch_seconds", time.perf_counter() - started, policy=policy)
+        inc("kjb_notifications_reclaimed_total", reclaimed, policy=policy)
+        report[policy] += reclaimed
+        report["batches"] += 1
+        if self.pause:
+            socketio.sleep(self.pause)
+
+    def _rows(self):
+        return db.session.query(Notification.id, Notification.user_id, Notification.is_read)
+
+    def _expire(self, cutoff, report, unread_changed):
+        while True:
+            rows = (
+                self._rows()
+                .filter(Notification.created_at < cutoff)
+                .order_by(Notification.created_at.asc())
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                return
+            self._delete_batch(rows, "expired", report, unread_changed)
+
+    def _cap(self, report, unread_changed):
+        over = (
+            db.session.query(Notification.user_id)
+            .group_by(Notification.user_id)
+            .having(func.count(Notification.id) > self.max_per_user)
+            .all()
+        )
+        for (user_id,) in over:
+            # Oldest id the user keeps; everything below it goes.
+            keep_from = (
+                db.session.query(Notification.id)
+                .filter(Notification.user_id == user_id)
+                .order_by(Notification.id.desc())
+                .offset(self.max_per_user - 1)
+                .limit(1)
+                .scalar()
+            )
+            while keep_from is not None:
+                rows = (
+                    self._rows()
+                    .filter(Notification.user_id == user_id, Notification.id < keep_from)
+                    .order_by(Notification.id.asc())
+                    .limit(self.batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                self._delete_batch(rows, "capped", report, unread_changed)
+
+    def _compact(self, cutoff, report):
+        compactable = (
+            Notification.is_read.is_(True),
+            Notification.created_at < cutoff,
+        )
+        while True:
+            groups = (
+                db.session.query(
+                    Notification.user_id,
+                    Notification.title,
+                    func.max(Notification.id),
+                )
+                .filter(*compactable)
+                .group_by(Notification.user_id, Notification.title)
+                .having(func.count(Notification.id) > 1)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not groups:
+                return
+            started = time.perf_counter()
+            pending = 0
+            for user_id, title, keeper_id in groups:
+                folded = (
+                    db.session.query(Notification.id, Notification.merged_count)
+                    .filter(
+                        *compactable,
+                        Notification.user_id == user_id,
+                        Notification.title == title,
+                        Notification.id < keeper_id,
+                    )
+                    .order_by(Notification.id.asc())
+                    .limit(self.batch_size - pending)
+                    .all()
+                )
+                # A group larger than one batch is folded over several passes.
+                merged = sum(row.merged_count for row in folded)
+                Notification.query.filter(Notification.id == keeper_id).update(
+                    {Notification.merged_count: Notification.merged_count + merged},
+                    synchronize_session=False,
+                )
+                Notification.query.filter(Notification.id.in_([row.id for row in folded])).delete(
+                    synchronize_session=False
+                )
+                pending += len(folded)
+                if pending >= self.batch_size:
+                    db.session.commit()
+                    self._finish_batch("compacted", pending, started, report)
+                    started = time.perf_counter()
+                    pending = 0
+            if pending:
+                db.session.commit()
+                self._finish_batch("compacted", pending, started, report)
+
+
+def run_notification_retention(app=None):
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        return NotificationRetention.from_config(app.config).run()
+
+
+def _summary(report):
+    return (
+        f"{report['expired']} expired, {report['capped']} capped, "
+        f"{report['compacted']} compacted in {report['seconds']:.2f}s"
+    )
+
+
+def start_notification_retention(app):
+    """Run the retention policies every ``NOTIFICATION_RETENTION_INTERVAL`` seconds."""
+    start_periodic(
+        app,
+        "notification retention",
+        app.config.get("NOTIFICATION_RETENTION_INTERVAL", 0),
+        run_notification_retention,
+        _summary,
+    )
@@ -0,0 +1,120 @@
+"""Channel rooms split by permission tier.
+
+A channel's live sockets sit in one of two rooms: ``channel:<id>:read`` for
+users who may read it, who get full message payloads, and
+``channel:<id>:view`` for users who only see that it exists, who get a bare
+``channel_activity`` ping for the unread dot. A broadcast is one emit per
+tier however many sockets there are. Rooms are keyed by channel id, so a
+slug change doesn't strand anyone.
+
+Each worker remembers, for its own sockets, the channels they asked to join
+and the tier each was put in, including channels they asked for but may not
+see. When an admin changes a channel's defaults or a user's override,
+``sockets.refresh_channel_rooms`` works out the new tiers of the online
+users concerned once, moves this worker's sockets and sends the tiers to the
+other workers over the cluster bus, which move theirs.
+"""
+from .cluster import on_cluster_event
+from .extensions import socketio
+from .models import ChannelPermission, User
+from .utils import permissions_from
+
+READ = "read"
+VIEW = "view"
+
+
+def channel_room(channel_id, tier):
+    return f"channel:{channel_id}:{tier}"
+
+
+def channel_rooms_for(channel_id):
+    """Both tier rooms of a channel, for events every member gets."""
+    return [channel_room(channel_id, READ), channel_room(channel_id, VIEW)]
+
+
+def tier_for(permissions):
+    if permissions["can_read"]:
+        return READ
+    if permissions["can_view"]:
+        return VIEW
+    return None
+
+
+def channel_tiers(channels, user_ids):
+    """``[channel id, user id, tier]`` for every pair, with one query for the overrides."""
+    user_ids = list(user_ids)
+    if not channels or not user_ids:
+        return []
+    users = User.query.filter(User.id.in_(user_ids)).all()
+    overrides = {
+        (row.channel_id, row.user_id): row
+        for row in ChannelPermission.query.filter(
+            ChannelPermission.channel_id.in_([channel.id for channel in channels]),
+            ChannelPermission.user_id.in_(user_ids),
+        )
+    }
+    changes = []
+    for channel in channels:
+        for user in users:
+            permissions = permissions_from(user, channel, overrides.get((channel.id, user.id)))
+            changes.append([channel.id, user.id, tier_for(permissions)])
+    return changes
+
+
+class ChannelRooms:
+    def __init__(self):
+        # sid -> user id, for this worker's sockets
+        self._users = {}
+        # sid -> {channel id: tier, or None if refused}
+        self._channels = {}
+
+    def connect(self, sid, user_id):
+        self._users[sid] = user_id
+        self._channels[sid] = {}
+
+    def disconnect(self, sid):
+        # Socket.IO takes a closed socket out of its rooms by itself.
+        self._users.pop(sid, None)
+        self._channels.pop(sid, None)
+
+    def join(self, sid, channel_id, tier):
+        if sid in self._channels:
+            self._move(sid, channel_id, tier)
+
+    def leave(self, sid, channel_id):
+        if sid in self._channels:
+            self._move(sid, channel_id, None)
+            self._channels[sid].pop(channel_id, None)
+
+    def apply(self, changes):
+        """Move this worker's sockets per ``[channel id, user id, tier]`` changes; returns how many moved."""
+        wanted = {}
+        for channel_id, user_id, tier in changes:
+            wanted.setdefault(user_id, {})[channel_id] = tier
+        moved = 0
+        for sid, user_id in list(self._users.items()):
+            joined = self._channels.get(sid, {})
+            for channel_id, tier in wanted.get(user_id, {}).items():
+                if channel_id in joined and joined[channel_id] != tier:
+                    self._move(sid, channel_id, tier)
+                    moved += 1
+        return moved
+
+    def _move(self, sid, channel_id, tier):
+        joined = self._channels[sid]
+        current = joined.get(channel_id)
+        if current != tier:
+            server = socketio.server
+            if current:
+                server.leave_room(sid, channel_room(channel_id, current), namespace="/")
+            if tier:
+                server.enter_room(sid, channel_room(channel_id, tier), namespace="/")
+        joined[channel_id] = tier
+
+
+channel_rooms = ChannelRooms()
+
+
+@on_cluster_event("channel_tiers")
+def _remote_channel_tiers(node, changes):
+    channel_rooms.apply(changes)
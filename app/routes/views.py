@@ -1,5 +1,4 @@
-from datetime import datetime
-from sqlalchemy.orm import selectinload
+from datetime import datetime, timezone
 from flask import (
     Blueprint,
     abort,
@@ -10,8 +9,14 @@ from flask import (
     flash,
     current_app,
     send_from_directory,
+    Response,
+    jsonify,
 )
+from ..archive import archived_by_ids, channel_history, drop_channel_archive, remove_segment_files
 from ..extensions import db
+from ..hashing import PasswordHashingBusy
+from ..message_cache import recent_messages
+from ..metrics import render_metrics
 from ..models import (
     User,
     Channel,
@@ -28,6 +33,22 @@ from ..models import (
     UserAccessoryPermission,
     UserChannelRead,
 )
+from ..notifications import (
+    mailbox_page,
+    mark_read,
+    push_unread_count,
+    serialize_notification,
+    unread_count,
+    unread_counts,
+)
+from ..permissions import apply_permission_rows, parse_permission_csv
+from ..shop import decide_requests, release_items, reserve_item
+from ..user_search import (
+    PUBLIC_SEARCH_COLUMNS,
+    SEARCH_COLUMNS,
+    search_users,
+    serialize_search_result,
+)
 from ..utils import (
     login_required,
     admin_required,
@@ -37,13 +58,21 @@ from ..utils import (
     notify,
     adjust_kc,
     to_kst,
+    to_epoch,
     save_upload,
     resolve_channel_permissions,
     parse_int,
     get_visible_channels,
 )
-from ..sockets import online_users
-from ..sockets import serialize_messages
+from ..sockets import online_user_ids
+from ..sockets import (
+    HISTORY_PAGE_SIZE,
+    cards_for_ids,
+    recent_channel_messages,
+    refresh_channel_rooms,
+    refresh_user_cards,
+    serialize_messages,
+)
 
 bp = Blueprint("views", __name__)
 
@@ -107,7 +136,12 @@ def signin():
         password = request.form.get("password", "")
         remember = request.form.get("remember") == "on"
         user = User.query.filter_by(email=email).first()
-        if not user or not user.check_password(password):
+        try:
+            valid = bool(user) and user.check_password(password)
+        except PasswordHashingBusy:
+            flash("로그인 요청이 많습니다. 잠시 후 다시 시도해주세요.")
+            return redirect(url_for("views.signin"))
+        if not valid:
             flash("이메일 또는 비밀번호가 올바르지 않습니다.")
             return redirect(url_for("views.signin"))
         set_login(user, remember)
@@ -145,7 +179,11 @@ def signup():
             username=username,
             is_admin=is_first,
         )
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except PasswordHashingBusy:
+            flash("가입 요청이 많습니다. 잠시 후 다시 시도해주세요.")
+            return redirect(url_for("views.signup"))
         db.session.add(user)
         db.session.commit()
         set_login(user, True)
@@ -183,23 +221,15 @@ def chat():
             return redirect(url_for("views.chat", id=allowed[0].slug))
         flash("접근 가능한 채널이 없습니다.")
         return redirect(url_for("views.index"))
-    messages = []
     serialized_messages = []
+    user_cards = []
+    # Taken before reading history so reconnect catch-up can't skip an edit.
+    sync_cursor = to_epoch(datetime.utcnow())
     if permissions["can_read"]:
-        messages = (
-            Message.query.filter_by(channel_id=channel.id)
-            .options(
-                selectinload(Message.user).selectinload(User.emoji_permissions).selectinload(UserEmojiPermission.emoji),
-                selectinload(Message.reply_to),
-            )
-            .order_by(Message.created_at.desc())
-            .limit(200)
-            .all()
-        )
-        messages.reverse()
-        serialized_messages = serialize_messages(messages)
-        if messages:
-            _mark_channel_read(current, channel.id, messages[-1].id)
+        serialized_messages = recent_channel_messages(channel.id)
+        user_cards = cards_for_ids(sorted({payload["u"] for payload in serialized_messages}))
+        if serialized_messages:
+            _mark_channel_read(current, channel.id, serialized_messages[-1]["id"])
             db.session.commit()
     visible_channels = get_visible_channels(current)
     unread_channel_ids = _compute_unread_channel_ids(current, visible_channels)
@@ -207,8 +237,11 @@ def chat():
         "chat.html",
         channel=channel,
         messages=serialized_messages,
+        user_cards=user_cards,
+        cards_by_id={card["id"]: card for card in user_cards},
         can_send=permissions["can_send"],
         can_read=permissions["can_read"],
+        sync_cursor=sync_cursor,
         unread_channel_ids=unread_channel_ids,
     )
 
@@ -231,6 +264,56 @@ def mark_chat_read():
     return ("", 204)
 
 
+@bp.route("/chat/history")
+@login_required
+def chat_history():
+    current = get_current_user()
+    channel = Channel.query.filter_by(slug=request.args.get("id", "")).first()
+    if not channel or not resolve_channel_permissions(current, channel)["can_read"]:
+        abort(404)
+    messages, next_before = channel_history(
+        channel.id, before_id=parse_int(request.args.get("before")), limit=HISTORY_PAGE_SIZE
+    )
+    payloads = serialize_messages(messages)
+    return jsonify(
+        {
+            "messages": payloads,
+            "next": next_before,
+            "cards": cards_for_ids(sorted({payload["u"] for payload in payloads})),
+        }
+    )
+
+
+@bp.route("/chat/thread/<int:message_id>")
+@login_required
+def chat_thread(message_id):
+    current = get_current_user()
+    root = Message.query.get(message_id) or archived_by_ids([message_id]).get(message_id)
+    if not root:
+        abort(404)
+    channel = Channel.query.get(root.channel_id)
+    if not channel or not resolve_channel_permissions(current, channel)["can_read"]:
+        abort(404)
+    limit = current_app.config["THREAD_MAX_REPLIES"]
+    replies = (
+        Message.query.filter_by(reply_to_id=root.id)
+        .order_by(Message.id.asc())
+        .limit(limit + 1)
+        .all()
+    )
+    truncated = len(replies) > limit
+    payloads = serialize_messages([root] + replies[:limit])
+    cards = cards_for_ids(sorted({payload["u"] for payload in payloads}))
+    return jsonify(
+        {
+            "root": payloads[0],
+            "replies": payloads[1:],
+            "truncated": truncated,
+            "cards": cards,
+        }
+    )
+
+
 @bp.route("/profile")
 @login_required
 def profile():
@@ -302,6 +385,7 @@ def mypage():
                 return redirect(url_for("views.mypage"))
             current.avatar_url = upload_name
         db.session.commit()
+        refresh_user_cards([current.id])
         flash("프로필이 업데이트되었습니다.")
         return redirect(url_for("views.mypage"))
     return render_template("mypage.html", profile_user=current)
@@ -318,7 +402,7 @@ def shop():
         if not item:
             flash("상품을 찾을 수 없습니다.")
             return redirect(url_for("views.shop"))
-        if item.quantity is not None and item.quantity <= 0:
+        if not reserve_item(item.id):
             flash("품절된 상품입니다.")
             return redirect(url_for("views.shop"))
         request_entry = ShopRequest(user_id=current.id, item_id=item.id)
@@ -346,7 +430,11 @@ def sendkc():
         if current.kc_points < amount:
             flash("KC가 부족합니다.")
             return redirect(url_for("views.sendkc"))
-        recipient = User.query.filter_by(email_prefix=recipient_prefix).first()
+        recipient_id = parse_int(request.form.get("recipient_id"))
+        if recipient_id is not None:
+            recipient = db.session.get(User, recipient_id)
+        else:
+            recipient = User.query.filter_by(email_prefix=recipient_prefix).first()
         if not recipient:
             notify(current.id, "송금", "수신자를 찾지 못해 송금이 취소되었습니다.", db, Notification)
             flash("수신자를 찾을 수 없습니다. 송금이 취소됩니다.")
@@ -361,16 +449,58 @@ def sendkc():
     return render_template("sendkc.html")
 
 
+@bp.route("/users/search")
+@login_required
+def user_search():
+    max_limit = current_app.config["USER_SEARCH_LIMIT"]
+    limit = max(1, min(parse_int(request.args.get("limit")) or max_limit, max_limit))
+    is_admin = get_current_user().is_admin
+    users = search_users(
+        request.args.get("q", ""),
+        limit=limit,
+        columns=SEARCH_COLUMNS if is_admin else PUBLIC_SEARCH_COLUMNS,
+    )
+    return jsonify({"items": [serialize_search_result(user, include_email=is_admin) for user in users]})
+
+
 @bp.route("/mailbox")
 @login_required
 def mailbox():
     current = get_current_user()
-    notifications = (
-        Notification.query.filter_by(user_id=current.id)
-        .order_by(Notification.created_at.desc())
-        .all()
+    before = parse_int(request.args.get("before"))
+    notifications, next_before = mailbox_page(
+        current.id, before=before, limit=current_app.config["MAILBOX_PAGE_SIZE"]
+    )
+    # What was unread is shown highlighted this once, then counts as read.
+    unread_ids = {note.id for note in notifications if not note.is_read}
+    if unread_ids:
+        mark_read(current.id, unread_ids)
+        db.session.commit()
+        push_unread_count(current.id)
+    return render_template(
+        "mailbox.html",
+        notifications=notifications,
+        unread_ids=unread_ids,
+        next_before=next_before,
+    )
+
+
+@bp.route("/mailbox/notifications")
+@login_required
+def mailbox_notifications():
+    current = get_current_user()
+    page_size = current_app.config["MAILBOX_PAGE_SIZE"]
+    limit = max(1, min(parse_int(request.args.get("limit")) or page_size, page_size))
+    notifications, next_before = mailbox_page(
+        current.id, before=parse_int(request.args.get("before")), limit=limit
+    )
+    return jsonify(
+        {
+            "items": [serialize_notification(note) for note in notifications],
+            "next": next_before,
+            "unread": unread_count(current.id),
+        }
     )
-    return render_template("mailbox.html", notifications=notifications)
 
 
 @bp.route("/mailbox/clear", methods=["POST"])
@@ -379,6 +509,7 @@ def clear_mailbox():
     current = get_current_user()
     Notification.query.filter_by(user_id=current.id).delete()
     db.session.commit()
+    push_unread_count(current.id)
     flash("알림이 모두 삭제되었습니다.")
     return redirect(url_for("views.mailbox"))
 
@@ -394,6 +525,20 @@ def media(filename):
     return send_from_directory(upload_folder, filename)
 
 
+@bp.route("/metrics")
+def metrics():
+    if not current_app.config.get("METRICS_ENABLED"):
+        abort(404)
+    # Without the scrape token only a signed-in admin may look; a loopback
+    # check wouldn't do, since the balancer reaches workers from loopback.
+    token = current_app.config.get("METRICS_TOKEN")
+    if not (token and request.headers.get("Authorization") == f"Bearer {token}"):
+        user = get_current_user()
+        if not user or not user.is_admin:
+            abort(403)
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 @bp.route("/admin", methods=["GET", "POST"])
 @admin_required
 def admin():
@@ -412,44 +557,20 @@ def admin():
                 db.session.commit()
                 flash("KC가 조정되었습니다.")
         elif action == "shop_decision":
-            request_id = request.form.get("request_id")
-            decision = request.form.get("decision")
-            shop_request = ShopRequest.query.get(request_id)
-            if shop_request and shop_request.status == "pending":
-                if decision == "approve":
-                    item = shop_request.item
-                    if shop_request.user.kc_points >= item.kc_cost:
-                        adjust_kc(shop_request.user, -item.kc_cost, "상점 구매", db, KCLog, Notification)
-                        shop_request.status = "approved"
-                        shop_request.processed_at = datetime.utcnow()
-                        if item.quantity is not None:
-                            item.quantity = max(0, item.quantity - 1)
-                        notify(
-                            shop_request.user.id,
-                            "상점",
-                            f"{item.name} 구매가 승인되었습니다.",
-                            db,
-                            Notification,
-                        )
-                    else:
-                        shop_request.status = "denied"
-                        notify(
-                            shop_request.user.id,
-                            "상점",
-                            f"KC 부족으로 {item.name} 구매가 거절되었습니다.",
-                            db,
-                            Notification,
-                        )
-                else:
-                    shop_request.status = "denied"
-                    notify(
-                        shop_request.user.id,
-                        "상점",
-                        f"{shop_request.item.name} 구매가 거절되었습니다.",
-                        db,
-                        Notification,
-                    )
+            request_id = parse_int(request.form.get("request_id"))
+            if request_id is not None:
+                decide_requests([request_id], request.form.get("decision") == "approve")
                 db.session.commit()
+        elif action == "shop_decision_bulk":
+            request_ids = [
+                request_id
+                for request_id in map(parse_int, request.form.getlist("request_ids"))
+                if request_id is not None
+            ]
+            if request_ids:
+                result = decide_requests(request_ids, request.form.get("decision") == "approve")
+                db.session.commit()
+                flash(f"승인 {result['approved']}건, 거절 {result['denied']}건을 처리했습니다.")
         elif action == "channel_create":
             slug = request.form.get("slug", "").strip()
             name = request.form.get("name", "").strip()
@@ -495,7 +616,10 @@ def admin():
                 channel.default_can_send = (
                     request.form.get("default_can_send") == "on"
                 )
+                # Blank follows MESSAGE_ARCHIVE_AFTER_DAYS.
+                channel.archive_after_days = parse_int(request.form.get("archive_after_days"))
                 db.session.commit()
+                refresh_channel_rooms([channel])
         elif action == "channel_delete":
             channel_id = request.form.get("channel_id")
             channel = Channel.query.get(channel_id)
@@ -503,8 +627,11 @@ def admin():
                 Message.query.filter_by(channel_id=channel.id).delete()
                 UserChannelRead.query.filter_by(channel_id=channel.id).delete()
                 ChannelPermission.query.filter_by(channel_id=channel.id).delete()
+                archived_paths = drop_channel_archive(channel.id)
                 db.session.delete(channel)
                 db.session.commit()
+                remove_segment_files(archived_paths)
+                recent_messages.drop(channel.id)
         elif action == "shop_item_create":
             name = request.form.get("name", "").strip()
             kc_cost = parse_int(request.form.get("kc_cost"))
@@ -565,18 +692,31 @@ def admin():
                 permission.can_read = request.form.get("can_read") == "on"
                 permission.can_send = request.form.get("can_send") == "on"
                 db.session.commit()
+                refresh_channel_rooms([channel], [user.id])
         elif action == "channel_permission_delete":
             perm_id = request.form.get("permission_id")
             permission = ChannelPermission.query.get(perm_id)
             if permission:
+                channel, user_id = permission.channel, permission.user_id
                 db.session.delete(permission)
                 db.session.commit()
+                refresh_channel_rooms([channel], [user_id])
         elif action == "user_delete":
             prefix = request.form.get("target")
             target = User.query.filter_by(email_prefix=prefix).first()
-            if target and target.id != current.id:
+            if not target:
+                flash("사용자를 찾을 수 없습니다.")
+            elif target.is_admin:
+                flash("관리자 계정은 삭제할 수 없습니다.")
+            elif target.id != current.id:
                 Message.query.filter_by(user_id=target.id).delete()
                 UserChannelRead.query.filter_by(user_id=target.id).delete()
+                release_items(
+                    item_id
+                    for (item_id,) in ShopRequest.query.with_entities(ShopRequest.item_id).filter_by(
+                        user_id=target.id, status="pending"
+                    )
+                )
                 ShopRequest.query.filter_by(user_id=target.id).delete()
                 Follow.query.filter_by(follower_id=target.id).delete()
                 Follow.query.filter_by(followed_id=target.id).delete()
@@ -587,6 +727,10 @@ def admin():
                 KCLog.query.filter_by(user_id=target.id).delete()
                 db.session.delete(target)
                 db.session.commit()
+                recent_messages.clear()
+                refresh_user_cards([target.id])
+                unread_counts.drop(target.id)
+                flash("사용자가 삭제되었습니다.")
         elif action == "emoji_create":
             name = request.form.get("name", "").strip().lower()
             image_file = request.files.get("image_file")
@@ -610,18 +754,22 @@ def admin():
             is_public = request.form.get("is_public") == "on"
             db.session.add(Emoji(name=name, image_url=upload_name, is_public=is_public))
             db.session.commit()
+            # Buffered messages were rendered against the old emoji set.
+            recent_messages.clear()
         elif action == "emoji_delete":
             emoji_id = request.form.get("emoji_id")
             emoji = Emoji.query.get(emoji_id)
             if emoji:
                 db.session.delete(emoji)
                 db.session.commit()
+                recent_messages.clear()
         elif action == "emoji_toggle_public":
             emoji_id = request.form.get("emoji_id")
             emoji = Emoji.query.get(emoji_id)
             if emoji:
                 emoji.is_public = not emoji.is_public
                 db.session.commit()
+                recent_messages.clear()
         elif action == "emoji_permission_upsert":
             user_id = request.form.get("user_id")
             emoji_id = request.form.get("emoji_id")
@@ -634,12 +782,14 @@ def admin():
                 if not existing:
                     db.session.add(UserEmojiPermission(user_id=user.id, emoji_id=emoji.id))
                     db.session.commit()
+                    recent_messages.clear()
         elif action == "emoji_permission_delete":
             permission_id = request.form.get("permission_id")
             permission = UserEmojiPermission.query.get(permission_id)
             if permission:
                 db.session.delete(permission)
                 db.session.commit()
+                recent_messages.clear()
         elif action == "accessory_create":
             name = request.form.get("name", "").strip()
             text_color = request.form.get("text_color", "#f7f9ff").strip() or "#f7f9ff"
@@ -667,8 +817,15 @@ def admin():
             accessory_id = request.form.get("accessory_id")
             accessory = Accessory.query.get(accessory_id)
             if accessory:
+                holder_ids = [
+                    user_id
+                    for (user_id,) in db.session.query(UserAccessoryPermission.user_id).filter_by(
+                        accessory_id=accessory.id, is_active=True
+                    )
+                ]
                 db.session.delete(accessory)
                 db.session.commit()
+                refresh_user_cards(holder_ids)
         elif action == "accessory_permission_upsert":
             user_id = request.form.get("user_id")
             accessory_id = request.form.get("accessory_id")
@@ -691,6 +848,7 @@ def admin():
                     )
                     permission.is_active = True
                 db.session.commit()
+                refresh_user_cards([user.id])
         elif action == "accessory_permission_activate":
             permission_id = request.form.get("permission_id")
             permission = UserAccessoryPermission.query.get(permission_id)
@@ -700,36 +858,38 @@ def admin():
                 )
                 permission.is_active = True
                 db.session.commit()
+                refresh_user_cards([permission.user_id])
         elif action == "accessory_permission_delete":
             permission_id = request.form.get("permission_id")
             permission = UserAccessoryPermission.query.get(permission_id)
             if permission:
+                user_id = permission.user_id
                 db.session.delete(permission)
                 db.session.commit()
+                refresh_user_cards([user_id])
     stats = {
         "user_count": User.query.count(),
         "channel_count": Channel.query.count(),
-        "online_count": len(online_users),
+        "online_count": len(online_user_ids()),
     }
-    shop_requests = (
-        ShopRequest.query.filter_by(status="pending")
-        .order_by(ShopRequest.created_at.desc())
-        .all()
-    )
+    # Every item, channel, emoji and accessory is listed in full, so the
+    # permission rows find theirs in the identity map; the users they name
+    # are loaded together below rather than once per list.
     items = ShopItem.query.order_by(ShopItem.priority.desc(), ShopItem.name.asc()).all()
     channels = Channel.query.order_by(Channel.priority.desc(), Channel.name.asc()).all()
-    users = User.query.order_by(User.created_at.desc()).all()
-    channel_permissions = ChannelPermission.query.order_by(
-        ChannelPermission.created_at.desc()
-    ).all()
     emojis = Emoji.query.order_by(Emoji.name.asc()).all()
-    emoji_permissions = UserEmojiPermission.query.order_by(
-        UserEmojiPermission.created_at.desc()
-    ).all()
     accessories = Accessory.query.order_by(Accessory.created_at.desc()).all()
-    accessory_permissions = UserAccessoryPermission.query.order_by(
-        UserAccessoryPermission.created_at.desc()
-    ).all()
+    shop_requests = ShopRequest.query.filter_by(status="pending").order_by(ShopRequest.created_at.desc()).all()
+    channel_permissions = ChannelPermission.query.order_by(ChannelPermission.created_at.desc()).all()
+    emoji_permissions = UserEmojiPermission.query.order_by(UserEmojiPermission.created_at.desc()).all()
+    accessory_permissions = UserAccessoryPermission.query.order_by(UserAccessoryPermission.created_at.desc()).all()
+    user_ids = {
+        row.user_id
+        for rows in (shop_requests, channel_permissions, emoji_permissions, accessory_permissions)
+        for row in rows
+    }
+    # Held until the page is rendered; the identity map only keeps live objects.
+    listed_users = User.query.filter(User.id.in_(user_ids)).all() if user_ids else []
     return render_template(
         "admin.html",
         stats=stats,
@@ -741,12 +901,50 @@ def admin():
         emoji_permissions=emoji_permissions,
         accessories=accessories,
         accessory_permissions=accessory_permissions,
-        users=users,
     )
 
 
+@bp.route("/admin/permissions", methods=["POST"])
+@admin_required
+def admin_permissions_bulk():
+    """Grant or revoke emoji, accessory and channel permissions in bulk (JSON ``{"rows": [...]}``)."""
+    payload = request.get_json(silent=True) or {}
+    rows = payload.get("rows")
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        abort(400)
+    return jsonify(apply_permission_rows(list(enumerate(rows, start=1))))
+
+
+@bp.route("/admin/permissions/import", methods=["POST"])
+@admin_required
+def admin_permissions_import():
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("CSV 파일을 선택해주세요.")
+        return redirect(url_for("views.admin"))
+    try:
+        rows = parse_permission_csv(upload.stream)
+    except (ValueError, UnicodeDecodeError) as exc:
+        flash(f"CSV를 읽을 수 없습니다: {exc}")
+        return redirect(url_for("views.admin"))
+    report = apply_permission_rows(rows)
+    flash(f"권한 {report['granted']}건 부여, {report['revoked']}건 회수했습니다.")
+    for line, message in report["errors"][:20]:
+        flash(f"{line}행: {message}")
+    if len(report["errors"]) > 20:
+        flash(f"외 {len(report['errors']) - 20}건의 오류가 있습니다.")
+    return redirect(url_for("views.admin"))
+
+
 @bp.app_template_filter("datetime")
 def format_datetime(value):
     if not value:
         return ""
     return to_kst(value).strftime("%Y-%m-%d %H:%M")
+
+
+@bp.app_template_filter("epoch_datetime")
+def format_epoch_datetime(value):
+    if not value:
+        return ""
+    return to_kst(datetime.fromtimestamp(value, timezone.utc)).strftime("%Y-%m-%d %H:%M")
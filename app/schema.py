@@ -0,0 +1,64 @@
+"""Database schema setup, kept out of the worker boot path.
+
+The schema lives in Flask-Migrate migrations under ``migrations/``.
+``flask --app run init`` brings a database to the latest revision and seeds
+the default channel; workers started with ``AUTO_INIT_DB=0`` then boot with
+no DDL or introspection. Flask-Migrate (and with it Alembic) is only
+imported for CLI invocations and for ``init_database``.
+"""
+import os
+
+import click
+from sqlalchemy import inspect, text
+
+from .extensions import db
+from .models import Channel
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+# Databases created by ``db.create_all()`` before migrations existed match
+# this revision once the old boot-time fallbacks have been applied.
+BASELINE_REVISION = "0001_initial"
+
+
+def running_cli():
+    return click.get_current_context(silent=True) is not None
+
+
+def init_migrations(app):
+    from flask_migrate import Migrate
+
+    Migrate(app, db, directory=MIGRATIONS_DIR, render_as_batch=True)
+
+
+def _adopt_legacy_database(inspector):
+    """Bring a pre-migrations database to the baseline and stamp it."""
+    from flask_migrate import stamp
+
+    emoji_columns = {column["name"] for column in inspector.get_columns("emojis")}
+    if "is_public" not in emoji_columns:
+        db.session.execute(
+            text("ALTER TABLE emojis ADD COLUMN is_public BOOLEAN NOT NULL DEFAULT 0")
+        )
+        db.session.commit()
+    stamp(directory=MIGRATIONS_DIR, revision=BASELINE_REVISION)
+
+
+def seed_defaults():
+    if not Channel.query.first():
+        db.session.add(Channel(slug="general", name="# general", description="기본 채널"))
+        db.session.commit()
+
+
+def init_database(app):
+    """Upgrade the database to the latest migration and seed defaults."""
+    from flask_migrate import upgrade
+
+    if "migrate" not in app.extensions:
+        init_migrations(app)
+    with app.app_context():
+        inspector = inspect(db.engine)
+        tables = set(inspector.get_table_names())
+        if "users" in tables and "alembic_version" not in tables:
+            _adopt_legacy_database(inspector)
+        upgrade(directory=MIGRATIONS_DIR)
+        seed_defaults()
@@ -0,0 +1,104 @@
+"""Shop stock reservations and request decisions.
+
+Stock is taken when a user asks for an item, not when an admin approves:
+``reserve_item`` is one conditional UPDATE that only succeeds while the item
+has stock left, so however many users race for the last unit, one request
+gets it and the others are told it's sold out. A denied request, or one
+dropped with its user, puts its unit back.
+
+``decide_requests`` approves or denies any number of pending requests in
+the caller's transaction. It claims them with one UPDATE guarded on
+``status = 'pending'``, so a request clicked by two admins at once is only
+decided once, then debits each buyer with ``debit_kc`` (oldest request
+first), denies those short of KC, returns their stock and adds the
+notifications, which are pushed after the commit.
+"""
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import or_, update
+
+from .extensions import db
+from .metrics import inc, observe
+from .models import KCLog, Notification, ShopItem, ShopRequest
+from .utils import debit_kc, notify
+
+PURCHASE_REASON = "상점 구매"
+
+
+def reserve_item(item_id):
+    """Take one unit of the item's stock; returns False if it's sold out or gone."""
+    # Unlimited items have a NULL quantity, which NULL - 1 leaves alone.
+    reserved = bool(
+        ShopItem.query.filter(
+            ShopItem.id == item_id, or_(ShopItem.quantity.is_(None), ShopItem.quantity > 0)
+        ).update({ShopItem.quantity: ShopItem.quantity - 1}, synchronize_session=False)
+    )
+    inc("kjb_shop_reservations_total", result="reserved" if reserved else "sold_out")
+    return reserved
+
+
+def release_items(item_ids):
+    """Put one unit back per entry of ``item_ids``, which may repeat."""
+    for item_id, count in Counter(item_ids).items():
+        ShopItem.query.filter(ShopItem.id == item_id, ShopItem.quantity.isnot(None)).update(
+            {ShopItem.quantity: ShopItem.quantity + count}, synchronize_session=False
+        )
+
+
+def _set_status(request_ids, status, now):
+    """Move the still-pending requests among ``request_ids`` to ``status``; returns their rows."""
+    statement = (
+        update(ShopRequest)
+        .where(ShopRequest.id.in_(request_ids), ShopRequest.status == "pending")
+        .values(status=status, processed_at=now)
+        .returning(ShopRequest.id, ShopRequest.user_id, ShopRequest.item_id)
+    )
+    return db.session.execute(statement, execution_options={"synchronize_session": False}).all()
+
+
+def decide_requests(request_ids, approve):
+    """Approve or deny the pending requests among ``request_ids``; the caller commits.
+
+    Returns ``{"approved": n, "denied": n}``. Requests already decided are
+    skipped; when approving, requests whose buyer is short of KC are denied.
+    """
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    claimed = _set_status(list(request_ids), "approved" if approve else "denied", now)
+    if not claimed:
+        return {"approved": 0, "denied": 0}
+    items = {
+        item.id: item for item in ShopItem.query.filter(ShopItem.id.in_({row.item_id for row in claimed}))
+    }
+    approved, denied, short = [], [], []
+    # The debits don't read the log and notification rows they add, so keep
+    # those for one batched INSERT at flush instead of one per UPDATE.
+    with db.session.no_autoflush:
+        for row in sorted(claimed):
+            if not approve:
+                denied.append(row)
+            elif debit_kc(row.user_id, items[row.item_id].kc_cost, PURCHASE_REASON, db, KCLog, Notification):
+                approved.append(row)
+            else:
+                short.append(row)
+    if short:
+        db.session.execute(
+            update(ShopRequest).where(ShopRequest.id.in_([row.id for row in short])).values(status="denied"),
+            execution_options={"synchronize_session": False},
+        )
+    release_items([row.item_id for row in denied + short])
+
+    for rows, template in (
+        (approved, "{} 구매가 승인되었습니다."),
+        (short, "KC 부족으로 {} 구매가 거절되었습니다."),
+        (denied, "{} 구매가 거절되었습니다."),
+    ):
+        for row in rows:
+            notify(row.user_id, "상점", template.format(items[row.item_id].name), db, Notification)
+
+    inc("kjb_shop_decisions_total", len(approved), decision="approved")
+    inc("kjb_shop_decisions_total", len(denied) + len(short), decision="denied")
+    observe("kjb_shop_decision_batch_seconds", time.perf_counter() - started)
+    return {"approved": len(approved), "denied": len(denied) + len(short)}
@@ -1,8 +1,14 @@
-from datetime import datetime
-from flask import session
-from flask_socketio import join_room, leave_room, emit
+from datetime import datetime, timezone
+from flask import current_app, request, session
+from flask_socketio import join_room, emit
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
-from .extensions import db
+from .archive import archived_by_ids
+from .card_cache import user_cards
+from .cluster import on_cluster_event, publish
+from .extensions import db, socketio as socketio_ext
+from .message_cache import recent_messages
+from .metrics import gauge, inc, observe_event
 from .models import (
     Message,
     Channel,
@@ -12,30 +18,83 @@ from .models import (
     Emoji,
     UserAccessoryPermission,
     UserChannelRead,
+    UserEmojiPermission,
+)
+from .notifications import notification_room
+from .ratelimit import rate_limited, rate_limiter
+from .rooms import (
+    READ,
+    VIEW,
+    channel_room,
+    channel_rooms,
+    channel_rooms_for,
+    channel_tiers,
+    tier_for,
 )
 from .utils import (
     adjust_kc,
-    to_kst,
+    to_epoch,
     resolve_channel_permissions,
     media_url,
+    parse_int,
     render_chat_content,
 )
 
 
 online_users = set()
+# worker id -> user ids online there, as last announced over the cluster bus
+remote_online_users = {}
 channel_typing_users = {}
 
 
+def online_user_ids():
+    """Users online on this worker or any other one sharing the message queue."""
+    user_ids = set(online_users)
+    for remote in remote_online_users.values():
+        user_ids |= remote
+    return user_ids
+
+
+def announce_presence():
+    publish("presence", users=sorted(online_users))
+
+
+@on_cluster_event("presence")
+def _remote_presence(node, users):
+    if users:
+        remote_online_users[node] = set(users)
+    else:
+        remote_online_users.pop(node, None)
+
+
+@on_cluster_event("hello")
+def _peer_started(node):
+    # A restarted worker reuses its id; forget whatever it had before.
+    remote_online_users.pop(node, None)
+    announce_presence()
+
+
 def _build_emoji_map_for_user(user):
-    emoji_map = {emoji.name: emoji.image_url for emoji in Emoji.query.filter_by(is_public=True).all()}
-    if user:
-        emoji_map.update(
-            {
-                permission.emoji.name: permission.emoji.image_url
-                for permission in user.emoji_permissions
-            }
+    if not user:
+        return _build_emoji_maps([])[None]
+    return _build_emoji_maps([user.id])[user.id]
+
+
+def _build_emoji_maps(user_ids):
+    public_map = {emoji.name: emoji.image_url for emoji in Emoji.query.filter_by(is_public=True).all()}
+    result = {None: public_map}
+    for user_id in user_ids:
+        result[user_id] = dict(public_map)
+    if user_ids:
+        rows = (
+            db.session.query(UserEmojiPermission.user_id, Emoji.name, Emoji.image_url)
+            .join(Emoji, UserEmojiPermission.emoji_id == Emoji.id)
+            .filter(UserEmojiPermission.user_id.in_(user_ids))
+            .all()
         )
-    return emoji_map
+        for user_id, name, image_url in rows:
+            result[user_id][name] = image_url
+    return result
 
 
 def _active_accessory_map(user_ids):
@@ -83,7 +142,141 @@ def _mark_channel_read(user_id, channel_id, message_id):
         state.last_read_message_id = message_id
 
 
+def _catch_up(channel_id, last_id, first_id=None, cursor=None):
+    """Messages a reconnecting client missed, or None if it is too far behind.
+
+    Returns ``(missed, updated)``: payloads newer than ``last_id``, and
+    payloads between ``first_id`` and ``last_id`` edited or deleted since the
+    epoch ``cursor``. Both come from the ring buffer when it covers the range.
+    """
+    limit = current_app.config.get("CATCHUP_MAX_MESSAGES", 200)
+    missed = recent_messages.since(channel_id, last_id)
+    if missed is None:
+        rows = (
+            Message.query.filter(Message.channel_id == channel_id, Message.id > last_id)
+            .order_by(Message.id.asc())
+            .limit(limit + 1)
+            .all()
+        )
+        missed = serialize_messages(rows)
+    if len(missed) > limit:
+        return None
+    if not isinstance(cursor, int) or not isinstance(first_id, int):
+        return missed, []
+    # A cursor from the future (or before the epoch) isn't one this server
+    # handed out; treat it as none rather than fail the join.
+    if not 0 <= cursor <= to_epoch(datetime.utcnow()):
+        return missed, []
+    buffered = recent_messages.latest(channel_id)
+    if buffered and buffered[0]["id"] <= first_id:
+        updated = [
+            payload
+            for payload in buffered
+            if first_id <= payload["id"] <= last_id and payload.get("ed", 0) >= cursor
+        ]
+    else:
+        rows = (
+            Message.query.filter(
+                Message.channel_id == channel_id,
+                Message.updated_at >= datetime.fromtimestamp(cursor, timezone.utc).replace(tzinfo=None),
+                Message.id.between(first_id, last_id),
+            )
+            .order_by(Message.id.asc())
+            .limit(limit + 1)
+            .all()
+        )
+        updated = serialize_messages(rows)
+    if len(updated) > limit:
+        return None
+    return missed, updated
+
+
+def _send_message(user, data, channels=None):
+    """Store and broadcast one message, returning its ack.
+
+    ``client_id`` makes the send idempotent: (user_id, client_id) is unique,
+    so a retry fails the insert, rolls back its KC reward with it, and is
+    answered with the original message instead. ``channels`` caches channel
+    lookups and permissions across a batch.
+    """
+    channel_slug = data.get("channel")
+    content = (data.get("content") or "").strip()
+    reply_to_id = parse_int(data.get("reply_to"))
+    client_id = data.get("client_id")
+    if not isinstance(client_id, str) or not 0 < len(client_id) <= 64:
+        client_id = None
+    if not channel_slug or not content:
+        return {"ok": False, "error": "메시지 내용을 입력해주세요."}
+    if channels is not None and channel_slug in channels:
+        channel, can_send = channels[channel_slug]
+    else:
+        channel = Channel.query.filter_by(slug=channel_slug).first()
+        can_send = bool(channel) and resolve_channel_permissions(user, channel)["can_send"]
+        if channels is not None:
+            channels[channel_slug] = (channel, can_send)
+    if not channel:
+        return {"ok": False, "error": "채널을 찾을 수 없습니다."}
+    if not can_send:
+        return {"ok": False, "error": "메시지 전송 권한이 없습니다."}
+    reply_previews = {}
+    if reply_to_id:
+        reply_previews = _reply_previews([reply_to_id], channel_id=channel.id)
+        if reply_to_id not in reply_previews:
+            return {"ok": False, "error": "답장할 메시지를 찾을 수 없습니다."}
+    message = Message(
+        channel_id=channel.id,
+        user_id=user.id,
+        content=content,
+        reply_to_id=reply_to_id,
+        client_id=client_id,
+    )
+    db.session.add(message)
+    adjust_kc(user, 1, "채팅 보상", db, KCLog, Notification)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        original = (
+            Message.query.filter_by(user_id=user.id, client_id=client_id).first()
+            if client_id
+            else None
+        )
+        if not original:
+            raise
+        inc("kjb_duplicate_sends_total")
+        # Serialized as the first ack was, so a retry can't tell the difference.
+        if original.reply_to_id:
+            reply_previews = _reply_previews([original.reply_to_id], channel_id=original.channel_id)
+        payload = serialize_message(
+            original,
+            emoji_map=_build_emoji_map_for_user(user),
+            reply_previews=reply_previews,
+        )
+        return {"ok": True, "message": payload, "duplicate": True}
+    _mark_channel_read(user.id, channel.id, message.id)
+    db.session.commit()
+    payload = serialize_message(
+        message,
+        emoji_map=_build_emoji_map_for_user(user),
+        reply_previews=reply_previews,
+    )
+    recent_messages.append(channel.id, payload, message.reply_to_id)
+    emit("new_message", payload, room=channel_room(channel.id, READ))
+    emit("channel_activity", {"ch": channel.id, "id": message.id}, room=channel_room(channel.id, VIEW))
+    return {"ok": True, "message": payload}
+
+
+def _batch_size(data):
+    messages = data.get("messages") if isinstance(data, dict) else None
+    if not isinstance(messages, list):
+        return 1
+    return max(1, min(len(messages), current_app.config.get("SEND_BATCH_MAX", 20)))
+
+
 def _emit_typing_update(channel_slug):
+    channel = Channel.query.filter_by(slug=channel_slug).first()
+    if not channel:
+        return
     user_ids = list(channel_typing_users.get(channel_slug, set()))
     users = User.query.filter(User.id.in_(user_ids)).all() if user_ids else []
     emit(
@@ -92,23 +285,33 @@ def _emit_typing_update(channel_slug):
             "channel": channel_slug,
             "users": [{"id": user.id, "name": user.name} for user in users],
         },
-        room=channel_slug,
+        room=channel_rooms_for(channel.id),
     )
 
 def register_socket_handlers(socketio):
+    gauge("kjb_online_users", lambda: len(online_users))
+
     @socketio.on("connect")
-    def handle_connect():
+    @observe_event("connect")
+    def handle_connect(auth=None):
         user = _current_user()
         if not user:
             return False
+        join_room(notification_room(user.id))
+        channel_rooms.connect(request.sid, user.id)
         online_users.add(user.id)
+        announce_presence()
         emit("online_update", _online_payload(), broadcast=True)
 
     @socketio.on("disconnect")
+    @observe_event("disconnect")
     def handle_disconnect():
+        rate_limiter.forget_connection(request.sid)
+        channel_rooms.disconnect(request.sid)
         user = _current_user()
         if user and user.id in online_users:
             online_users.discard(user.id)
+            announce_presence()
             emit("online_update", _online_payload(), broadcast=True)
         if user:
             for channel_slug in list(channel_typing_users.keys()):
@@ -120,6 +323,8 @@ def register_socket_handlers(socketio):
                     _emit_typing_update(channel_slug)
 
     @socketio.on("join")
+    @observe_event("join")
+    @rate_limited("join")
     def handle_join(data):
         user = _current_user()
         if not user:
@@ -130,17 +335,32 @@ def register_socket_handlers(socketio):
         channel = Channel.query.filter_by(slug=channel_slug).first()
         if not channel:
             return
-        if not resolve_channel_permissions(user, channel)["can_view"]:
+        permissions = resolve_channel_permissions(user, channel)
+        # Remembered even when refused, so a later grant can move the socket in.
+        channel_rooms.join(request.sid, channel.id, tier_for(permissions))
+        if not permissions["can_view"]:
             return
-        join_room(channel_slug)
+        cursor = to_epoch(datetime.utcnow())
+        last_id = data.get("last_id")
+        if not isinstance(last_id, int) or not permissions["can_read"]:
+            return {"ok": True, "cursor": cursor}
+        replay = _catch_up(channel.id, last_id, data.get("first_id"), data.get("cursor"))
+        if replay is None:
+            return {"ok": False, "reload": True}
+        missed, updated = replay
+        return {"ok": True, "cursor": cursor, "messages": missed, "updated": updated}
 
     @socketio.on("leave")
+    @observe_event("leave")
+    @rate_limited("leave")
     def handle_leave(data):
         user = _current_user()
         channel_slug = data.get("channel")
         if not channel_slug:
             return
-        leave_room(channel_slug)
+        channel = Channel.query.filter_by(slug=channel_slug).first()
+        if channel:
+            channel_rooms.leave(request.sid, channel.id)
         if user:
             typers = channel_typing_users.get(channel_slug, set())
             if user.id in typers:
@@ -150,36 +370,36 @@ def register_socket_handlers(socketio):
                 _emit_typing_update(channel_slug)
 
     @socketio.on("send_message")
+    @observe_event("send_message")
+    @rate_limited("send_message")
     def handle_send_message(data):
         user = _current_user()
         if not user:
             return
-        channel_slug = data.get("channel")
-        content = (data.get("content") or "").strip()
-        reply_to_id = data.get("reply_to")
-        if not channel_slug or not content:
-            return {"ok": False, "error": "메시지 내용을 입력해주세요."}
-        channel = Channel.query.filter_by(slug=channel_slug).first()
-        if not channel:
-            return {"ok": False, "error": "채널을 찾을 수 없습니다."}
-        if not resolve_channel_permissions(user, channel)["can_send"]:
-            return {"ok": False, "error": "메시지 전송 권한이 없습니다."}
-        message = Message(
-            channel_id=channel.id,
-            user_id=user.id,
-            content=content,
-            reply_to_id=reply_to_id,
-        )
-        db.session.add(message)
-        adjust_kc(user, 1, "채팅 보상", db, KCLog, Notification)
-        db.session.commit()
-        _mark_channel_read(user.id, channel.id, message.id)
-        db.session.commit()
-        payload = serialize_message(message, emoji_map=_build_emoji_map_for_user(user))
-        emit("new_message", payload, room=channel_slug)
-        return {"ok": True, "message": payload}
+        return _send_message(user, data or {})
+
+    @socketio.on("send_messages")
+    @observe_event("send_messages")
+    @rate_limited("send_messages", weight=_batch_size)
+    def handle_send_messages(data):
+        """Resend several queued messages in one round trip; one ack per message."""
+        user = _current_user()
+        if not user:
+            return
+        batch = (data or {}).get("messages") or []
+        if not isinstance(batch, list):
+            return {"ok": False, "error": "잘못된 요청입니다."}
+        batch = batch[: current_app.config.get("SEND_BATCH_MAX", 20)]
+        channels = {}
+        results = [
+            _send_message(user, item, channels) if isinstance(item, dict) else {"ok": False}
+            for item in batch
+        ]
+        return {"ok": True, "results": results}
 
     @socketio.on("typing")
+    @observe_event("typing")
+    @rate_limited("typing")
     def handle_typing(data):
         user = _current_user()
         if not user:
@@ -202,7 +422,18 @@ def register_socket_handlers(socketio):
             channel_typing_users.pop(channel_slug, None)
         _emit_typing_update(channel_slug)
 
+    @socketio.on("user_cards")
+    @observe_event("user_cards")
+    @rate_limited("user_cards")
+    def handle_user_cards(data):
+        if not _current_user():
+            return {"ok": False}
+        user_ids = [user_id for user_id in (data or {}).get("ids", []) if isinstance(user_id, int)]
+        return {"ok": True, "cards": cards_for_ids(user_ids[:100])}
+
     @socketio.on("edit_message")
+    @observe_event("edit_message")
+    @rate_limited("edit_message")
     def handle_edit_message(data):
         user = _current_user()
         if not user:
@@ -219,9 +450,13 @@ def register_socket_handlers(socketio):
         message.content = content
         message.updated_at = datetime.utcnow()
         db.session.commit()
-        emit("message_updated", serialize_message(message), room=_channel_slug(message))
+        payload = serialize_message(message)
+        recent_messages.update(message.channel_id, payload, preview=reply_preview(message.content))
+        emit("message_updated", payload, room=channel_room(message.channel_id, READ))
 
     @socketio.on("delete_message")
+    @observe_event("delete_message")
+    @rate_limited("delete_message")
     def handle_delete_message(data):
         user = _current_user()
         if not user:
@@ -235,91 +470,187 @@ def register_socket_handlers(socketio):
         message.is_deleted = True
         message.content = "[삭제됨]"
         db.session.commit()
-        emit("message_deleted", {"message_id": message.id}, room=_channel_slug(message))
+        recent_messages.update(
+            message.channel_id,
+            serialize_message(message, emoji_map={}),
+            preview=reply_preview(message.content),
+        )
+        emit("message_deleted", {"message_id": message.id}, room=channel_room(message.channel_id, READ))
+
+
+WIRE_VERSION = 2
+
+
+def reply_preview(content):
+    limit = current_app.config.get("REPLY_PREVIEW_LENGTH", 80)
+    if len(content) <= limit:
+        return content
+    return content[: limit - 1].rstrip() + "…"
+
+
+def _reply_previews(message_ids, channel_id=None):
+    """Truncated previews for replied-to messages, keyed by id, in one query.
+
+    Only the first ``REPLY_PREVIEW_LENGTH`` characters are read, so long
+    messages aren't pulled in full for every reply to them.
+    """
+    if not message_ids:
+        return {}
+    limit = current_app.config.get("REPLY_PREVIEW_LENGTH", 80)
+    query = db.session.query(Message.id, db.func.substr(Message.content, 1, limit + 1)).filter(
+        Message.id.in_(message_ids)
+    )
+    if channel_id is not None:
+        query = query.filter(Message.channel_id == channel_id)
+    previews = {message_id: reply_preview(content) for message_id, content in query.all()}
+    missing = [message_id for message_id in message_ids if message_id not in previews]
+    if missing:
+        for message_id, message in archived_by_ids(missing).items():
+            if channel_id is None or message.channel_id == channel_id:
+                previews[message_id] = reply_preview(message.content)
+    return previews
 
 
-def serialize_message(message, emoji_map=None, active_accessory=None):
-    created_at = to_kst(message.created_at)
-    updated_at = to_kst(message.updated_at) if message.updated_at else None
+def serialize_message(message, emoji_map=None, reply_previews=None):
+    """Compact v2 wire format.
+
+    Author display data travels separately as user cards (see
+    ``serialize_user_cards``) and is referenced by ``u``. Raw content is only
+    sent when there is no rendered HTML; timestamps are epoch seconds.
+    Replies carry the replied-to id in ``ri`` and a truncated preview in ``r``.
+    """
     if emoji_map is None:
         emoji_map = _build_emoji_map_for_user(message.user)
-    if active_accessory is None:
-        active_accessory = _active_accessory_map([message.user_id]).get(message.user_id)
-    return {
+    rendered = str(render_chat_content(message.content, emoji_map))
+    payload = {
+        "v": WIRE_VERSION,
         "id": message.id,
-        "channel_id": message.channel_id,
-        "user_id": message.user_id,
-        "user_name": message.user.name,
-        "user_prefix": message.user.email_prefix,
-        "avatar": media_url(message.user.avatar_url),
-        "content": message.content,
-        "rendered_content": str(render_chat_content(message.content, emoji_map)),
-        "reply_to": message.reply_to.content if message.reply_to else None,
-        "is_deleted": message.is_deleted,
-        "name_color": (
-            active_accessory.accessory.text_color
-            if active_accessory and active_accessory.accessory
-            else None
-        ),
-        "accessory_image": (
-            media_url(active_accessory.accessory.image_url)
-            if active_accessory and active_accessory.accessory
-            else None
-        ),
-        "created_at": created_at.strftime("%Y-%m-%d %H:%M"),
-        "updated_at": updated_at.strftime("%Y-%m-%d %H:%M") if updated_at else None,
+        "ch": message.channel_id,
+        "u": message.user_id,
+        "ts": to_epoch(message.created_at),
     }
-
+    if rendered:
+        payload["h"] = rendered
+    else:
+        payload["t"] = message.content
+    if message.reply_to_id:
+        if reply_previews is None:
+            reply_previews = _reply_previews([message.reply_to_id])
+        preview = reply_previews.get(message.reply_to_id)
+        if preview is not None:
+            payload["ri"] = message.reply_to_id
+            payload["r"] = preview
+    if message.is_deleted:
+        payload["x"] = 1
+    if message.updated_at:
+        payload["ed"] = to_epoch(message.updated_at)
+    return payload
 
 
 def serialize_messages(messages):
     if not messages:
         return []
     user_ids = sorted({message.user_id for message in messages})
-    accessory_map = _active_accessory_map(user_ids)
-    emoji_map_cache = {}
-    serialized = []
-    for message in messages:
-        emoji_map = emoji_map_cache.get(message.user_id)
-        if emoji_map is None:
-            emoji_map = _build_emoji_map_for_user(message.user)
-            emoji_map_cache[message.user_id] = emoji_map
-        serialized.append(
-            serialize_message(
-                message,
-                emoji_map=emoji_map,
-                active_accessory=accessory_map.get(message.user_id),
-            )
+    emoji_maps = _build_emoji_maps(user_ids)
+    reply_previews = _reply_previews(
+        sorted({message.reply_to_id for message in messages if message.reply_to_id})
+    )
+    return [
+        serialize_message(
+            message, emoji_map=emoji_maps[message.user_id], reply_previews=reply_previews
         )
-    return serialized
+        for message in messages
+    ]
 
-def _online_payload():
-    users = User.query.filter(User.id.in_(online_users)).all() if online_users else []
+
+HISTORY_PAGE_SIZE = 200
+
+
+def load_recent_messages(channel_id):
+    """Serialize a channel's newest messages from the database and buffer them."""
+    recent_messages.begin_load(channel_id)
+    messages = (
+        Message.query.filter_by(channel_id=channel_id)
+        .order_by(Message.id.desc())
+        .limit(max(recent_messages.per_channel, HISTORY_PAGE_SIZE))
+        .all()
+    )
+    messages.reverse()
+    payloads = serialize_messages(messages)
+    recent_messages.load(
+        channel_id, zip(payloads, [message.reply_to_id for message in messages])
+    )
+    return payloads
+
+
+def recent_channel_messages(channel_id, limit=HISTORY_PAGE_SIZE):
+    """The first history page, from the ring buffer when the channel is warm."""
+    payloads = None
+    if limit <= recent_messages.per_channel:
+        payloads = recent_messages.latest(channel_id, limit)
+    inc("kjb_recent_messages_lookups_total", result="miss" if payloads is None else "hit")
+    if payloads is None:
+        payloads = load_recent_messages(channel_id)[-limit:]
+    return payloads
+
+
+def serialize_user_cards(users):
     accessory_map = _active_accessory_map([user.id for user in users])
-    payload = []
+    cards = []
     for user in users:
+        card = {
+            "id": user.id,
+            "n": user.name,
+            "p": user.email_prefix,
+            "a": media_url(user.avatar_url),
+        }
         active_accessory = accessory_map.get(user.id)
-        payload.append(
-            {
-                "id": user.id,
-                "name": user.name,
-                "email_prefix": user.email_prefix,
-                "avatar": media_url(user.avatar_url),
-                "name_color": (
-                    active_accessory.accessory.text_color
-                    if active_accessory and active_accessory.accessory
-                    else None
-                ),
-                "accessory_image": (
-                    media_url(active_accessory.accessory.image_url)
-                    if active_accessory and active_accessory.accessory
-                    else None
-                ),
-            }
-        )
-    return payload
+        if active_accessory and active_accessory.accessory:
+            card["nc"] = active_accessory.accessory.text_color
+            card["ai"] = media_url(active_accessory.accessory.image_url)
+        cards.append(card)
+    return cards
+
+
+def cards_for_ids(user_ids):
+    """Display cards for ``user_ids``, in that order, built only for cache misses."""
+    found, missing = user_cards.get_many(user_ids)
+    if found:
+        inc("kjb_user_card_lookups_total", len(found), result="hit")
+    if missing:
+        inc("kjb_user_card_lookups_total", len(missing), result="miss")
+        version = user_cards.version
+        built = serialize_user_cards(User.query.filter(User.id.in_(missing)).all())
+        user_cards.store(built, version)
+        found.update((card["id"], card) for card in built)
+    return [found[user_id] for user_id in user_ids if user_id in found]
+
+
+def refresh_user_cards(user_ids):
+    """Drop cached cards after a profile or accessory change and push the new ones.
+
+    Call after the change is committed. Deleted users simply drop out.
+    """
+    user_ids = sorted(set(user_ids))
+    user_cards.invalidate(user_ids)
+    cards = cards_for_ids(user_ids)
+    if cards:
+        socketio_ext.emit("cards_updated", cards)
+
+
+def _online_payload():
+    return cards_for_ids(sorted(online_user_ids()))
+
 
+def refresh_channel_rooms(channels, user_ids=None):
+    """Move live sockets between tier rooms after a permission change, on every worker.
 
-def _channel_slug(message):
-    channel = Channel.query.get(message.channel_id)
-    return channel.slug if channel else "general"
+    Call after the change is committed. Without ``user_ids`` (a channel's
+    defaults changed) every online user is re-tiered.
+    """
+    online = online_user_ids()
+    user_ids = online if user_ids is None else online.intersection(user_ids)
+    changes = channel_tiers(channels, user_ids)
+    if changes:
+        channel_rooms.apply(changes)
+        publish("channel_tiers", changes=changes)
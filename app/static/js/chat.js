@@ -1,4 +1,8 @@
-const socket = io({ transports: ['websocket', 'polling'] });
+const socketOptions = { transports: ['websocket', 'polling'] };
+if (window.KJBMsgpackParser) {
+  socketOptions.parser = window.KJBMsgpackParser;
+}
+const socket = io(socketOptions);
 const chatMain = document.querySelector('.chat-main');
 const channel = chatMain.dataset.channel;
 const channelId = parseInt(chatMain.dataset.channelId, 10);
@@ -10,6 +14,7 @@ const contextMenu = document.getElementById('contextMenu');
 const replyBanner = document.getElementById('replyBanner');
 const typingIndicator = document.getElementById('typingIndicator');
 const onlineLists = document.querySelectorAll('[data-online-list]');
+const threadPanel = document.getElementById('threadPanel');
 let replyToId = null;
 let contextMessageId = null;
 let contextUserId = null;
@@ -18,14 +23,60 @@ let typingTimer = null;
 let lastReadMessageId = 0;
 let readSyncTimer = null;
 let sending = false;
+let retryTimer = null;
 const queuedMessages = [];
+const SEND_BATCH_MAX = 20;
+const userCards = new Map();
+const pendingCardIds = new Set();
+let onlineCardIds = [];
+const kstFormatter = new Intl.DateTimeFormat('sv-SE', {
+  timeZone: 'Asia/Seoul',
+  year: 'numeric',
+  month: '2-digit',
+  day: '2-digit',
+  hour: '2-digit',
+  minute: '2-digit',
+  hour12: false,
+});
+
+const cardsElement = document.getElementById('userCards');
+if (cardsElement) {
+  JSON.parse(cardsElement.textContent || '[]').forEach((card) => userCards.set(card.id, card));
+}
 
 const channelItems = Array.from(document.querySelectorAll('[data-channel-slug][data-channel-id]'));
 const joinedChannelSlugs = new Set(channelItems.map((item) => item.dataset.channelSlug).filter(Boolean));
+const canRead = chatMain.dataset.canRead === 'true';
+let syncCursor = parseInt(chatMain.dataset.syncCursor, 10) || 0;
+let lastSeenMessageId = 0;
+let firstSeenMessageId = 0;
+// Older history is paged in on scroll; null once the channel's start is reached.
+let historyBefore = null;
+let loadingHistory = false;
 
-joinedChannelSlugs.forEach((slug) => {
-  socket.emit('join', { channel: slug });
-});
+// The message list is windowed: every message of the channel stays in
+// `messagesById` (ids in `messageOrder`, ascending), but only the rows in
+// and near the viewport exist in the DOM, between two spacers standing in
+// for the rest. Row heights are measured when a row is drawn and estimated
+// until then. Arrivals, edits and scrolling are applied once per frame.
+const WINDOW_BUFFER_PX = 800;
+const STICK_TO_BOTTOM_PX = 40;
+const messagesById = new Map();
+const messageOrder = [];
+const rowHeights = new Map();
+const renderedRows = new Map();
+const dirtyRows = new Set();
+const pendingMessages = [];
+const topSpacer = document.createElement('div');
+const bottomSpacer = document.createElement('div');
+topSpacer.className = 'chat-spacer';
+bottomSpacer.className = 'chat-spacer';
+let estimatedRowHeight = 72;
+let measuredRows = 0;
+let measuredHeight = 0;
+let orderChanged = false;
+let frameRequested = false;
+let stickToBottom = true;
 
 function setUnreadDot(targetChannelId, isUnread) {
   if (!targetChannelId) return;
@@ -70,54 +121,387 @@ function updateTypingState(nextState) {
   socket.emit('typing', { channel, is_typing: typing });
 }
 
+function escapeHtml(value) {
+  return String(value ?? '').replace(/[&<>"']/g, (char) => ({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;',
+  })[char]);
+}
+
+function formatEpoch(seconds) {
+  if (!seconds) return '';
+  return kstFormatter.format(new Date(seconds * 1000)).replace('T', ' ');
+}
+
+function isEdited(message) {
+  return Boolean(message.ed) && formatEpoch(message.ed) !== formatEpoch(message.ts);
+}
+
+function messageHtml(message) {
+  if (message.h) return message.h;
+  return escapeHtml(message.t || '');
+}
+
+function requestCards(userIds) {
+  const missing = userIds.filter((id) => id && !userCards.has(id) && !pendingCardIds.has(id));
+  if (!missing.length) return;
+  missing.forEach((id) => pendingCardIds.add(id));
+  socket.emit('user_cards', { ids: missing }, (response) => {
+    missing.forEach((id) => pendingCardIds.delete(id));
+    if (!response || !response.ok) return;
+    response.cards.forEach((card) => {
+      userCards.set(card.id, card);
+      refreshAuthor(card);
+    });
+  });
+}
+
+function authorHtml(card) {
+  const prefix = escapeHtml(card.p || '');
+  return `
+    <a href="/profile?usr=${prefix}" ${card.nc ? `style="color:${escapeHtml(card.nc)};"` : ''}>${escapeHtml(card.n || '')}</a>
+    ${card.ai ? `<img src="${escapeHtml(card.ai)}" class="name-accessory" alt="accessory">` : ''}
+  `;
+}
+
+// Rows drawn later pick the card up from `userCards`; only drawn ones need it now.
+function refreshAuthor(card) {
+  renderedRows.forEach((element, messageId) => {
+    if (messagesById.get(messageId).u !== card.id) return;
+    const avatarLink = element.querySelector('.avatar-link');
+    avatarLink.href = `/profile?usr=${card.p}`;
+    avatarLink.querySelector('img').src = card.a;
+    element.querySelector('.message-author').innerHTML = authorHtml(card);
+  });
+}
+
+function messageText(message) {
+  if (!message.h) return message.t || '';
+  const scratch = document.createElement('div');
+  scratch.innerHTML = message.h;
+  return scratch.textContent;
+}
+
+// Server-rendered content is already HTML (escaped when the message had no
+// markup), so it comes back as `h` either way.
+function messageFromRow(element) {
+  const message = {
+    id: parseInt(element.dataset.messageId, 10),
+    ch: channelId,
+    u: parseInt(element.dataset.userId, 10),
+    ts: parseInt(element.dataset.ts, 10),
+    h: element.querySelector('.message-content').innerHTML,
+  };
+  if (element.dataset.ed) message.ed = parseInt(element.dataset.ed, 10);
+  const preview = element.querySelector('.reply-preview');
+  if (preview) {
+    message.ri = parseInt(preview.dataset.replyTo, 10);
+    message.r = preview.textContent.replace(/^↳ /, '');
+  }
+  return message;
+}
+
+function noteSeen(messageId) {
+  if (messageId > lastSeenMessageId) lastSeenMessageId = messageId;
+  if (!firstSeenMessageId || messageId < firstSeenMessageId) firstSeenMessageId = messageId;
+}
+
 function renderMessage(message) {
   const wrapper = document.createElement('div');
   wrapper.className = 'message';
   wrapper.dataset.messageId = message.id;
-  wrapper.dataset.userId = message.user_id;
+  wrapper.dataset.userId = message.u;
+  const card = userCards.get(message.u) || { id: message.u };
+  if (!userCards.has(message.u)) requestCards([message.u]);
 
   wrapper.innerHTML = `
-    <a href="/profile?usr=${message.user_prefix}" class="avatar-link">
-      <img src="${message.avatar}" alt="avatar">
+    <a href="/profile?usr=${escapeHtml(card.p || '')}" class="avatar-link">
+      <img src="${escapeHtml(card.a || '/static/images/default-avatar.svg')}" alt="avatar">
     </a>
     <div class="message-body">
       <div class="message-meta">
-        <a href="/profile?usr=${message.user_prefix}" ${message.name_color ? `style="color:${message.name_color};"` : ''}>${message.user_name}</a>
-        ${message.accessory_image ? `<img src="${message.accessory_image}" class="name-accessory" alt="accessory">` : ''}
-        <span>${message.created_at}</span>
-        ${message.updated_at && message.updated_at !== message.created_at ? '<span class="edited">수정됨</span>' : ''}
+        <span class="message-author">${authorHtml(card)}</span>
+        <span>${formatEpoch(message.ts)}</span>
+        ${isEdited(message) ? '<span class="edited">수정됨</span>' : ''}
       </div>
-      ${message.reply_to ? `<div class="reply-preview">↳ ${message.reply_to}</div>` : ''}
-      <div class="message-content">${message.rendered_content || message.content}</div>
+      ${message.r ? `<div class="reply-preview" data-reply-to="${message.ri}">↳ ${escapeHtml(message.r)}</div>` : ''}
+      <div class="message-content">${messageHtml(message)}</div>
     </div>
   `;
   return wrapper;
 }
 
+function openThread(rootId) {
+  fetch(`/chat/thread/${rootId}`, { headers: { Accept: 'application/json' } })
+    .then((response) => (response.ok ? response.json() : null))
+    .then((thread) => {
+      if (!thread) return;
+      thread.cards.forEach((card) => userCards.set(card.id, card));
+      const list = threadPanel.querySelector('.thread-messages');
+      const fragment = document.createDocumentFragment();
+      [thread.root, ...thread.replies].forEach((message) => {
+        const element = renderMessage(message);
+        element.removeAttribute('data-message-id');
+        fragment.appendChild(element);
+      });
+      list.replaceChildren(fragment);
+      threadPanel.classList.remove('hidden');
+    })
+    .catch(() => {});
+}
+
+function rowHeight(messageId) {
+  return rowHeights.get(messageId) || estimatedRowHeight;
+}
+
+// Index of `messageId` in `messageOrder`, or where it would go.
+function orderIndex(messageId) {
+  let low = 0;
+  let high = messageOrder.length;
+  while (low < high) {
+    const middle = (low + high) >> 1;
+    if (messageOrder[middle] < messageId) low = middle + 1;
+    else high = middle;
+  }
+  return low;
+}
+
+function insertMessage(message) {
+  if (messagesById.has(message.id)) return false;
+  messagesById.set(message.id, message);
+  const last = messageOrder[messageOrder.length - 1];
+  if (last === undefined || message.id > last) {
+    messageOrder.push(message.id);
+  } else {
+    messageOrder.splice(orderIndex(message.id), 0, message.id);
+  }
+  noteSeen(message.id);
+  orderChanged = true;
+  return true;
+}
+
+function scheduleRender() {
+  if (frameRequested) return;
+  frameRequested = true;
+  requestAnimationFrame(renderWindow);
+}
+
+function isAtBottom() {
+  return messageList.scrollHeight - messageList.scrollTop - messageList.clientHeight < STICK_TO_BOTTOM_PX;
+}
+
+// Indexes of the first and last message to draw, and the row at the top of
+// the view with its offset from there, as far as the row heights known or
+// estimated so far say.
+function visibleRange() {
+  const count = messageOrder.length;
+  if (!count) return { first: 0, last: -1, anchor: null };
+  if (stickToBottom) {
+    let first = count - 1;
+    let covered = 0;
+    while (first > 0 && covered < messageList.clientHeight + WINDOW_BUFFER_PX) {
+      covered += rowHeight(messageOrder[first]);
+      first -= 1;
+    }
+    return { first, last: count - 1, anchor: null };
+  }
+  // Rows start one flex gap below the top spacer.
+  const viewTop = messageList.scrollTop - topSpacer.offsetTop - rowGap();
+  let index = 0;
+  let offset = 0;
+  while (index < count - 1 && offset + rowHeight(messageOrder[index]) <= viewTop) {
+    offset += rowHeight(messageOrder[index]);
+    index += 1;
+  }
+  let first = index;
+  let above = 0;
+  while (first > 0 && above < WINDOW_BUFFER_PX) {
+    first -= 1;
+    above += rowHeight(messageOrder[first]);
+  }
+  let last = index;
+  let below = offset - viewTop;
+  while (last < count - 1 && below < messageList.clientHeight + WINDOW_BUFFER_PX) {
+    below += rowHeight(messageOrder[last]);
+    last += 1;
+  }
+  return { first, last, anchor: { messageId: messageOrder[index], offset: offset - viewTop } };
+}
+
+function drawnElements() {
+  const elements = [];
+  let element = topSpacer.nextElementSibling;
+  while (element && element !== bottomSpacer) {
+    elements.push(element);
+    element = element.nextElementSibling;
+  }
+  return elements;
+}
+
+// The first drawn row at or below the top of the viewport, and where it is.
+function scrollAnchor() {
+  const element = drawnElements().find((row) => row.offsetTop + row.offsetHeight > messageList.scrollTop);
+  if (!element) return null;
+  return {
+    messageId: parseInt(element.dataset.messageId, 10),
+    offset: element.offsetTop - messageList.scrollTop,
+  };
+}
+
+function restoreAnchor(anchor) {
+  const element = anchor && renderedRows.get(anchor.messageId);
+  if (element) messageList.scrollTop = element.offsetTop - anchor.offset;
+}
+
+function placeSpacers(first, last) {
+  let above = 0;
+  for (let index = 0; index < first; index += 1) above += rowHeight(messageOrder[index]);
+  let drawn = 0;
+  for (let index = first; index <= last; index += 1) drawn += rowHeight(messageOrder[index]);
+  const total = measuredHeight + (messageOrder.length - rowHeights.size) * estimatedRowHeight;
+  topSpacer.style.height = `${above}px`;
+  bottomSpacer.style.height = `${Math.max(0, total - above - drawn)}px`;
+}
+
+function forgetHeight(messageId) {
+  if (!rowHeights.has(messageId)) return;
+  measuredHeight -= rowHeights.get(messageId);
+  rowHeights.delete(messageId);
+}
+
+function rowGap() {
+  return parseFloat(getComputedStyle(messageList).rowGap) || 0;
+}
+
+function measureRow(messageId, element, gap) {
+  const height = element.offsetHeight + gap;
+  if (rowHeights.has(messageId)) {
+    measuredHeight -= rowHeights.get(messageId);
+  } else {
+    measuredRows += 1;
+    estimatedRowHeight += (height - estimatedRowHeight) / measuredRows;
+  }
+  measuredHeight += height;
+  rowHeights.set(messageId, height);
+}
+
+function renderWindow() {
+  frameRequested = false;
+  stickToBottom = stickToBottom || isAtBottom();
+  const anchor = stickToBottom ? null : scrollAnchor();
+  let arrived = false;
+  pendingMessages.splice(0).forEach((message) => {
+    if (!insertMessage(message)) return;
+    arrived = true;
+    markChannelRead(message.id);
+  });
+  if (arrived) setUnreadDot(channelId, false);
+  const drawn = orderChanged && anchor ? drawnElements() : [];
+  orderChanged = false;
+  if (drawn.length) {
+    // Rows may have arrived above the drawn ones: move the spacers to match
+    // before choosing what to draw, so the view doesn't jump.
+    const ids = drawn.map((element) => parseInt(element.dataset.messageId, 10));
+    placeSpacers(orderIndex(ids[0]), orderIndex(ids[ids.length - 1]));
+    restoreAnchor(anchor);
+  }
+
+  const range = visibleRange();
+  drawRows(range.first, range.last);
+  if (stickToBottom) {
+    messageList.scrollTop = messageList.scrollHeight;
+  } else {
+    // Measuring drawn rows moves everything estimated around them; put the
+    // row that was at the top of the view back where it was. The row seen
+    // there before this frame is measured already, so it wins if still drawn.
+    restoreAnchor(anchor && renderedRows.has(anchor.messageId) ? anchor : range.anchor);
+  }
+}
+
+function drawRows(first, last) {
+  const wanted = new Set(messageOrder.slice(first, last + 1));
+  renderedRows.forEach((element, messageId) => {
+    if (!wanted.has(messageId)) {
+      element.remove();
+      renderedRows.delete(messageId);
+    }
+  });
+  const fresh = [];
+  let previous = topSpacer;
+  for (let index = first; index <= last; index += 1) {
+    const messageId = messageOrder[index];
+    let element = renderedRows.get(messageId);
+    if (element && dirtyRows.has(messageId)) {
+      const replacement = renderMessage(messagesById.get(messageId));
+      element.replaceWith(replacement);
+      element = replacement;
+      renderedRows.set(messageId, element);
+      fresh.push(messageId);
+    } else if (!element) {
+      element = renderMessage(messagesById.get(messageId));
+      renderedRows.set(messageId, element);
+      fresh.push(messageId);
+    } else if (!rowHeights.has(messageId)) {
+      fresh.push(messageId);
+    }
+    if (previous.nextSibling !== element) previous.after(element);
+    previous = element;
+  }
+  dirtyRows.clear();
+
+  const gap = rowGap();
+  fresh.forEach((messageId) => measureRow(messageId, renderedRows.get(messageId), gap));
+  placeSpacers(first, last);
+}
+
 function appendMessage(message) {
-  const element = renderMessage(message);
-  messageList.appendChild(element);
-  messageList.scrollTop = messageList.scrollHeight;
-  setUnreadDot(channelId, false);
-  markChannelRead(message.id);
+  if (messagesById.has(message.id)) return;
+  pendingMessages.push(message);
+  scheduleRender();
 }
 
-function updateOnlineList(users) {
+function prependMessages(messages) {
+  const added = messages.filter(insertMessage).length;
+  if (!added) return;
+  stickToBottom = false;
+  scheduleRender();
+}
+
+function loadOlderMessages() {
+  if (!canRead || loadingHistory || !historyBefore) return;
+  loadingHistory = true;
+  const params = new URLSearchParams({ id: channel, before: historyBefore });
+  fetch(`/chat/history?${params}`, { headers: { Accept: 'application/json' } })
+    .then((response) => (response.ok ? response.json() : null))
+    .then((page) => {
+      if (!page) return;
+      page.cards.forEach((card) => userCards.set(card.id, card));
+      prependMessages(page.messages);
+      historyBefore = page.next;
+    })
+    .catch(() => {})
+    .finally(() => {
+      loadingHistory = false;
+    });
+}
+
+function updateOnlineList(cards) {
+  cards.forEach((card) => userCards.set(card.id, card));
+  onlineCardIds = cards.map((card) => card.id);
   onlineLists.forEach((list) => {
     list.innerHTML = '';
-    users.forEach((user) => {
+    cards.forEach((card) => {
       const li = document.createElement('li');
       li.className = 'online-item';
       li.innerHTML = `
-        <a href="/profile?usr=${user.email_prefix}">
-          <img src="${user.avatar}" alt="avatar">
+        <a href="/profile?usr=${escapeHtml(card.p)}">
+          <img src="${escapeHtml(card.a)}" alt="avatar">
         </a>
-        <a href="/profile?usr=${user.email_prefix}">${user.name}</a>
-        ${user.accessory_image ? `<img src="${user.accessory_image}" class="name-accessory" alt="accessory">` : ''}
+        <a href="/profile?usr=${escapeHtml(card.p)}">${escapeHtml(card.n)}</a>
+        ${card.ai ? `<img src="${escapeHtml(card.ai)}" class="name-accessory" alt="accessory">` : ''}
       `;
       const nameLink = li.querySelectorAll('a')[1];
-      if (nameLink && user.name_color) {
-        nameLink.style.color = user.name_color;
+      if (nameLink && card.nc) {
+        nameLink.style.color = card.nc;
       }
       list.appendChild(li);
     });
@@ -133,6 +517,20 @@ function enqueueMessage(payload) {
   queuedMessages.push(payload);
 }
 
+function newClientId() {
+  if (window.crypto && window.crypto.randomUUID) return window.crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+function handleSendAck(response) {
+  if (!response || !response.ok) return;
+  if (response.message && response.message.ch === channelId) {
+    markChannelRead(response.message.id);
+  }
+}
+
+// Payloads keep their client_id across retries, so a resend of something the
+// server already stored is answered with the original message.
 function trySend(payload) {
   if (!payload || sending) return;
   sending = true;
@@ -144,28 +542,134 @@ function trySend(payload) {
       enqueueMessage(payload);
       return;
     }
-    if (!response.ok) {
+    if (response.retry_after) {
+      queuedMessages.unshift(payload);
+      retryQueueAfter(response.retry_after);
       return;
     }
-    if (response.message && response.message.channel_id === channelId) {
-      markChannelRead(response.message.id);
-    }
+    handleSendAck(response);
+    flushQueue();
   });
 }
 
+// Rate-limited sends stay queued and go out once the server says they can.
+function retryQueueAfter(seconds) {
+  if (retryTimer) return;
+  retryTimer = setTimeout(() => {
+    retryTimer = null;
+    flushQueue();
+  }, seconds * 1000);
+}
+
 function flushQueue() {
   if (sending || !queuedMessages.length) return;
-  const next = queuedMessages.shift();
-  trySend(next);
+  if (queuedMessages.length === 1) {
+    trySend(queuedMessages.shift());
+    return;
+  }
+  const batch = queuedMessages.splice(0, SEND_BATCH_MAX);
+  sending = true;
+  setSendDisabled(true);
+  socket.timeout(10000).emit('send_messages', { messages: batch }, (error, response) => {
+    sending = false;
+    setSendDisabled(!canSend);
+    if (error || !response || !response.ok) {
+      queuedMessages.unshift(...batch);
+      if (response && response.retry_after) retryQueueAfter(response.retry_after);
+      return;
+    }
+    (response.results || []).forEach(handleSendAck);
+    flushQueue();
+  });
+}
+
+function replaceMessage(message) {
+  messagesById.set(message.id, message);
+  if (renderedRows.has(message.id)) {
+    dirtyRows.add(message.id);
+    forgetHeight(message.id);
+    scheduleRender();
+  }
+}
+
+function applyUpdate(message) {
+  if (!messagesById.has(message.id)) return;
+  if (message.x) {
+    applyDelete(message.id);
+    return;
+  }
+  replaceMessage(message);
+}
+
+function applyDelete(messageId) {
+  const message = messagesById.get(messageId);
+  if (!message) return;
+  const deleted = { ...message, t: '[삭제됨]', x: 1 };
+  delete deleted.h;
+  replaceMessage(deleted);
+}
+
+function joinCurrentChannel() {
+  const payload = { channel };
+  if (canRead) {
+    payload.last_id = lastSeenMessageId;
+    payload.first_id = firstSeenMessageId || lastSeenMessageId;
+    payload.cursor = syncCursor;
+  }
+  socket.emit('join', payload, (response) => {
+    if (!response) return;
+    if (response.retry_after) {
+      setTimeout(joinCurrentChannel, response.retry_after * 1000);
+      return;
+    }
+    if (response.reload) {
+      // Too much was missed to replay; the page render is cheaper.
+      window.location.reload();
+      return;
+    }
+    (response.messages || []).forEach(appendMessage);
+    (response.updated || []).forEach(applyUpdate);
+    if (response.cursor) syncCursor = response.cursor;
+  });
 }
 
 socket.on('connect', () => {
-  joinedChannelSlugs.forEach((slug) => socket.emit('join', { channel: slug }));
+  joinedChannelSlugs.forEach((slug) => {
+    if (slug !== channel) socket.emit('join', { channel: slug });
+  });
+  joinCurrentChannel();
   flushQueue();
 });
 
-socket.on('online_update', (users) => {
-  updateOnlineList(users);
+socket.on('online_update', (cards) => {
+  updateOnlineList(cards);
+});
+
+function setUnreadBadges(count) {
+  document.querySelectorAll('[data-unread-badge]').forEach((badge) => {
+    const value = count === null ? (parseInt(badge.textContent, 10) || 0) + 1 : count;
+    badge.textContent = value;
+    badge.hidden = value <= 0;
+  });
+}
+
+// `unread` is null when the server had no count cached; the push is one more.
+socket.on('notification', (payload) => {
+  setUnreadBadges(payload.unread);
+});
+
+socket.on('notification_count', (payload) => {
+  setUnreadBadges(payload.unread);
+});
+
+socket.on('cards_updated', (cards) => {
+  cards.forEach((card) => {
+    userCards.set(card.id, card);
+    refreshAuthor(card);
+  });
+  if (onlineCardIds.some((id) => cards.some((card) => card.id === id))) {
+    updateOnlineList(onlineCardIds.map((id) => userCards.get(id)).filter(Boolean));
+  }
 });
 
 socket.on('typing_update', (payload) => {
@@ -182,41 +686,56 @@ socket.on('typing_update', (payload) => {
 });
 
 socket.on('new_message', (message) => {
-  if (message.channel_id !== channelId) {
-    setUnreadDot(message.channel_id, true);
+  if (message.ch !== channelId) {
+    setUnreadDot(message.ch, true);
     return;
   }
   appendMessage(message);
 });
 
-socket.on('message_updated', (message) => {
-  const element = messageList.querySelector(`[data-message-id="${message.id}"]`);
-  if (!element) return;
-  element.querySelector('.message-content').textContent = message.content;
-  if (message.rendered_content) {
-    element.querySelector('.message-content').innerHTML = message.rendered_content;
-  }
-  const meta = element.querySelector('.message-meta');
-  if (!meta.querySelector('.edited')) {
-    const edited = document.createElement('span');
-    edited.className = 'edited';
-    edited.textContent = '수정됨';
-    meta.appendChild(edited);
-  }
+// Channels this user may see but not read only say that something was posted.
+socket.on('channel_activity', (payload) => {
+  if (payload.ch !== channelId) setUnreadDot(payload.ch, true);
 });
 
+socket.on('message_updated', applyUpdate);
+
 socket.on('message_deleted', (payload) => {
-  const element = messageList.querySelector(`[data-message-id="${payload.message_id}"]`);
-  if (!element) return;
-  element.querySelector('.message-content').textContent = '[삭제됨]';
+  applyDelete(payload.message_id);
+});
+
+messageList.addEventListener('scroll', () => {
+  stickToBottom = isAtBottom();
+  scheduleRender();
+  if (messageList.scrollTop < 80) loadOlderMessages();
+});
+
+window.addEventListener('resize', () => {
+  // Wrapping changes with the width; measure rows again as they are drawn.
+  rowHeights.clear();
+  measuredRows = 0;
+  measuredHeight = 0;
+  scheduleRender();
+});
+
+messageList.addEventListener('click', (event) => {
+  const preview = event.target.closest('.reply-preview[data-reply-to]');
+  if (!preview) return;
+  openThread(preview.dataset.replyTo);
+});
+
+threadPanel.querySelector('[data-thread-close]').addEventListener('click', () => {
+  threadPanel.classList.add('hidden');
 });
 
 sendButton.addEventListener('click', () => {
   if (!canSend || sending) return;
   const content = input.value.trim();
   if (!content) return;
-  const payload = { channel, content, reply_to: replyToId };
-  trySend(payload);
+  const payload = { channel, content, reply_to: replyToId, client_id: newClientId() };
+  // While rate limited, queue behind the waiting messages to keep their order.
+  if (retryTimer) enqueueMessage(payload);
+  else trySend(payload);
   input.value = '';
   replyToId = null;
   replyBanner.classList.add('hidden');
@@ -248,7 +767,7 @@ messageList.addEventListener('contextmenu', (event) => {
   const messageElement = event.target.closest('.message');
   if (!messageElement) return;
   event.preventDefault();
-  contextMessageId = messageElement.dataset.messageId;
+  contextMessageId = parseInt(messageElement.dataset.messageId, 10);
   contextUserId = parseInt(messageElement.dataset.userId, 10);
   const isOwner = contextUserId === window.KJB_CURRENT_USER_ID;
   contextMenu.querySelector('[data-action="edit"]').style.display = isOwner ? 'block' : 'none';
@@ -273,8 +792,8 @@ contextMenu.addEventListener('click', (event) => {
   if (!action) return;
   if (action === 'reply') {
     replyToId = contextMessageId;
-    const messageElement = messageList.querySelector(`[data-message-id="${contextMessageId}"]`);
-    const content = messageElement ? messageElement.querySelector('.message-content').textContent : '';
+    const message = messagesById.get(contextMessageId);
+    const content = message ? messageText(message) : '';
     replyBanner.textContent = `답장: ${content}`;
     replyBanner.classList.remove('hidden');
   }
@@ -292,9 +811,19 @@ contextMenu.addEventListener('click', (event) => {
   contextMenu.classList.add('hidden');
 });
 
-const lastMessage = messageList.querySelector('.message:last-of-type');
-if (lastMessage) {
-  markChannelRead(parseInt(lastMessage.dataset.messageId, 10));
+// The first page is rendered by the server; its rows are reused as they are
+// and the map is rebuilt from them, so the page doesn't carry it twice.
+messageList.querySelectorAll('.message[data-message-id]').forEach((element) => {
+  const message = messageFromRow(element);
+  if (insertMessage(message)) renderedRows.set(message.id, element);
+  else element.remove();
+});
+messageList.prepend(topSpacer);
+messageList.append(bottomSpacer);
+renderWindow();
+if (lastSeenMessageId) {
+  markChannelRead(lastSeenMessageId);
 }
+historyBefore = firstSeenMessageId || null;
 setUnreadDot(channelId, false);
 setSendDisabled(!canSend);
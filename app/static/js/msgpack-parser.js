@@ -0,0 +1,200 @@
+// Socket.IO parser speaking MessagePack, wire compatible with python-socketio's
+// serializer='msgpack' (and socket.io-msgpack-parser). Loaded only when the
+// server is configured with SOCKETIO_SERIALIZER=msgpack.
+(function () {
+  const textEncoder = new TextEncoder();
+  const textDecoder = new TextDecoder();
+
+  function encodeValue(value, out) {
+    if (value === null || value === undefined) {
+      out.push(0xc0);
+    } else if (value === false) {
+      out.push(0xc2);
+    } else if (value === true) {
+      out.push(0xc3);
+    } else if (typeof value === 'number') {
+      encodeNumber(value, out);
+    } else if (typeof value === 'string') {
+      const bytes = textEncoder.encode(value);
+      const length = bytes.length;
+      if (length < 32) out.push(0xa0 | length);
+      else if (length < 0x100) out.push(0xd9, length);
+      else if (length < 0x10000) out.push(0xda, length >> 8, length & 0xff);
+      else out.push(0xdb, (length >>> 24) & 0xff, (length >> 16) & 0xff, (length >> 8) & 0xff, length & 0xff);
+      for (let i = 0; i < length; i += 1) out.push(bytes[i]);
+    } else if (value instanceof ArrayBuffer || ArrayBuffer.isView(value)) {
+      const bytes = value instanceof ArrayBuffer ? new Uint8Array(value) : new Uint8Array(value.buffer, value.byteOffset, value.byteLength);
+      const length = bytes.length;
+      if (length < 0x100) out.push(0xc4, length);
+      else if (length < 0x10000) out.push(0xc5, length >> 8, length & 0xff);
+      else out.push(0xc6, (length >>> 24) & 0xff, (length >> 16) & 0xff, (length >> 8) & 0xff, length & 0xff);
+      for (let i = 0; i < length; i += 1) out.push(bytes[i]);
+    } else if (Array.isArray(value)) {
+      const length = value.length;
+      if (length < 16) out.push(0x90 | length);
+      else if (length < 0x10000) out.push(0xdc, length >> 8, length & 0xff);
+      else out.push(0xdd, (length >>> 24) & 0xff, (length >> 16) & 0xff, (length >> 8) & 0xff, length & 0xff);
+      value.forEach((item) => encodeValue(item, out));
+    } else if (typeof value === 'object') {
+      const keys = Object.keys(value).filter((key) => value[key] !== undefined && typeof value[key] !== 'function');
+      const length = keys.length;
+      if (length < 16) out.push(0x80 | length);
+      else if (length < 0x10000) out.push(0xde, length >> 8, length & 0xff);
+      else out.push(0xdf, (length >>> 24) & 0xff, (length >> 16) & 0xff, (length >> 8) & 0xff, length & 0xff);
+      keys.forEach((key) => {
+        encodeValue(key, out);
+        encodeValue(value[key], out);
+      });
+    } else {
+      out.push(0xc0);
+    }
+  }
+
+  function encodeNumber(value, out) {
+    if (Number.isInteger(value) && Math.abs(value) <= 0xffffffff) {
+      if (value >= 0) {
+        if (value < 0x80) out.push(value);
+        else if (value < 0x100) out.push(0xcc, value);
+        else if (value < 0x10000) out.push(0xcd, value >> 8, value & 0xff);
+        else out.push(0xce, (value >>> 24) & 0xff, (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff);
+        return;
+      }
+      if (value >= -32) out.push(value & 0xff);
+      else if (value >= -0x80) out.push(0xd0, value & 0xff);
+      else if (value >= -0x8000) out.push(0xd1, (value >> 8) & 0xff, value & 0xff);
+      else if (value >= -0x80000000) out.push(0xd2, (value >> 24) & 0xff, (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff);
+      else encodeFloat(value, out);
+      return;
+    }
+    encodeFloat(value, out);
+  }
+
+  function encodeFloat(value, out) {
+    const view = new DataView(new ArrayBuffer(8));
+    view.setFloat64(0, value);
+    out.push(0xcb);
+    for (let i = 0; i < 8; i += 1) out.push(view.getUint8(i));
+  }
+
+  function decode(buffer) {
+    const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    let offset = 0;
+
+    function str(length) {
+      const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+      offset += length;
+      return value;
+    }
+    function bin(length) {
+      const value = bytes.slice(offset, offset + length).buffer;
+      offset += length;
+      return value;
+    }
+    function array(length) {
+      const value = new Array(length);
+      for (let i = 0; i < length; i += 1) value[i] = read();
+      return value;
+    }
+    function map(length) {
+      const value = {};
+      for (let i = 0; i < length; i += 1) {
+        const key = read();
+        value[key] = read();
+      }
+      return value;
+    }
+    function u8() { const v = view.getUint8(offset); offset += 1; return v; }
+    function u16() { const v = view.getUint16(offset); offset += 2; return v; }
+    function u32() { const v = view.getUint32(offset); offset += 4; return v; }
+    function u64() { const hi = u32(); const lo = u32(); return hi * 0x100000000 + lo; }
+    function i64() { const hi = view.getInt32(offset); offset += 4; const lo = u32(); return hi * 0x100000000 + lo; }
+
+    function read() {
+      const type = u8();
+      if (type < 0x80) return type;
+      if (type < 0x90) return map(type & 0x0f);
+      if (type < 0xa0) return array(type & 0x0f);
+      if (type < 0xc0) return str(type & 0x1f);
+      if (type >= 0xe0) return type - 0x100;
+      switch (type) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xc4: return bin(u8());
+        case 0xc5: return bin(u16());
+        case 0xc6: return bin(u32());
+        case 0xca: { const v = view.getFloat32(offset); offset += 4; return v; }
+        case 0xcb: { const v = view.getFloat64(offset); offset += 8; return v; }
+        case 0xcc: return u8();
+        case 0xcd: return u16();
+        case 0xce: return u32();
+        case 0xcf: return u64();
+        case 0xd0: { const v = view.getInt8(offset); offset += 1; return v; }
+        case 0xd1: { const v = view.getInt16(offset); offset += 2; return v; }
+        case 0xd2: { const v = view.getInt32(offset); offset += 4; return v; }
+        case 0xd3: return i64();
+        case 0xd9: return str(u8());
+        case 0xda: return str(u16());
+        case 0xdb: return str(u32());
+        case 0xdc: return array(u16());
+        case 0xdd: return array(u32());
+        case 0xde: return map(u16());
+        case 0xdf: return map(u32());
+        default: throw new Error(`unsupported msgpack type 0x${type.toString(16)}`);
+      }
+    }
+
+    return read();
+  }
+
+  class Encoder {
+    encode(packet) {
+      const out = [];
+      encodeValue(packet, out);
+      return [new Uint8Array(out)];
+    }
+  }
+
+  class Decoder {
+    constructor() {
+      this.listeners = {};
+    }
+
+    on(event, listener) {
+      (this.listeners[event] = this.listeners[event] || []).push(listener);
+      return this;
+    }
+
+    off(event, listener) {
+      if (!event) {
+        this.listeners = {};
+      } else if (!listener) {
+        delete this.listeners[event];
+      } else {
+        this.listeners[event] = (this.listeners[event] || []).filter((item) => item !== listener);
+      }
+      return this;
+    }
+
+    emit(event, ...args) {
+      (this.listeners[event] || []).slice().forEach((listener) => listener.apply(this, args));
+      return this;
+    }
+
+    add(chunk) {
+      if (typeof chunk === 'string') {
+        throw new Error('msgpack parser received a text frame');
+      }
+      const packet = decode(chunk);
+      if (typeof packet.type !== 'number' || typeof packet.nsp !== 'string') {
+        throw new Error('invalid msgpack packet');
+      }
+      this.emit('decoded', packet);
+    }
+
+    destroy() {}
+  }
+
+  window.KJBMsgpackParser = { protocol: 5, Encoder, Decoder };
+})();
@@ -0,0 +1,126 @@
+// Typeahead for user fields backed by /users/search.
+//
+// <div class="user-picker" data-user-picker data-search-url="/users/search">
+//   <input type="text" data-user-search>          <- what the user types
+//   <input type="hidden" name="user_id" data-user-id>  <- optional
+// </div>
+//
+// With a hidden [data-user-id] input, picking a result stores its id there
+// and the form can't be submitted until a result is picked. Without one,
+// picking fills the text input with the user's email prefix, which only
+// admins get back from the search.
+const USER_SEARCH_DELAY = 150;
+const USER_SEARCH_PROMPT = '목록에서 사용자를 선택해주세요.';
+
+const initUserPicker = (picker) => {
+  const input = picker.querySelector('[data-user-search]');
+  const idField = picker.querySelector('[data-user-id]');
+  const searchUrl = picker.dataset.searchUrl || '/users/search';
+  const results = document.createElement('ul');
+  results.className = 'user-picker-results';
+  results.hidden = true;
+  picker.appendChild(results);
+  input.setAttribute('autocomplete', 'off');
+
+  let timer = null;
+  let controller = null;
+  let items = [];
+  let activeIndex = -1;
+
+  const close = () => {
+    results.hidden = true;
+    activeIndex = -1;
+  };
+
+  const highlight = (index) => {
+    activeIndex = index;
+    results.querySelectorAll('li').forEach((row, rowIndex) => {
+      row.classList.toggle('active', rowIndex === index);
+    });
+  };
+
+  const pick = (user) => {
+    if (idField) {
+      idField.value = user.id;
+      input.value = `${user.name} (${user.email_prefix || `@${user.username}`})`;
+      input.setCustomValidity('');
+    } else {
+      input.value = user.email_prefix;
+    }
+    close();
+  };
+
+  const render = () => {
+    results.textContent = '';
+    items.forEach((user, index) => {
+      const row = document.createElement('li');
+      const name = document.createElement('strong');
+      name.textContent = user.name;
+      const detail = document.createElement('span');
+      detail.textContent = user.email_prefix ? `@${user.username} · ${user.email_prefix}` : `@${user.username}`;
+      row.append(name, detail);
+      row.addEventListener('mousedown', (event) => {
+        // Keep focus in the input so blur doesn't close the list first.
+        event.preventDefault();
+        pick(user);
+      });
+      row.addEventListener('mouseenter', () => highlight(index));
+      results.appendChild(row);
+    });
+    results.hidden = items.length === 0;
+    highlight(items.length ? 0 : -1);
+  };
+
+  const search = () => {
+    const query = input.value.trim();
+    controller?.abort();
+    if (!query) {
+      items = [];
+      render();
+      return;
+    }
+    controller = new AbortController();
+    const params = new URLSearchParams({ q: query });
+    fetch(`${searchUrl}?${params}`, {
+      headers: { Accept: 'application/json' },
+      signal: controller.signal,
+    })
+      .then((response) => (response.ok ? response.json() : { items: [] }))
+      .then((data) => {
+        items = data.items || [];
+        render();
+      })
+      .catch(() => {});
+  };
+
+  if (idField) {
+    input.setCustomValidity(idField.value ? '' : USER_SEARCH_PROMPT);
+  }
+
+  input.addEventListener('input', () => {
+    if (idField) {
+      idField.value = '';
+      input.setCustomValidity(USER_SEARCH_PROMPT);
+    }
+    clearTimeout(timer);
+    timer = setTimeout(search, USER_SEARCH_DELAY);
+  });
+
+  input.addEventListener('keydown', (event) => {
+    if (results.hidden) return;
+    if (event.key === 'ArrowDown' || event.key === 'ArrowUp') {
+      event.preventDefault();
+      const step = event.key === 'ArrowDown' ? 1 : -1;
+      highlight((activeIndex + step + items.length) % items.length);
+    } else if (event.key === 'Enter' && activeIndex >= 0) {
+      event.preventDefault();
+      pick(items[activeIndex]);
+    } else if (event.key === 'Escape') {
+      close();
+    }
+  });
+
+  input.addEventListener('blur', close);
+};
+
+document.querySelectorAll('[data-user-picker]').forEach(initUserPicker);
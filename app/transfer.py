@@ -0,0 +1,326 @@
+"""Channel export and bulk import as NDJSON.
+
+An export is one JSON object per line: a ``channel`` header, then the
+channel's messages in id order (archived and hot, merged), each author
+introduced by a ``user`` line before their first message::
+
+    {"type": "channel", "format": 1, "slug": "general", "name": "# general", ...}
+    {"type": "user", "id": 3, "email": "...", "email_prefix": "...", "username": "...", "name": "..."}
+    {"type": "message", "id": 10, "user_id": 3, "content": "...", "reply_to_id": null, ...}
+
+Hot rows stream through a server-side cursor (``yield_per``) and archive
+segments are decoded one at a time, so memory stays flat whatever the
+channel's size. Both directions write a small JSON checkpoint after every
+batch and continue from it when run again with the same checkpoint path.
+
+An import keeps message ids relative to each other: every id is shifted by
+one offset past the highest id in use, so replies resolve without an id map
+and a resumed import uses the same offset. Authors are matched by email;
+missing ones are created without a usable password. Client ids are dropped
+(they only deduplicate live sends). With ``defer_indexes`` the secondary
+message indexes are dropped for the load and rebuilt once at the end, which
+is only sensible while nothing else uses the database.
+
+Imported messages get ids above every existing one, so an import appended
+to a live channel sorts after its current messages; running workers pick
+the new messages up once their buffer for the channel is reloaded. The
+usual case is restoring into a new channel.
+"""
+import heapq
+import json
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+
+from .archive import read_segment
+from .extensions import db
+from .models import Channel, Message, MessageArchiveSegment, User
+
+EXPORT_FORMAT = 1
+CHANNEL_FIELDS = (
+    "slug",
+    "name",
+    "description",
+    "priority",
+    "default_can_view",
+    "default_can_read",
+    "default_can_send",
+    "archive_after_days",
+)
+MESSAGE_FIELDS = ("id", "user_id", "content", "reply_to_id", "is_deleted", "created_at", "updated_at")
+DATETIME_FIELDS = ("created_at", "updated_at")
+USER_FIELDS = ("id", "email", "email_prefix", "username", "name")
+# Stored for imported authors with no local account: check_password_hash
+# rejects it, so the account exists but can't sign in until reset.
+UNUSABLE_PASSWORD = "!"
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def write_checkpoint(path, state):
+    if not path:
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as handle:
+        json.dump(state, handle)
+    os.replace(temporary, path)
+
+
+class Throughput:
+    """Rows and bytes per second since the start, for progress lines."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, rows, size):
+        self.rows += rows
+        self.bytes += size
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"{self.rows} rows, {self.bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+            f"({self.rows / elapsed:.0f} rows/s, {self.bytes / 1e6 / elapsed:.1f} MB/s)"
+        )
+
+
+def _line(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _hot_rows(channel_id, after_id, batch_size):
+    columns = [getattr(Message, field) for field in MESSAGE_FIELDS]
+    query = (
+        db.session.query(*columns)
+        .filter(Message.channel_id == channel_id, Message.id > after_id)
+        .order_by(Message.id.asc())
+        .execution_options(yield_per=batch_size)
+    )
+    for row in query:
+        record = dict(zip(MESSAGE_FIELDS, row))
+        record["is_deleted"] = bool(record["is_deleted"])
+        for field in DATETIME_FIELDS:
+            record[field] = _iso(record[field])
+        yield record
+
+
+def _archived_rows(channel_id, after_id):
+    segments = (
+        db.session.query(MessageArchiveSegment)
+        .filter(MessageArchiveSegment.channel_id == channel_id, MessageArchiveSegment.last_id > after_id)
+        .order_by(MessageArchiveSegment.first_id.asc())
+        .all()
+    )
+    for segment in segments:
+        for row in read_segment(segment):
+            if row["id"] > after_id:
+                yield {field: row.get(field) for field in MESSAGE_FIELDS}
+
+
+def export_channel(channel, output, checkpoint_path=None, batch_size=5000, progress=None):
+    """Write ``channel`` as NDJSON to the binary file ``output``; returns a ``Throughput``.
+
+    With a checkpoint from an earlier run, ``output`` must be the same file
+    opened for appending: it is cut back to the last checkpointed size and
+    the export continues after the last message written.
+    """
+    state = read_checkpoint(checkpoint_path)
+    stats = Throughput()
+    if state:
+        output.seek(state["bytes"])
+        output.truncate()
+        after_id, written, users_seen = state["last_id"], state["bytes"], set(state["users"])
+    else:
+        header = {"type": "channel", "format": EXPORT_FORMAT}
+        header.update({field: getattr(channel, field) for field in CHANNEL_FIELDS})
+        data = _line(header)
+        output.write(data)
+        after_id, written, users_seen = 0, len(data), set()
+
+    pending = 0
+    deleted_authors = set()
+    rows = heapq.merge(
+        _archived_rows(channel.id, after_id),
+        _hot_rows(channel.id, after_id, batch_size),
+        key=lambda record: record["id"],
+    )
+    for record in rows:
+        chunk = b""
+        if record["user_id"] in deleted_authors:
+            continue
+        if record["user_id"] not in users_seen:
+            user = db.session.get(User, record["user_id"])
+            if user is None:
+                # Archived rows can outlive their author; the app hides them too.
+                deleted_authors.add(record["user_id"])
+                continue
+            users_seen.add(user.id)
+            chunk += _line({"type": "user", **{field: getattr(user, field) for field in USER_FIELDS}})
+        chunk += _line({"type": "message", **record})
+        output.write(chunk)
+        written += len(chunk)
+        after_id = record["id"]
+        stats.add(1, len(chunk))
+        pending += 1
+        if pending >= batch_size:
+            _export_checkpoint(output, checkpoint_path, after_id, written, users_seen)
+            pending = 0
+            if progress:
+                progress(stats)
+    _export_checkpoint(output, checkpoint_path, after_id, written, users_seen)
+    return stats
+
+
+def _export_checkpoint(output, path, last_id, written, users_seen):
+    output.flush()
+    if path:
+        os.fsync(output.fileno())
+    write_checkpoint(path, {"last_id": last_id, "bytes": written, "users": sorted(users_seen)})
+
+
+def _local_user(record):
+    """The local user for an exported author, created if there is none."""
+    user = User.query.filter_by(email=record["email"]).first()
+    if user:
+        return user
+    username, email_prefix = record["username"], record["email_prefix"]
+    if User.query.filter_by(username=username).first():
+        username = f"{username}-{record['id']}"
+    if User.query.filter_by(email_prefix=email_prefix).first():
+        email_prefix = f"{email_prefix}-{record['id']}"
+    user = User(
+        email=record["email"],
+        email_prefix=email_prefix,
+        username=username,
+        name=record["name"],
+        password_hash=UNUSABLE_PASSWORD,
+    )
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def _import_channel(header, slug, append):
+    channel = Channel.query.filter_by(slug=slug).first()
+    if channel is not None:
+        if not append:
+            raise ValueError(f"channel {slug!r} already exists; pass append to import into it")
+        return channel
+    values = {field: header.get(field) for field in CHANNEL_FIELDS}
+    values["slug"] = slug
+    channel = Channel(**{field: value for field, value in values.items() if value is not None})
+    db.session.add(channel)
+    db.session.flush()
+    return channel
+
+
+def _next_free_id():
+    hot = db.session.query(func.max(Message.id)).scalar() or 0
+    archived = db.session.query(func.max(MessageArchiveSegment.last_id)).scalar() or 0
+    return max(hot, archived) + 1
+
+
+def _secondary_indexes():
+    return [index for index in Message.__table__.indexes if not index.unique]
+
+
+def import_channel(
+    path,
+    slug=None,
+    append=False,
+    checkpoint_path=None,
+    batch_size=5000,
+    defer_indexes=False,
+    progress=None,
+):
+    """Load an NDJSON export from ``path``; returns ``(channel, Throughput)``."""
+    state = read_checkpoint(checkpoint_path)
+    stats = Throughput()
+    with open(path, "rb") as handle:
+        if state:
+            channel = db.session.get(Channel, state["channel_id"])
+            if channel is None:
+                raise ValueError("the checkpoint's channel no longer exists")
+            handle.seek(state["offset"])
+            id_offset = state["id_offset"]
+            user_map = {int(key): value for key, value in state["users"].items()}
+        else:
+            header = json.loads(handle.readline())
+            if header.get("type") != "channel" or header.get("format") != EXPORT_FORMAT:
+                raise ValueError("not a channel export")
+            channel = _import_channel(header, slug or header["slug"], append)
+            id_offset = None
+            user_map = {}
+
+        deferred = _secondary_indexes() if defer_indexes else []
+        connection = db.session.connection()
+        for index in deferred:
+            index.drop(connection, checkfirst=True)
+
+        batch = []
+        while True:
+            line = handle.readline()
+            if line:
+                record = json.loads(line)
+                kind = record.pop("type", None)
+                if kind == "user":
+                    user_map[record["id"]] = _local_user(record).id
+                elif kind == "message":
+                    if id_offset is None:
+                        # Shift exported ids past every id in use, keeping their order.
+                        id_offset = _next_free_id() - record["id"]
+                    batch.append(_message_row(record, channel.id, user_map, id_offset))
+                stats.add(1 if kind == "message" else 0, len(line))
+            if batch and (len(batch) >= batch_size or not line):
+                db.session.execute(Message.__table__.insert(), batch)
+                db.session.commit()
+                write_checkpoint(
+                    checkpoint_path,
+                    {
+                        "channel_id": channel.id,
+                        "offset": handle.tell(),
+                        "id_offset": id_offset,
+                        "users": user_map,
+                    },
+                )
+                batch = []
+                if progress:
+                    progress(stats)
+            if not line:
+                break
+        db.session.commit()
+        # Also restores indexes an interrupted deferred import left dropped.
+        connection = db.session.connection()
+        for index in _secondary_indexes():
+            index.create(connection, checkfirst=True)
+        db.session.commit()
+    return channel, stats
+
+
+def _message_row(record, channel_id, user_map, id_offset):
+    row = {
+        "id": record["id"] + id_offset,
+        "channel_id": channel_id,
+        "user_id": user_map[record["user_id"]],
+        "content": record["content"],
+        "reply_to_id": record["reply_to_id"] + id_offset if record.get("reply_to_id") else None,
+        "is_deleted": bool(record.get("is_deleted")),
+        "client_id": None,
+    }
+    for field in DATETIME_FIELDS:
+        value = record.get(field)
+        row[field] = datetime.fromisoformat(value) if value else None
+    return row
@@ -0,0 +1,60 @@
+"""Prefix search over users for typeahead inputs.
+
+Each searchable column (``username``, ``name``, ``email_prefix``) has its own
+index, and a prefix is matched as the half-open range ``[q, q + U+10FFFF)``
+rather than with ``LIKE``, so every column costs one short index range scan
+capped at ``limit`` rows however many users there are. Matching is
+case-sensitive, as the index is; email prefixes are stored lower-cased, so
+the query is lower-cased for that column. Only admins search by email
+prefix or see it in results; other users match on username and name.
+"""
+from .models import User
+
+SEARCH_COLUMNS = ("username", "name", "email_prefix")
+PUBLIC_SEARCH_COLUMNS = ("username", "name")
+# Sorts after every valid character, so ``q + _RANGE_END`` bounds the prefix.
+_RANGE_END = "\U0010ffff"
+
+
+def serialize_search_result(user, include_email=False):
+    """Typeahead entry; the email prefix is only for admin forms."""
+    result = {
+        "id": user.id,
+        "name": user.name,
+        "username": user.username,
+        "avatar_url": user.avatar_url,
+    }
+    if include_email:
+        result["email_prefix"] = user.email_prefix
+    return result
+
+
+def _prefix_matches(column_name, prefix, limit):
+    column = getattr(User, column_name)
+    return (
+        User.query.filter(column >= prefix, column < prefix + _RANGE_END)
+        .order_by(column.asc())
+        .limit(limit)
+        .all()
+    )
+
+
+def search_users(query, limit=10, columns=SEARCH_COLUMNS):
+    """Up to ``limit`` users whose value in one of ``columns`` starts with ``query``.
+
+    Exact matches come first, then shorter matched values, so typing a full
+    email prefix puts that user on top.
+    """
+    query = (query or "").strip()
+    if not query or limit <= 0:
+        return []
+    ranked = {}
+    for rank, column_name in enumerate(columns):
+        prefix = query.lower() if column_name == "email_prefix" else query
+        for user in _prefix_matches(column_name, prefix, limit):
+            value = getattr(user, column_name)
+            key = (value != prefix, len(value), rank, value)
+            if user.id not in ranked or key < ranked[user.id][0]:
+                ranked[user.id] = (key, user)
+    results = sorted(ranked.values(), key=lambda entry: entry[0])
+    return [user for _, user in results[:limit]]
@@ -7,6 +7,7 @@ import re
 from markupsafe import Markup, escape
 from werkzeug.utils import secure_filename
 from flask import session, redirect, url_for, g, current_app
+from .metrics import inc
 from .models import User, ChannelPermission
 
 
@@ -63,8 +64,11 @@ def logout_user():
 
 
 def notify(user_id, title, body, db, Notification):
+    from .notifications import track_notification
+
     notification = Notification(user_id=user_id, title=title, body=body)
     db.session.add(notification)
+    track_notification(db.session, notification)
 
 
 def adjust_kc(user, delta, reason, db, KCLog, Notification):
@@ -73,6 +77,23 @@ def adjust_kc(user, delta, reason, db, KCLog, Notification):
     notify(user.id, "KC 변동", f"{reason} ({delta:+d} KC)", db, Notification)
 
 
+def debit_kc(user_id, amount, reason, db, KCLog, Notification):
+    """Take ``amount`` KC from the user only if they still have it; returns whether it was taken.
+
+    A single conditional UPDATE, so two debits racing for the same balance
+    can't both pass a check made earlier in Python.
+    """
+    taken = (
+        User.query.filter(User.id == user_id, User.kc_points >= amount)
+        .update({User.kc_points: User.kc_points - amount}, synchronize_session=False)
+    )
+    if not taken:
+        return False
+    db.session.add(KCLog(user_id=user_id, delta=-amount, reason=reason))
+    notify(user_id, "KC 변동", f"{reason} ({-amount:+d} KC)", db, Notification)
+    return True
+
+
 _KST_TZ = None
 
 
@@ -94,6 +115,14 @@ def to_kst(value):
     return value.astimezone(_get_kst_tz())
 
 
+def to_epoch(value):
+    if not value:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
 def allowed_file(filename, allowed_extensions):
     if "." not in filename:
         return False
@@ -110,7 +139,9 @@ def save_upload(file_storage, upload_folder, allowed_extensions):
     ext = filename.rsplit(".", 1)[1].lower()
     new_name = f"{uuid.uuid4().hex}.{ext}"
     os.makedirs(upload_folder, exist_ok=True)
-    file_storage.save(os.path.join(upload_folder, new_name))
+    path = os.path.join(upload_folder, new_name)
+    file_storage.save(path)
+    inc("kjb_upload_bytes_total", os.path.getsize(path))
     return new_name
 
 
@@ -135,8 +166,13 @@ def resolve_channel_permissions(user, channel):
             "overrides": {row.channel_id: row for row in rows},
         }
         g.channel_permission_cache = permission_cache
+    return permissions_from(user, channel, permission_cache["overrides"].get(channel.id))
 
-    override = permission_cache["overrides"].get(channel.id)
+
+def permissions_from(user, channel, override):
+    """``user``'s permissions in ``channel`` given their override row for it, if any."""
+    if user.is_admin:
+        return {"can_view": True, "can_read": True, "can_send": True}
     if override:
         permissions = {
             "can_view": override.can_view,
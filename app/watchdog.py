@@ -0,0 +1,105 @@
+"""Event-loop stall detection for eventlet workers.
+
+Under eventlet one blocking call (an fsync, a big file read, CPU-heavy
+rendering) freezes every socket in the worker. The watchdog measures it from
+two sides:
+
+* a heartbeat greenlet sleeps ``HUB_WATCHDOG_INTERVAL`` seconds at a time
+  and records how late the hub woke it up in ``kjb_hub_lag_seconds``;
+* a native thread, which keeps running while the hub is blocked, checks the
+  heartbeat and, once it is ``HUB_WATCHDOG_THRESHOLD`` seconds overdue,
+  takes the stack of whatever the hub thread is running: the greenlet that
+  blocked.
+
+The native thread only takes the snapshot; logging and metrics happen in the
+heartbeat greenlet once the hub is back, since eventlet's patched locks
+can't be used from another OS thread. Each stall is logged with its duration
+and stack and counted in ``kjb_hub_stalls_total`` by the innermost frame in
+the app. Enabled by ``HUB_WATCHDOG_ENABLED`` on eventlet only; the cost is a
+wake-up per interval on each side.
+"""
+import os
+import sys
+import time
+import traceback
+
+from .extensions import socketio
+from .metrics import inc, observe
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class HubWatchdog:
+    def __init__(self, app, interval=0.1, threshold=0.25, stack_depth=30):
+        self.app = app
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+        self.hub_thread = None
+        self.last_beat = time.monotonic()
+        # Set by the native thread during a stall, consumed by the heartbeat.
+        self.snapshot = None
+
+    def start(self):
+        from eventlet import patcher
+
+        threading = patcher.original("threading")
+        self.hub_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        socketio.start_background_task(self._beat)
+        threading.Thread(target=self._watch, name="kjb-hub-watchdog", daemon=True).start()
+
+    def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            socketio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.last_beat = now
+            observe("kjb_hub_lag_seconds", lag, buckets=LAG_BUCKETS)
+            snapshot, self.snapshot = self.snapshot, None
+            if snapshot is not None or lag >= self.threshold:
+                self._report(lag, snapshot)
+
+    def _watch(self):
+        from eventlet import patcher
+
+        sleep = patcher.original("time").sleep
+        while True:
+            sleep(self.interval / 2)
+            overdue = time.monotonic() - self.last_beat - self.interval
+            if overdue >= self.threshold and self.snapshot is None:
+                frame = sys._current_frames().get(self.hub_thread)
+                if frame is not None:
+                    self.snapshot = traceback.extract_stack(frame, limit=self.stack_depth)
+
+    def _report(self, lag, stack):
+        site = _blocking_site(stack) if stack else "unknown"
+        inc("kjb_hub_stalls_total", site=site)
+        trace = "".join(traceback.format_list(stack)) if stack else "  (no stack captured)\n"
+        self.app.logger.warning("event loop blocked for %.3fs at %s:\n%s", lag, site, trace.rstrip())
+
+
+def _blocking_site(stack):
+    """``path:line function`` of the innermost frame in the app, else the innermost frame."""
+    for frame in reversed(stack):
+        if frame.filename.startswith(APP_ROOT) and "site-packages" not in frame.filename:
+            return f"{os.path.relpath(frame.filename, APP_ROOT)}:{frame.lineno} {frame.name}"
+    frame = stack[-1]
+    return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+
+
+def start_hub_watchdog(app):
+    """Start the stall detector when enabled and running on eventlet; returns it or None."""
+    server = socketio.server
+    if not app.config.get("HUB_WATCHDOG_ENABLED") or server is None or server.async_mode != "eventlet":
+        return None
+    watchdog = HubWatchdog(
+        app,
+        interval=app.config["HUB_WATCHDOG_INTERVAL"],
+        threshold=app.config["HUB_WATCHDOG_THRESHOLD"],
+        stack_depth=app.config["HUB_WATCHDOG_STACK_DEPTH"],
+    )
+    watchdog.start()
+    return watchdog
@@ -11,3 +11,107 @@ class Config:
     MAX_CONTENT_LENGTH = 20 * 1024 * 1024
     SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
     ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp", "mp4", "mp3", "pdf"}
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+    QUERY_TRACKING = os.getenv("QUERY_TRACKING", "0") == "1"
+    QUERY_REPEAT_THRESHOLD = 3
+    QUERY_BUDGET_DEFAULT = None
+    QUERY_BUDGET_STRICT = False
+    QUERY_BUDGETS = {
+        "http:views.chat": 16,
+        "http:views.admin": 16,
+        "socket:send_message": 18,
+        "socket:edit_message": 12,
+    }
+    WS_COMPRESSION = os.getenv("WS_COMPRESSION", "1") == "1"
+    WS_COMPRESSION_THRESHOLD = int(os.getenv("WS_COMPRESSION_THRESHOLD", "256"))
+    WS_COMPRESSION_LEVEL = 6
+    WS_COMPRESSION_WINDOW_BITS = 12
+    WS_COMPRESSION_CONTEXT_TAKEOVER = True
+    SOCKETIO_POLLING_COMPRESSION_THRESHOLD = 1024
+    HTTP_COMPRESSION = os.getenv("HTTP_COMPRESSION", "1") == "1"
+    HTTP_COMPRESSION_THRESHOLD = 1024
+    GZIP_LEVEL = 6
+    BROTLI_QUALITY = 5
+    PRECOMPRESSED_STATIC = True
+    # "default" (JSON) or "msgpack"; msgpack needs the msgpack package.
+    SOCKETIO_SERIALIZER = os.getenv("SOCKETIO_SERIALIZER", "default")
+    # Per-worker ring buffer of recently serialized messages (0 disables).
+    RECENT_MESSAGES_PER_CHANNEL = int(os.getenv("RECENT_MESSAGES_PER_CHANNEL", "200"))
+    RECENT_MESSAGES_MAX_CHANNELS = int(os.getenv("RECENT_MESSAGES_MAX_CHANNELS", "64"))
+    RECENT_MESSAGES_WARM_CHANNELS = int(os.getenv("RECENT_MESSAGES_WARM_CHANNELS", "16"))
+    # Reconnecting clients further behind than this are told to reload.
+    CATCHUP_MAX_MESSAGES = int(os.getenv("CATCHUP_MAX_MESSAGES", "200"))
+    # Per-worker cache of user display cards (0 disables).
+    USER_CARD_CACHE_SIZE = int(os.getenv("USER_CARD_CACHE_SIZE", "4096"))
+    # Per-worker cache of unread notification counts; mailbox page size.
+    UNREAD_COUNT_CACHE_SIZE = int(os.getenv("UNREAD_COUNT_CACHE_SIZE", "4096"))
+    MAILBOX_PAGE_SIZE = 30
+    # Notification retention (0 disables a policy). Runs every
+    # NOTIFICATION_RETENTION_INTERVAL seconds in one process (0: only via
+    # ``flask --app run prune-notifications``), in batches with a pause between.
+    NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+    NOTIFICATION_MAX_PER_USER = int(os.getenv("NOTIFICATION_MAX_PER_USER", "1000"))
+    NOTIFICATION_COMPACT_AFTER_HOURS = int(os.getenv("NOTIFICATION_COMPACT_AFTER_HOURS", "24"))
+    NOTIFICATION_RETENTION_INTERVAL = int(os.getenv("NOTIFICATION_RETENTION_INTERVAL", "3600"))
+    NOTIFICATION_RETENTION_BATCH = int(os.getenv("NOTIFICATION_RETENTION_BATCH", "500"))
+    NOTIFICATION_RETENTION_PAUSE = float(os.getenv("NOTIFICATION_RETENTION_PAUSE", "0.05"))
+    # Message archival: messages older than MESSAGE_ARCHIVE_AFTER_DAYS (per
+    # channel override on the admin page; 0 never) move to compressed segment
+    # files, except each channel's newest MESSAGE_ARCHIVE_KEEP_RECENT.
+    # MESSAGE_ARCHIVE_CODEC is "gzip" or "zstd" (needs the zstandard package).
+    MESSAGE_ARCHIVE_FOLDER = os.getenv("MESSAGE_ARCHIVE_FOLDER", os.path.join(BASE_DIR, "archive"))
+    MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "365"))
+    MESSAGE_ARCHIVE_KEEP_RECENT = int(os.getenv("MESSAGE_ARCHIVE_KEEP_RECENT", "1000"))
+    MESSAGE_ARCHIVE_SEGMENT_ROWS = int(os.getenv("MESSAGE_ARCHIVE_SEGMENT_ROWS", "5000"))
+    MESSAGE_ARCHIVE_CODEC = os.getenv("MESSAGE_ARCHIVE_CODEC", "gzip")
+    MESSAGE_ARCHIVE_INTERVAL = int(os.getenv("MESSAGE_ARCHIVE_INTERVAL", "21600"))
+    MESSAGE_ARCHIVE_PAUSE = float(os.getenv("MESSAGE_ARCHIVE_PAUSE", "0.05"))
+    # Decoded segments kept in memory per worker for history pages.
+    MESSAGE_ARCHIVE_CACHE_SEGMENTS = int(os.getenv("MESSAGE_ARCHIVE_CACHE_SEGMENTS", "16"))
+    # Most matches the user typeahead returns per query.
+    USER_SEARCH_LIMIT = 10
+    REPLY_PREVIEW_LENGTH = 80
+    THREAD_MAX_REPLIES = 500
+    SEND_BATCH_MAX = 20
+    # Token-bucket limits on Socket.IO events (see app/ratelimit.py). Costs
+    # are tokens per event; send_messages is charged per message. User
+    # buckets are shared through RATE_LIMIT_STORE (a Redis URL; defaults to
+    # a Redis SOCKETIO_MESSAGE_QUEUE, "" keeps them per worker).
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+    RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE")
+    RATE_LIMIT_COSTS = {
+        "send_message": 1.0,
+        "send_messages": 1.0,
+        "edit_message": 1.0,
+        "delete_message": 1.0,
+        "typing": 0.2,
+        "join": 0.2,
+        "leave": 0.1,
+        "user_cards": 0.2,
+    }
+    RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "3"))
+    RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "40"))
+    RATE_LIMIT_CONNECTION_RATE = float(os.getenv("RATE_LIMIT_CONNECTION_RATE", "2"))
+    RATE_LIMIT_CONNECTION_BURST = float(os.getenv("RATE_LIMIT_CONNECTION_BURST", "30"))
+    # Disconnect a socket refused this many times in a row (0 never).
+    RATE_LIMIT_DISCONNECT_AFTER = int(os.getenv("RATE_LIMIT_DISCONNECT_AFTER", "50"))
+    # Run password hashing in eventlet's native thread pool (eventlet only).
+    PASSWORD_HASH_OFFLOAD = os.getenv("PASSWORD_HASH_OFFLOAD", "1") == "1"
+    PASSWORD_HASH_THREADS = int(os.getenv("PASSWORD_HASH_THREADS", "4"))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+    # Log and count event-loop stalls longer than HUB_WATCHDOG_THRESHOLD
+    # seconds, with the blocking stack (eventlet only; see app/watchdog.py).
+    HUB_WATCHDOG_ENABLED = os.getenv("HUB_WATCHDOG_ENABLED", "1") == "1"
+    HUB_WATCHDOG_INTERVAL = float(os.getenv("HUB_WATCHDOG_INTERVAL", "0.1"))
+    HUB_WATCHDOG_THRESHOLD = float(os.getenv("HUB_WATCHDOG_THRESHOLD", "0.25"))
+    HUB_WATCHDOG_STACK_DEPTH = int(os.getenv("HUB_WATCHDOG_STACK_DEPTH", "30"))
+    # Run migrations and seed data on boot. Production workers set this to 0
+    # and rely on ``flask --app run init`` having been run once.
+    AUTO_INIT_DB = os.getenv("AUTO_INIT_DB", "1") == "1"
+    # serve.py: workers behind the local balancer. More than one needs
+    # SOCKETIO_MESSAGE_QUEUE so emits and cache updates reach every worker.
+    SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "2"))
+    SERVE_DRAIN_TIMEOUT = float(os.getenv("SERVE_DRAIN_TIMEOUT", "20"))
+    # Set per worker by serve.py; prefixes Engine.IO session ids for sticky routing.
+    WORKER_ID = os.getenv("KJB_WORKER_ID")
@@ -0,0 +1,45 @@
+"""message catch-up, reply and client id indexes
+
+Revision ID: 0002_message_indexes
+Revises: 0001_initial
+Create Date: 2026-10-18 23:20:11.402117
+
+Databases that booted while these were still applied at startup may already
+have some of them, so each step checks first.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_message_indexes'
+down_revision = '0001_initial'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_messages_channel_id_id', ['channel_id', 'id'], False),
+    ('ix_messages_channel_id_updated_at', ['channel_id', 'updated_at'], False),
+    ('ix_messages_reply_to_id', ['reply_to_id'], False),
+    ('uq_messages_user_client_id', ['user_id', 'client_id'], True),
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name'] for column in inspector.get_columns('messages')}
+    existing = {index['name'] for index in inspector.get_indexes('messages')}
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        if 'client_id' not in columns:
+            batch_op.add_column(sa.Column('client_id', sa.String(length=64), nullable=True))
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        for name, columns, unique in INDEXES:
+            if name not in existing:
+                batch_op.create_index(name, columns, unique=unique)
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        for name, _, _ in reversed(INDEXES):
+            batch_op.drop_index(name)
+        batch_op.drop_column('client_id')
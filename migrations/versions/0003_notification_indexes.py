@@ -0,0 +1,28 @@
+"""notification mailbox and unread count indexes
+
+Revision ID: 0003_notification_indexes
+Revises: 0002_message_indexes
+Create Date: 2026-10-18 23:52:40.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_notification_indexes'
+down_revision = '0002_message_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index('ix_notifications_user_id_id', ['user_id', 'id'], unique=False)
+        batch_op.create_index('ix_notifications_user_id_is_read', ['user_id', 'is_read'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_user_id_is_read')
+        batch_op.drop_index('ix_notifications_user_id_id')
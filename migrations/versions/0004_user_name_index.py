@@ -0,0 +1,26 @@
+"""user search name index
+
+Revision ID: 0004_user_name_index
+Revises: 0003_notification_indexes
+Create Date: 2026-10-18 23:44:03.213727
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_user_name_index'
+down_revision = '0003_notification_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_name', ['name'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_name')
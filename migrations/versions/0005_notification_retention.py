@@ -0,0 +1,28 @@
+"""notification merged_count and created_at index for retention
+
+Revision ID: 0005_notification_retention
+Revises: 0004_user_name_index
+Create Date: 2026-10-18 23:46:28.997499
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_notification_retention'
+down_revision = '0004_user_name_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('merged_count', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_index('ix_notifications_created_at', ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_created_at')
+        batch_op.drop_column('merged_count')
@@ -0,0 +1,51 @@
+"""message archive segment index and per-channel archive age
+
+Revision ID: 0006_message_archive
+Revises: 0005_notification_retention
+Create Date: 2026-10-18 23:51:13.793793
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_message_archive'
+down_revision = '0005_notification_retention'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('message_archive_segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('channel_id', sa.Integer(), nullable=False),
+    sa.Column('first_id', sa.Integer(), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('first_created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_created_at', sa.DateTime(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(length=255), nullable=False),
+    sa.Column('codec', sa.String(length=16), nullable=False),
+    sa.Column('size_bytes', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['channel_id'], ['channels.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('message_archive_segments', schema=None) as batch_op:
+        batch_op.create_index('ix_message_archive_segments_channel_id_last_id', ['channel_id', 'last_id'], unique=False)
+        batch_op.create_index('ix_message_archive_segments_first_id_last_id', ['first_id', 'last_id'], unique=False)
+
+    with op.batch_alter_table('channels', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('archive_after_days', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('channels', schema=None) as batch_op:
+        batch_op.drop_column('archive_after_days')
+
+    with op.batch_alter_table('message_archive_segments', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_archive_segments_first_id_last_id')
+        batch_op.drop_index('ix_message_archive_segments_channel_id_last_id')
+
+    op.drop_table('message_archive_segments')
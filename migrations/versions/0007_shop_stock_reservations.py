@@ -0,0 +1,35 @@
+"""reserve stock for shop requests already pending
+
+Revision ID: 0007_shop_stock_reservations
+Revises: 0006_message_archive
+Create Date: 2026-10-19 10:12:40.318206
+
+Stock used to be taken at approval; it is now taken when the request is
+made. Requests pending at upgrade time haven't taken theirs, so take it
+here, never going below zero. Downgrade gives it back, which can leave more
+stock than before if upgrade had to clamp at zero.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_shop_stock_reservations'
+down_revision = '0006_message_archive'
+branch_labels = None
+depends_on = None
+
+PENDING = (
+    "(SELECT COUNT(*) FROM shop_requests "
+    "WHERE shop_requests.item_id = shop_items.id AND shop_requests.status = 'pending')"
+)
+
+
+def upgrade():
+    op.execute(
+        f"UPDATE shop_items SET quantity = CASE WHEN quantity > {PENDING} "
+        f"THEN quantity - {PENDING} ELSE 0 END WHERE quantity IS NOT NULL"
+    )
+
+
+def downgrade():
+    op.execute(f"UPDATE shop_items SET quantity = quantity + {PENDING} WHERE quantity IS NOT NULL")
@@ -0,0 +1,32 @@
+"""unique channel permission per channel and user
+
+Revision ID: 0008_channel_permission_unique
+Revises: 0007_shop_stock_reservations
+Create Date: 2026-10-19 11:03:27.540912
+
+Bulk grants upsert overrides on (channel_id, user_id), which needs a unique
+key. Lookups have always used the first row of a pair, so duplicates left
+by racing admin POSTs are dropped in favour of the lowest id.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_channel_permission_unique'
+down_revision = '0007_shop_stock_reservations'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "DELETE FROM channel_permissions WHERE id NOT IN "
+        "(SELECT MIN(id) FROM channel_permissions GROUP BY channel_id, user_id)"
+    )
+    with op.batch_alter_table('channel_permissions', schema=None) as batch_op:
+        batch_op.create_index('uq_channel_permissions_channel_user', ['channel_id', 'user_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('channel_permissions', schema=None) as batch_op:
+        batch_op.drop_index('uq_channel_permissions_channel_user')
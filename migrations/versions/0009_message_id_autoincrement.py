@@ -0,0 +1,43 @@
+"""never reuse message ids once they are archived
+
+Revision ID: 0009_message_id_autoincrement
+Revises: 0008_channel_permission_unique
+Create Date: 2026-10-19 14:20:51.602318
+
+Archival deletes message rows, and SQLite gives a table without
+AUTOINCREMENT the next id after the current maximum, so an archived id could
+be handed to a new message. The table is rebuilt with AUTOINCREMENT and its
+sequence raised to the newest archived id. Other databases use sequences,
+which never go back, and are left alone.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_message_id_autoincrement'
+down_revision = '0008_channel_permission_unique'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('messages', recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+        pass
+    # Copying the rows set the sequence to the hot maximum; archived ids may be higher.
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'messages', 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'messages')"
+    )
+    op.execute(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, "
+        "(SELECT COALESCE(MAX(last_id), 0) FROM message_archive_segments)) WHERE name = 'messages'"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('messages', recreate='always', table_kwargs={'sqlite_autoincrement': False}):
+        pass
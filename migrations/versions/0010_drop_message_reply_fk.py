@@ -0,0 +1,76 @@
+"""drop the foreign key from messages.reply_to_id
+
+Revision ID: 0010_drop_message_reply_fk
+Revises: 0009_message_id_autoincrement
+Create Date: 2026-10-19 16:05:12.447130
+
+Archival deletes old messages that newer replies still point to, and the
+replies keep the archived id for archived_by_ids to resolve. A database
+that enforces the self-referencing foreign key refuses those deletes, so
+the constraint goes. SQLite rebuilds the table to drop it, which resets
+its AUTOINCREMENT sequence to the hot maximum, so the sequence is raised
+past the archived ids again as in 0009.
+
+Downgrade clears reply_to_id on replies whose message has been archived,
+since the constraint can't be restored over them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_drop_message_reply_fk'
+down_revision = '0009_message_id_autoincrement'
+branch_labels = None
+depends_on = None
+
+# 0001 left the constraint unnamed; SQLite reflects it without a name.
+NAMING = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+FK_NAME = 'fk_messages_reply_to_id_messages'
+
+
+def _reply_fk_name():
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys('messages'):
+        if foreign_key['constrained_columns'] == ['reply_to_id']:
+            return foreign_key['name'] or FK_NAME
+    return None
+
+
+def _batch():
+    if op.get_bind().dialect.name == 'sqlite':
+        return op.batch_alter_table(
+            'messages', naming_convention=NAMING, table_kwargs={'sqlite_autoincrement': True}
+        )
+    return op.batch_alter_table('messages', naming_convention=NAMING)
+
+
+def _raise_sqlite_sequence():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'messages', 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'messages')"
+    )
+    op.execute(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, "
+        "(SELECT COALESCE(MAX(last_id), 0) FROM message_archive_segments)) WHERE name = 'messages'"
+    )
+
+
+def upgrade():
+    name = _reply_fk_name()
+    if name is None:
+        return
+    with _batch() as batch_op:
+        batch_op.drop_constraint(name, type_='foreignkey')
+    _raise_sqlite_sequence()
+
+
+def downgrade():
+    op.execute(
+        "UPDATE messages SET reply_to_id = NULL WHERE reply_to_id IS NOT NULL "
+        "AND reply_to_id NOT IN (SELECT id FROM messages)"
+    )
+    with _batch() as batch_op:
+        batch_op.create_foreign_key(FK_NAME, 'messages', ['reply_to_id'], ['id'])
+    _raise_sqlite_sequence()
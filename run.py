@@ -1,8 +1,16 @@
 """Entry point for running the server."""
 from app import create_app
 from app.extensions import socketio
+from app.archive import start_message_archival
+from app.message_cache import warm_message_cache
+from app.retention import start_notification_retention
+from app.watchdog import start_hub_watchdog
 
 app = create_app()
 
 if __name__ == "__main__":
+    start_hub_watchdog(app)
+    warm_message_cache(app)
+    start_notification_retention(app)
+    start_message_archival(app)
     socketio.run(app, host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,181 @@
+"""Measure bytes on the wire and CPU cost of the compression settings.
+
+Seeds a temporary database, serializes a channel's worth of messages the
+way ``new_message`` frames are encoded and runs them through
+permessage-deflate configurations, then compares HTML page and static
+asset sizes for identity/gzip/brotli.
+
+    python scripts/bench_compression.py --messages 500
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "안녕하세요 오늘 점심 뭐 먹을까요 회의 자료 공유드립니다 **중요** `deploy` "
+    "확인했습니다 감사합니다 :smile: 좋아요 내일 봬요 [링크](https://example.com/docs) "
+    "hello world ok sounds good let's ship it"
+).split()
+
+
+def _frame(payload):
+    return "42" + json.dumps(["new_message", payload], separators=(",", ":"))
+
+
+def _legacy_payload(message, payload, card):
+    """The pre-v2 ``serialize_message`` shape, rebuilt for size comparison."""
+    return {
+        "id": message.id,
+        "channel_id": message.channel_id,
+        "user_id": message.user_id,
+        "user_name": card["n"],
+        "user_prefix": card["p"],
+        "avatar": card["a"],
+        "content": message.content,
+        "rendered_content": payload.get("h", ""),
+        "reply_to": payload.get("r"),
+        "is_deleted": message.is_deleted,
+        "name_color": card.get("nc"),
+        "accessory_image": card.get("ai"),
+        "created_at": message.created_at.strftime("%Y-%m-%d %H:%M"),
+        "updated_at": None,
+    }
+
+
+def _deflate_stream(frames, level, window_bits, context_takeover, threshold):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits)
+    total = 0
+    started = time.perf_counter()
+    for frame in frames:
+        data = frame.encode("utf-8")
+        if len(data) < threshold:
+            total += len(data)
+            continue
+        if not context_takeover:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits)
+        out = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        total += len(out) - 4
+    elapsed = time.perf_counter() - started
+    return total, elapsed
+
+
+def seed(app, count):
+    from app.extensions import db
+    from app.models import Channel, Message, User
+
+    with app.app_context():
+        users = []
+        for index in range(20):
+            user = User(
+                email=f"bench{index}@example.com",
+                email_prefix=f"bench{index}",
+                name=f"벤치 사용자 {index}",
+                username=f"bench{index}",
+            )
+            user.password_hash = "x"
+            db.session.add(user)
+            users.append(user)
+        db.session.flush()
+        channel = Channel.query.filter_by(slug="general").first()
+        for index in range(count):
+            db.session.add(
+                Message(
+                    channel_id=channel.id,
+                    user_id=random.choice(users).id,
+                    content=" ".join(random.choice(WORDS) for _ in range(random.randint(3, 25))),
+                )
+            )
+        db.session.commit()
+        return users[0].id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="kjb-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    random.seed(1)
+
+    from app import create_app
+    from app.compression import brotli, compress_bytes
+    from app.models import Message
+    from app.sockets import serialize_messages, serialize_user_cards
+
+    app = create_app()
+    user_id = seed(app, args.messages)
+
+    with app.app_context():
+        messages = Message.query.order_by(Message.id.asc()).all()
+        payloads = serialize_messages(messages)
+        authors = {message.user_id: message.user for message in messages}
+        cards = {card["id"]: card for card in serialize_user_cards(list(authors.values()))}
+        legacy = [
+            _frame(_legacy_payload(message, payload, cards[message.user_id]))
+            for message, payload in zip(messages, payloads)
+        ]
+        frames = [_frame(payload) for payload in payloads]
+    raw = sum(len(frame.encode("utf-8")) for frame in frames)
+    legacy_raw = sum(len(frame.encode("utf-8")) for frame in legacy)
+    print(
+        f"legacy payload {legacy_raw / len(legacy):.0f} B/msg, compact v2 {raw / len(frames):.0f} B/msg "
+        f"({(1 - raw / legacy_raw) * 100:.0f}% smaller)"
+    )
+    try:
+        import msgpack
+
+        packed = sum(
+            len(msgpack.dumps({"type": 2, "data": ["new_message", payload], "nsp": "/"}))
+            for payload in payloads
+        )
+        print(
+            f"compact v2 msgpack {packed / len(payloads):.0f} B/msg "
+            f"({(1 - packed / legacy_raw) * 100:.0f}% smaller)"
+        )
+    except ImportError:
+        pass
+    print(f"new_message frames: {len(frames)}, {raw / len(frames):.0f} B/msg raw")
+    print(f"{'permessage-deflate':<34} {'B/msg':>7} {'ratio':>6} {'us/msg':>7}")
+    for label, level, bits, takeover, threshold in (
+        ("window 15, context takeover", 6, 15, True, 0),
+        ("window 12, context takeover", 6, 12, True, 0),
+        ("window 12, takeover, >=256B", 6, 12, True, 256),
+        ("window 12, no context takeover", 6, 12, False, 0),
+        ("window 12, level 1", 1, 12, True, 0),
+    ):
+        total, elapsed = _deflate_stream(frames, level, bits, takeover, threshold)
+        print(
+            f"{label:<34} {total / len(frames):>7.0f} {total / raw:>6.2f} "
+            f"{elapsed / len(frames) * 1e6:>7.1f}"
+        )
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    page = client.get("/chat?id=general", headers={"Accept-Encoding": "identity"}).get_data()
+    print()
+    print(f"{'response':<26} {'identity':>9} {'gzip':>8} {'br':>8} {'gzip us':>8}")
+    rows = [("chat.html", page)]
+    for name in ("css/styles.css", "js/chat.js"):
+        with open(os.path.join(app.static_folder, name), "rb") as handle:
+            rows.append((name, handle.read()))
+    for name, data in rows:
+        started = time.perf_counter()
+        gz = compress_bytes(data, "gzip", app.config["GZIP_LEVEL"])
+        gzip_us = (time.perf_counter() - started) * 1e6
+        br = len(compress_bytes(data, "br", app.config["BROTLI_QUALITY"])) if brotli else None
+        print(f"{name:<26} {len(data):>9} {len(gz):>8} {br if br is not None else '-':>8} {gzip_us:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Socket latency on the eventlet hub while a burst of logins hits the server.
+
+Starts a throwaway server once with password hashing inline and once with it
+offloaded to the native thread pool. A probe client keeps making small
+Socket.IO calls (a round trip through the hub) while ``--workers`` threads
+POST ``/signin`` as fast as they can. Probe latency is reported before and
+during the storm for both modes.
+
+    python scripts/bench_login_storm.py --workers 16 --duration 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import _free_port, percentile, start_server  # noqa: E402
+
+PASSWORD = "storm-password"
+
+
+def _signup(base_url, name):
+    http = requests.Session()
+    response = http.post(
+        f"{base_url}/signup",
+        data={
+            "email": f"{name}@storm.local",
+            "name": name,
+            "username": name,
+            "password": PASSWORD,
+            "password_confirm": PASSWORD,
+        },
+        allow_redirects=False,
+    )
+    if response.status_code != 302 or "session" not in http.cookies:
+        raise RuntimeError(f"signup failed for {name}: {response.status_code}")
+    return http
+
+
+def _probe(client, stop, samples):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            client.call("user_cards", {"ids": []}, timeout=10)
+        except socketio.exceptions.TimeoutError:
+            samples.append(10.0)
+            continue
+        samples.append(time.perf_counter() - started)
+        time.sleep(0.02)
+
+
+def _storm(base_url, stop, results):
+    http = requests.Session()
+    while not stop.is_set():
+        response = http.post(
+            f"{base_url}/signin",
+            data={"email": "storm@storm.local", "password": PASSWORD},
+            allow_redirects=False,
+        )
+        location = response.headers.get("Location", "")
+        results.append("ok" if location.endswith("/chat") else "rejected")
+
+
+def _summary(label, samples):
+    if not samples:
+        return f"{label:<10} no samples"
+    return (
+        f"{label:<10} n={len(samples):<5} p50={percentile(samples, 50) * 1000:7.1f}ms "
+        f"p99={percentile(samples, 99) * 1000:7.1f}ms max={max(samples) * 1000:7.1f}ms"
+    )
+
+
+def run_mode(offload, args):
+    workdir = tempfile.mkdtemp(prefix="kjb-storm-")
+    port = _free_port()
+    server = start_server(
+        workdir,
+        port,
+        {
+            "PASSWORD_HASH_OFFLOAD": "1" if offload else "0",
+            "PASSWORD_HASH_MAX_PENDING": str(args.max_pending),
+            "METRICS_ENABLED": "1",
+        },
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _signup(base_url, "storm")
+        prober = _signup(base_url, "prober")
+        client = socketio.Client(reconnection=False)
+        cookie = "; ".join(f"{key}={value}" for key, value in prober.cookies.items())
+        client.connect(base_url, headers={"Cookie": cookie}, transports=["websocket"], wait_timeout=10)
+
+        stop = threading.Event()
+        baseline = []
+        probe = threading.Thread(target=_probe, args=(client, stop, baseline), daemon=True)
+        probe.start()
+        time.sleep(args.baseline)
+        stop.set()
+        probe.join()
+
+        stop = threading.Event()
+        during = []
+        logins = []
+        threads = [threading.Thread(target=_probe, args=(client, stop, during), daemon=True)]
+        threads += [
+            threading.Thread(target=_storm, args=(base_url, stop, logins), daemon=True)
+            for _ in range(args.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        client.disconnect()
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    mode = "offloaded" if offload else "inline"
+    print(f"password hashing {mode}:")
+    print("  " + _summary("idle", baseline))
+    print("  " + _summary("storm", during))
+    accepted = logins.count("ok")
+    print(
+        f"  logins {accepted / args.duration:.1f}/s accepted, "
+        f"{logins.count('rejected')} rejected as busy or failed"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=16, help="concurrent login loops")
+    parser.add_argument("--duration", type=float, default=10.0, help="storm length in seconds")
+    parser.add_argument("--baseline", type=float, default=3.0, help="idle probe period in seconds")
+    parser.add_argument("--max-pending", type=int, default=32, help="PASSWORD_HASH_MAX_PENDING")
+    parser.add_argument("--mode", choices=("both", "inline", "offloaded"), default="both")
+    args = parser.parse_args(argv)
+    if args.mode in ("both", "inline"):
+        run_mode(False, args)
+    if args.mode in ("both", "offloaded"):
+        run_mode(True, args)
+
+
+if __name__ == "__main__":
+    main()
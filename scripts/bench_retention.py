@@ -0,0 +1,134 @@
+"""Rows reclaimed by notification retention and its effect on mailbox latency.
+
+Builds a throwaway database where ``--users`` users each have ``--per-user``
+notifications spread over ``--days`` days, shaped like production: mostly
+"KC 변동" chat rewards, some follows and shop results, older ones read. Times
+the mailbox (first page, a deep page and the JSON endpoint with its unread
+count) for the heaviest user, runs retention once, and times it again.
+
+    python scripts/bench_retention.py --users 200 --per-user 3000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import percentile  # noqa: E402
+
+TITLES = (("KC 변동", "채팅 보상 (+1 KC)", 0.85), ("팔로우", "새 팔로워가 생겼습니다.", 0.1), ("상점", "구매가 승인되었습니다.", 0.05))
+
+
+def _populate(db, User, Notification, args):
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    users = [
+        User(email=f"u{i}@bench.local", email_prefix=f"u{i}", name=f"u{i}", username=f"u{i}", password_hash="x")
+        for i in range(args.users)
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    weights = [weight for _, _, weight in TITLES]
+    rows = []
+    for user in users:
+        for index in range(args.per_user):
+            age = timedelta(days=args.days) * (1 - index / args.per_user)
+            title, body, _ = rng.choices(TITLES, weights)[0]
+            rows.append(
+                {
+                    "user_id": user.id,
+                    "title": title,
+                    "body": body,
+                    "created_at": now - age,
+                    # Roughly the last day is still unread.
+                    "is_read": age > timedelta(days=1),
+                }
+            )
+        if len(rows) >= 50000:
+            db.session.execute(Notification.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Notification.__table__.insert(), rows)
+    db.session.commit()
+    return users[0].id
+
+
+def _time(client, path, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = client.get(path)
+        samples.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path}: {response.status_code}")
+    return samples
+
+
+def _measure(client, Notification, user_id, runs):
+    oldest = Notification.query.filter_by(user_id=user_id).order_by(Notification.id.asc()).first()
+    deep = f"/mailbox/notifications?before={oldest.id + 60}" if oldest else "/mailbox/notifications"
+    return {
+        "first page (JSON)": _time(client, "/mailbox/notifications", runs),
+        "deep page (JSON)": _time(client, deep, runs),
+        "mailbox HTML": _time(client, "/mailbox", runs),
+    }
+
+
+def _print(label, results):
+    for name, samples in results.items():
+        print(
+            f"{label:<7} {name:<18} p50={percentile(samples, 50) * 1000:7.2f}ms "
+            f"p99={percentile(samples, 99) * 1000:7.2f}ms"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--per-user", type=int, default=3000)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="kjb-retention-")
+    database = os.path.join(workdir, "retention.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    os.environ["NOTIFICATION_RETENTION_PAUSE"] = "0"
+
+    from app import create_app
+    from app.extensions import db
+    from app.models import Notification, User
+    from app.retention import run_notification_retention
+
+    app = create_app()
+    with app.app_context():
+        user_id = _populate(db, User, Notification, args)
+        total = Notification.query.count()
+    print(f"{total} notifications, {os.path.getsize(database) / 1e6:.1f} MB")
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    with app.app_context():
+        _print("before", _measure(client, Notification, user_id, args.runs))
+        report = run_notification_retention(app)
+        remaining = Notification.query.count()
+        db.session.execute(db.text("VACUUM"))
+    print(
+        f"retention: expired {report['expired']}, capped {report['capped']}, compacted {report['compacted']} "
+        f"in {report['batches']} batches, {report['seconds']:.2f}s; {remaining} rows left, "
+        f"{os.path.getsize(database) / 1e6:.1f} MB after VACUUM"
+    )
+    with app.app_context():
+        _print("after", _measure(client, Notification, user_id, args.runs))
+
+
+if __name__ == "__main__":
+    main()
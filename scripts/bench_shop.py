@@ -0,0 +1,174 @@
+"""Shop request decisions one POST at a time versus in bulk, and the stock race.
+
+Builds a throwaway database with ``--users`` users, a few items and a
+backlog of ``--backlog`` pending requests whose stock is already reserved,
+with about one buyer in ten too short of KC for what they asked for. Times
+``--single`` requests decided the old way, one admin POST (and admin page
+render) each, then the rest of the backlog in a single bulk POST, and checks
+the balances, stock and notifications that come out.
+
+Then ``--racers`` threads each ask for an item with ``--stock`` units left
+at the same moment; exactly ``--stock`` requests may get through.
+
+    python scripts/bench_shop.py --backlog 2000 --racers 40 --stock 5
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+ITEMS = (("스티커", 30), ("머그컵", 120), ("후드티", 400))
+
+
+def _populate(db, User, ShopItem, ShopRequest, args):
+    rng = random.Random(7)
+    admin = User(email="admin@bench.local", email_prefix="admin", name="admin", username="admin", password_hash="x")
+    admin.is_admin = True
+    users = [
+        User(email=f"u{i}@bench.local", email_prefix=f"u{i}", name=f"u{i}", username=f"u{i}", password_hash="x")
+        for i in range(args.users)
+    ]
+    items = [ShopItem(name=name, kc_cost=cost, quantity=args.backlog) for name, cost in ITEMS]
+    db.session.add_all([admin, *users, *items])
+    db.session.commit()
+    spend = dict.fromkeys(user.id for user in users)
+    rows = []
+    for _ in range(args.backlog):
+        user = rng.choice(users)
+        item = rng.choice(items)
+        spend[user.id] = (spend[user.id] or 0) + item.kc_cost
+        rows.append({"user_id": user.id, "item_id": item.id, "status": "pending"})
+    db.session.execute(ShopRequest.__table__.insert(), rows)
+    for user in users:
+        # Most can pay for everything they asked for; some fall short partway.
+        needed = spend[user.id] or 0
+        user.kc_points = needed if rng.random() > 0.1 else needed // 2
+    for item in items:
+        item.quantity = args.backlog - sum(1 for row in rows if row["item_id"] == item.id)
+    db.session.commit()
+    return admin.id, [item.id for item in items]
+
+
+def _client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    return client
+
+
+def _decide(app, admin_id, args, db, ShopRequest):
+    client = _client(app, admin_id)
+    with app.app_context():
+        pending = [row.id for row in ShopRequest.query.filter_by(status="pending").order_by(ShopRequest.id)]
+    single, bulk = pending[: args.single], pending[args.single :]
+
+    started = time.perf_counter()
+    for request_id in single:
+        client.post("/admin", data={"action": "shop_decision", "request_id": request_id, "decision": "approve"})
+    single_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    response = client.post(
+        "/admin", data={"action": "shop_decision_bulk", "request_ids": bulk, "decision": "approve"}
+    )
+    bulk_seconds = time.perf_counter() - started
+    if response.status_code != 200:
+        raise RuntimeError(f"bulk decision: {response.status_code}")
+
+    print(
+        f"one POST each: {len(single)} requests in {single_seconds:.2f}s "
+        f"({len(single) / single_seconds:,.0f} requests/s)"
+    )
+    print(
+        f"bulk POST:     {len(bulk)} requests in {bulk_seconds:.2f}s "
+        f"({len(bulk) / bulk_seconds:,.0f} requests/s, one transaction)"
+    )
+
+
+def _check(app, db, User, ShopItem, ShopRequest, KCLog, Notification, args):
+    with app.app_context():
+        counts = dict(
+            db.session.query(ShopRequest.status, db.func.count()).group_by(ShopRequest.status).all()
+        )
+        negative = User.query.filter(User.kc_points < 0).count()
+        debits = KCLog.query.filter_by(reason="상점 구매").count()
+        stock = sum(item.quantity for item in ShopItem.query.all())
+        notes = Notification.query.filter_by(title="상점").count()
+    approved, denied = counts.get("approved", 0), counts.get("denied", 0)
+    print(
+        f"approved {approved}, denied {denied} (short of KC), pending {counts.get('pending', 0)}; "
+        f"{debits} debits, {notes} shop notifications, {negative} negative balances"
+    )
+    # Denied requests hand their unit back to the pool they came from.
+    expected_stock = len(ITEMS) * args.backlog - args.backlog + denied
+    if debits != approved or negative or stock != expected_stock or notes != approved + denied:
+        raise SystemExit(f"inconsistent: stock {stock}, expected {expected_stock}")
+
+
+def _race(app, db, User, ShopItem, ShopRequest, args):
+    with app.app_context():
+        racers = [
+            User(email=f"r{i}@bench.local", email_prefix=f"r{i}", name=f"r{i}", username=f"r{i}", password_hash="x")
+            for i in range(args.racers)
+        ]
+        item = ShopItem(name="한정판", kc_cost=1, quantity=args.stock)
+        db.session.add_all([*racers, item])
+        db.session.commit()
+        racer_ids, item_id = [racer.id for racer in racers], item.id
+
+    barrier = threading.Barrier(args.racers)
+
+    def request_item(user_id):
+        client = _client(app, user_id)
+        barrier.wait()
+        client.post("/shop", data={"item_id": item_id})
+
+    threads = [threading.Thread(target=request_item, args=(user_id,)) for user_id in racer_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        granted = ShopRequest.query.filter_by(item_id=item_id).count()
+        left = db.session.get(ShopItem, item_id).quantity
+    print(f"race: {args.racers} buyers for {args.stock} units -> {granted} requests accepted, {left} left")
+    if granted != args.stock or left != 0:
+        raise SystemExit("oversold or undersold")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--backlog", type=int, default=2000)
+    parser.add_argument("--single", type=int, default=100)
+    parser.add_argument("--racers", type=int, default=40)
+    parser.add_argument("--stock", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="kjb-shop-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'shop.db')}"
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+    from app import create_app
+    from app.extensions import db
+    from app.models import KCLog, Notification, ShopItem, ShopRequest, User
+
+    app = create_app()
+    with app.app_context():
+        admin_id, _ = _populate(db, User, ShopItem, ShopRequest, args)
+    print(f"{args.backlog} pending requests from {args.users} users")
+    _decide(app, admin_id, args, db, ShopRequest)
+    _check(app, db, User, ShopItem, ShopRequest, KCLog, Notification, args)
+    _race(app, db, User, ShopItem, ShopRequest, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Measure worker startup: package import and ``create_app()`` cost.
+
+Each sample runs in a fresh interpreter against an already initialised
+database: with ``AUTO_INIT_DB=1`` (migrations checked on boot), with
+``AUTO_INIT_DB=0`` (the production worker path: no DDL or schema
+introspection), and additionally with ``EVENTLET_NO_GREENDNS=yes``, which
+skips eventlet's dnspython patching when the Socket.IO server is set up.
+
+    python scripts/bench_startup.py --runs 5 --importtime
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+SAMPLE_CODE = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print(json.dumps({"import": imported - started, "factory": created - imported}))
+"""
+
+
+MODES = (
+    ("AUTO_INIT_DB=1", {"AUTO_INIT_DB": "1"}),
+    ("AUTO_INIT_DB=0", {"AUTO_INIT_DB": "0"}),
+    ("  +NO_GREENDNS", {"AUTO_INIT_DB": "0", "EVENTLET_NO_GREENDNS": "yes"}),
+)
+
+
+def _env(workdir, overrides=None):
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'startup.db')}"
+    env["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    env["AUTO_INIT_DB"] = "0"
+    env.update(overrides or {})
+    return env
+
+
+def _sample(workdir, overrides):
+    output = subprocess.run(
+        [sys.executable, "-c", SAMPLE_CODE],
+        cwd=ROOT,
+        env=_env(workdir, overrides),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _importtime(workdir, limit):
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT,
+        env=_env(workdir),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        # Third-party package roots, wherever they were first imported from.
+        if "." not in name and name != "app" and name not in sys.stdlib_module_names:
+            packages[name] = max(packages.get(name, 0), int(cumulative))
+    rows = [(cumulative, name) for name, cumulative in packages.items()]
+    for cumulative, name in sorted(rows, reverse=True)[:limit]:
+        print(f"  {name:<32} {cumulative / 1000:8.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="list the slowest top-level imports")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="kjb-startup-")
+    subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "run", "init"],
+        cwd=ROOT,
+        env=_env(workdir),
+        capture_output=True,
+        check=True,
+    )
+    print(f"{'mode':<16} {'import ms':>10} {'factory ms':>11} {'total ms':>9}")
+    for label, overrides in MODES:
+        samples = [_sample(workdir, overrides) for _ in range(args.runs)]
+        imported = statistics.median(sample["import"] for sample in samples) * 1000
+        factory = statistics.median(sample["factory"] for sample in samples) * 1000
+        print(f"{label:<16} {imported:>10.1f} {factory:>11.1f} {imported + factory:>9.1f}")
+    if args.importtime:
+        print("slowest packages imported by `import app` (cumulative, nested ones overlap):")
+        _importtime(workdir, 10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Integration check for ``serve.py`` with two workers.
+
+Runs a tiny in-process stand-in for Redis pub/sub (just enough RESP for
+python-socketio's RedisManager), starts the launcher with two workers
+against it and connects two users through the balancer over long-polling
+first, so sticky routing is exercised before the WebSocket upgrade. The
+users land on different workers; a message sent by one must reach the
+other, and a rejoin on the receiving worker must replay it from that
+worker's cache. Finally the launcher is sent SIGTERM and must drain and
+exit cleanly.
+
+    python scripts/check_multiworker.py
+"""
+import argparse
+import os
+import signal
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import ROOT, _free_port, _wait_for_port  # noqa: E402
+
+PASSWORD = "multiworker"
+
+
+class _PubSubHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, channel, handler):
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(handler)
+            return sum(1 for handlers in self.subscribers.values() if handler in handlers)
+
+    def unsubscribe(self, handler):
+        with self.lock:
+            for handlers in self.subscribers.values():
+                handlers.discard(handler)
+
+    def publish(self, channel, data):
+        with self.lock:
+            handlers = list(self.subscribers.get(channel, ()))
+        for handler in handlers:
+            handler.push([b"message", channel, data])
+        return len(handlers)
+
+
+def _encode(value):
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(_encode(item) for item in value)
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def push(self, value):
+        with self.write_lock:
+            self.wfile.write(_encode(value))
+            self.wfile.flush()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:])
+        parts = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:])
+            parts.append(self.rfile.read(length + 2)[:-2])
+        return parts
+
+    def handle(self):
+        self.write_lock = threading.Lock()
+        hub = self.server.hub
+        try:
+            while True:
+                command = self._read_command()
+                if command is None:
+                    break
+                name = command[0].upper()
+                if name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.push([b"subscribe", channel, hub.subscribe(channel, self)])
+                elif name == b"PUBLISH":
+                    self.push(hub.publish(command[1], command[2]))
+                elif name == b"PING":
+                    with self.write_lock:
+                        self.wfile.write(b"+PONG\r\n")
+                        self.wfile.flush()
+                else:
+                    # CLIENT SETINFO, SELECT, UNSUBSCRIBE...: accept and move on.
+                    with self.write_lock:
+                        self.wfile.write(b"+OK\r\n")
+                        self.wfile.flush()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            hub.unsubscribe(self)
+
+
+class QueueStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port):
+        super().__init__(("127.0.0.1", port), _RespHandler)
+        self.hub = _PubSubHub()
+
+
+def _signup(base_url, name):
+    http = requests.Session()
+    response = http.post(
+        f"{base_url}/signup",
+        data={
+            "email": f"{name}@multiworker.local",
+            "name": name,
+            "username": name,
+            "password": PASSWORD,
+            "password_confirm": PASSWORD,
+        },
+        allow_redirects=False,
+    )
+    if response.status_code != 302 or "session" not in http.cookies:
+        raise RuntimeError(f"signup failed for {name}: {response.status_code}")
+    return http
+
+
+def _connect(base_url, http, received):
+    client = socketio.Client(reconnection=False)
+    client.on("new_message", lambda message: received.append(message))
+    cookie = "; ".join(f"{key}={value}" for key, value in http.cookies.items())
+    client.connect(base_url, headers={"Cookie": cookie}, transports=["polling", "websocket"], wait_timeout=10)
+    return client
+
+
+def _worker_of(client):
+    return client.eio.sid.split(".", 1)[0]
+
+
+def _wait(predicate, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if predicate():
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    return False
+
+
+def check(args):
+    workdir = tempfile.mkdtemp(prefix="kjb-multiworker-")
+    queue_port = _free_port()
+    queue = QueueStandIn(queue_port)
+    threading.Thread(target=queue.serve_forever, daemon=True).start()
+
+    port = _free_port()
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'multiworker.db')}"
+    env["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    env["SOCKETIO_MESSAGE_QUEUE"] = f"redis://127.0.0.1:{queue_port}/0"
+    launcher = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(ROOT, "serve.py"),
+            "--workers",
+            "2",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--backend-port",
+            str(_free_port()),
+            "--drain-timeout",
+            "5",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    clients = []
+    try:
+        if not _wait_for_port(port, timeout=30):
+            raise RuntimeError("launcher did not start")
+        # Workers come up after the balancer; wait until both answer.
+        if not _wait(lambda: all(requests.get(f"{base_url}/signin").ok for _ in range(2)), 30):
+            raise RuntimeError("workers did not start")
+        alice = _signup(base_url, "alice")
+        bob = _signup(base_url, "bob")
+
+        alice_received, bob_received = [], []
+        sender = _connect(base_url, alice, alice_received)
+        clients.append(sender)
+        receiver = None
+        for _ in range(4):
+            candidate = _connect(base_url, bob, bob_received)
+            clients.append(candidate)
+            if _worker_of(candidate) != _worker_of(sender):
+                receiver = candidate
+                break
+        if receiver is None:
+            raise RuntimeError("could not place the two users on different workers")
+        if not _wait(lambda: sender.transport() == "websocket" and receiver.transport() == "websocket", 10):
+            raise RuntimeError("sessions did not upgrade to WebSocket through the balancer")
+        print(f"alice on {_worker_of(sender)}, bob on {_worker_of(receiver)}")
+
+        # Page loads go round robin, so these buffer the channel on both workers.
+        for _ in range(4):
+            alice.get(f"{base_url}/chat").raise_for_status()
+        sender.call("join", {"channel": "general"}, timeout=10)
+        joined = receiver.call("join", {"channel": "general"}, timeout=10)
+        ack = sender.call("send_message", {"channel": "general", "content": "hello from the other worker"}, timeout=10)
+        if not ack or not ack.get("ok"):
+            raise RuntimeError(f"send failed: {ack}")
+        message_id = ack["message"]["id"]
+        if not _wait(lambda: any(message["id"] == message_id for message in bob_received), args.timeout):
+            raise RuntimeError("message was not delivered across workers")
+        print("cross-worker delivery ok")
+
+        rejoin = receiver.call(
+            "join",
+            {"channel": "general", "last_id": message_id - 1, "first_id": message_id - 1, "cursor": joined["cursor"]},
+            timeout=10,
+        )
+        if not rejoin.get("ok") or [message["id"] for message in rejoin["messages"]] != [message_id]:
+            raise RuntimeError(f"catch-up on the receiving worker missed the message: {rejoin}")
+        print("catch-up from the receiving worker's cache ok")
+
+        launcher.send_signal(signal.SIGTERM)
+        code = launcher.wait(timeout=30)
+        if code != 0:
+            raise RuntimeError(f"launcher exited with {code}")
+        if not _wait(lambda: not any(client.connected for client in clients), 10):
+            raise RuntimeError("clients were not disconnected on drain")
+        print("graceful drain ok")
+    finally:
+        for client in clients:
+            if client.connected:
+                client.disconnect()
+        if launcher.poll() is None:
+            launcher.kill()
+            launcher.wait()
+        queue.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for cross-worker delivery")
+    args = parser.parse_args(argv)
+    check(args)
+    print("multi-worker check passed")
+
+
+if __name__ == "__main__":
+    main()
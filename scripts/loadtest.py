@@ -0,0 +1,357 @@
+"""Socket.IO load generator for the chat server.
+
+Spawns a throwaway server (or targets ``--url``), signs up synthetic users
+through ``/signup``, connects them over Socket.IO and drives send / typing /
+edit / delete traffic while recording fan-out and ack latency.
+
+    python scripts/loadtest.py --users 50 --rate 0.5 --duration 30
+"""
+import argparse
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+import socketio
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+SERVER_CODE = """
+from app import create_app
+from app.extensions import socketio
+app = create_app()
+socketio.run(app, host="127.0.0.1", port={port}, log_output=False)
+"""
+
+TOKEN_PATTERN = re.compile(r"lt:([0-9a-f]{32})")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=20.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start_server(workdir, port, extra_env=None):
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    env["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [sys.executable, "-c", SERVER_CODE.format(port=port)],
+        cwd=ROOT,
+        env=env,
+    )
+    if not _wait_for_port(port):
+        process.kill()
+        raise RuntimeError("server did not start")
+    return process
+
+
+def read_rss(pid):
+    """Resident set size of ``pid`` in bytes, or None when unavailable."""
+    if pid is None:
+        return None
+    try:
+        import psutil
+
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent_at = {}
+        self.fanout = []
+        self.ack = []
+        self.counts = {}
+        self.errors = {}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def error(self, name):
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def mark_sent(self, token):
+        with self.lock:
+            self.sent_at[token] = time.perf_counter()
+
+    def mark_received(self, token):
+        now = time.perf_counter()
+        with self.lock:
+            started = self.sent_at.get(token)
+            if started is not None:
+                self.fanout.append(now - started)
+
+    def mark_ack(self, elapsed):
+        with self.lock:
+            self.ack.append(elapsed)
+
+
+class SyntheticUser:
+    def __init__(self, base_url, index, channels, stats, args):
+        self.base_url = base_url
+        self.index = index
+        self.channels = channels
+        self.stats = stats
+        self.args = args
+        self.http = requests.Session()
+        self.client = socketio.Client(reconnection=False)
+        self.own_messages = []
+        self._install_handlers()
+
+    def _install_handlers(self):
+        @self.client.on("new_message")
+        def on_new_message(message):
+            self.stats.count("new_message")
+            match = TOKEN_PATTERN.search(str(message))
+            if match:
+                self.stats.mark_received(match.group(1))
+
+        @self.client.on("message_updated")
+        def on_message_updated(message):
+            self.stats.count("message_updated")
+
+        @self.client.on("message_deleted")
+        def on_message_deleted(payload):
+            self.stats.count("message_deleted")
+
+        @self.client.on("typing_update")
+        def on_typing_update(payload):
+            self.stats.count("typing_update")
+
+    def signup(self):
+        name = f"lt{self.index}-{uuid.uuid4().hex[:6]}"
+        response = self.http.post(
+            f"{self.base_url}/signup",
+            data={
+                "email": f"{name}@loadtest.local",
+                "name": name,
+                "username": name,
+                "password": "loadtest",
+                "password_confirm": "loadtest",
+            },
+            allow_redirects=False,
+        )
+        if response.status_code != 302 or "session" not in self.http.cookies:
+            raise RuntimeError(f"signup failed for {name}: {response.status_code}")
+
+    def connect(self):
+        cookie = "; ".join(f"{key}={value}" for key, value in self.http.cookies.items())
+        self.client.connect(
+            self.base_url,
+            headers={"Cookie": cookie},
+            transports=["websocket"],
+            wait_timeout=10,
+        )
+        for channel in self.channels:
+            self.client.emit("join", {"channel": channel})
+
+    def _send(self):
+        token = uuid.uuid4().hex
+        channel = random.choice(self.channels)
+        self.stats.mark_sent(token)
+        started = time.perf_counter()
+        try:
+            response = self.client.call(
+                "send_message",
+                {"channel": channel, "content": f"load message lt:{token}"},
+                timeout=self.args.ack_timeout,
+            )
+        except socketio.exceptions.TimeoutError:
+            self.stats.error("send_timeout")
+            return
+        self.stats.mark_ack(time.perf_counter() - started)
+        if not response or not response.get("ok"):
+            self.stats.error("send_rejected")
+            return
+        self.stats.count("sent")
+        message = response.get("message") or {}
+        if message.get("id"):
+            self.own_messages.append(message["id"])
+
+    def _edit(self):
+        if not self.own_messages:
+            return
+        message_id = random.choice(self.own_messages)
+        self.client.emit("edit_message", {"message_id": message_id, "content": "edited"})
+        self.stats.count("edit")
+
+    def _delete(self):
+        if not self.own_messages:
+            return
+        message_id = self.own_messages.pop(random.randrange(len(self.own_messages)))
+        self.client.emit("delete_message", {"message_id": message_id})
+        self.stats.count("delete")
+
+    def _type(self):
+        channel = random.choice(self.channels)
+        self.client.emit("typing", {"channel": channel, "is_typing": True})
+        self.client.emit("typing", {"channel": channel, "is_typing": False})
+        self.stats.count("typing")
+
+    def run(self, deadline):
+        interval = 1.0 / self.args.rate if self.args.rate > 0 else None
+        time.sleep(random.random() * (interval or 0.1))
+        while time.time() < deadline and self.client.connected:
+            roll = random.random()
+            try:
+                if roll < self.args.delete_ratio:
+                    self._delete()
+                elif roll < self.args.delete_ratio + self.args.edit_ratio:
+                    self._edit()
+                else:
+                    if random.random() < self.args.typing_ratio:
+                        self._type()
+                    self._send()
+            except socketio.exceptions.SocketIOError:
+                self.stats.error("socket")
+            if interval is None:
+                break
+            time.sleep(random.expovariate(1.0 / interval))
+
+    def close(self):
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+def _fmt_ms(value):
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+
+def _fmt_mb(value):
+    return "-" if value is None else f"{value / (1024 * 1024):.1f}MB"
+
+
+def report(stats, elapsed, rss_samples):
+    print(f"duration         {elapsed:.1f}s")
+    for name in sorted(stats.counts):
+        print(f"{name:<16} {stats.counts[name]}")
+    sent = stats.counts.get("sent", 0)
+    print(f"send rate        {sent / elapsed:.1f}/s" if elapsed else "send rate        -")
+    for label, values in (("fan-out", stats.fanout), ("ack", stats.ack)):
+        print(
+            f"{label:<16} n={len(values)} "
+            + " ".join(f"p{pct}={_fmt_ms(percentile(values, pct))}" for pct in (50, 90, 99))
+            + f" max={_fmt_ms(max(values) if values else None)}"
+        )
+    attempts = sent + sum(stats.errors.values())
+    total_errors = sum(stats.errors.values())
+    print(f"errors           {total_errors} ({(total_errors / attempts * 100) if attempts else 0:.2f}%)")
+    for name in sorted(stats.errors):
+        print(f"  {name:<14} {stats.errors[name]}")
+    samples = [value for value in rss_samples if value is not None]
+    if samples:
+        print(f"server rss       start={_fmt_mb(samples[0])} peak={_fmt_mb(max(samples))} end={_fmt_mb(samples[-1])}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="target an already running server instead of spawning one")
+    parser.add_argument("--server-pid", type=int, help="pid to sample RSS from when using --url")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--channels", default="general", help="comma separated channel slugs")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per user")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of traffic")
+    parser.add_argument("--typing-ratio", type=float, default=0.3)
+    parser.add_argument("--edit-ratio", type=float, default=0.05)
+    parser.add_argument("--delete-ratio", type=float, default=0.02)
+    parser.add_argument("--ack-timeout", type=float, default=5.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    channels = [slug.strip() for slug in args.channels.split(",") if slug.strip()]
+    process = None
+    workdir = tempfile.mkdtemp(prefix="kjb-loadtest-")
+    base_url = args.url
+    server_pid = args.server_pid
+    if not base_url:
+        port = _free_port()
+        process = start_server(workdir, port)
+        base_url = f"http://127.0.0.1:{port}"
+        server_pid = process.pid
+
+    stats = Stats()
+    users = []
+    rss_samples = [read_rss(server_pid)]
+    try:
+        # The first account becomes admin; keep it out of the measured population.
+        SyntheticUser(base_url, -1, channels, stats, args).signup()
+        for index in range(args.users):
+            user = SyntheticUser(base_url, index, channels, stats, args)
+            user.signup()
+            user.connect()
+            users.append(user)
+        print(f"connected {len(users)} users to {base_url}")
+        rss_samples.append(read_rss(server_pid))
+
+        started = time.time()
+        deadline = started + args.duration
+        threads = [threading.Thread(target=user.run, args=(deadline,), daemon=True) for user in users]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            rss_samples.append(read_rss(server_pid))
+            time.sleep(1.0)
+        time.sleep(0.5)
+        elapsed = time.time() - started
+        rss_samples.append(read_rss(server_pid))
+        report(stats, elapsed, rss_samples)
+    finally:
+        for user in users:
+            user.close()
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
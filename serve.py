@@ -0,0 +1,269 @@
+"""Production launcher: N eventlet workers behind a local sticky balancer.
+
+    SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6379/0 python serve.py --workers 4 --port 8000
+
+The master process brings the database up to date once (``flask init``),
+starts the workers on loopback ports and balances connections across them.
+Engine.IO session ids carry their worker's id, so a session's polling
+requests and its WebSocket upgrade always reach the worker that owns it;
+everything else goes round robin, one request per upstream connection.
+Workers share the message queue for cross-worker emits and cache updates.
+
+On SIGTERM or SIGINT the master stops accepting and tells every worker to
+drain: a worker stops accepting, closes its Engine.IO sessions (clients
+reconnect, normally to a replacement instance) and waits up to
+``--drain-timeout`` seconds for in-flight requests before exiting. Workers
+that die on their own are restarted.
+
+``/metrics`` is per worker; scrape the workers' loopback ports directly with
+``Authorization: Bearer $METRICS_TOKEN``.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import itertools  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+import re  # noqa: E402
+import signal  # noqa: E402
+import socket  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+from config import Config  # noqa: E402
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MAX_HEAD_BYTES = 64 * 1024
+SID_PATTERN = re.compile(rb"[?&]sid=([A-Za-z0-9]+)\.")
+CONNECTION_HEADER = re.compile(rb"^(connection|keep-alive):", re.IGNORECASE)
+RESTART_BACKOFF = 1.0
+
+log = logging.getLogger("kjb.serve")
+
+
+def worker_id(index):
+    return f"w{index}"
+
+
+# -- worker -------------------------------------------------------------------
+
+
+def run_worker(args):
+    import eventlet.wsgi
+
+    from app import create_app
+    from app.archive import start_message_archival
+    from app.cluster import publish, start_cluster
+    from app.extensions import socketio
+    from app.message_cache import warm_message_cache
+    from app.retention import start_notification_retention
+    from app.watchdog import start_hub_watchdog
+
+    app = create_app()
+    start_cluster(socketio)
+    start_hub_watchdog(app)
+    warm_message_cache(app)
+    if args.index == 1:
+        # Maintenance jobs work in batches; one worker is enough to run them.
+        start_notification_retention(app)
+        start_message_archival(app)
+
+    listener = eventlet.listen(("127.0.0.1", args.port))
+    server = eventlet.spawn(eventlet.wsgi.server, listener, app, log_output=False)
+    log.info("worker %s serving on 127.0.0.1:%s", worker_id(args.index), args.port)
+
+    master = os.getppid()
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.append(True))
+    # Drain as well if the master goes away without telling us.
+    while not stopping and not server.dead and os.getppid() == master:
+        eventlet.sleep(0.2)
+
+    # Close every session while the server still runs so the close packets
+    # go out, then stop accepting: killing wsgi.server shuts idle keep-alive
+    # connections and waits for requests in flight.
+    deadline = time.monotonic() + args.drain_timeout
+    eio = socketio.server.eio
+    closing = eventlet.GreenPool()
+    for sid in list(eio.sockets):
+        # A polling session's close waits for its next poll; close them all at once.
+        closing.spawn_n(eio.disconnect, sid)
+    while closing.running() and time.monotonic() < deadline:
+        eventlet.sleep(0.1)
+    server.kill()
+    while not server.dead and time.monotonic() < deadline:
+        eventlet.sleep(0.1)
+    publish("presence", users=[])
+    log.info("worker %s drained%s", worker_id(args.index), "" if server.dead else " (timed out)")
+
+
+# -- master -------------------------------------------------------------------
+
+
+class Worker:
+    def __init__(self, index, port, drain_timeout):
+        self.index = index
+        self.port = port
+        self.drain_timeout = drain_timeout
+        self.process = None
+        self.started_at = 0.0
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--worker",
+                str(self.index),
+                "--port",
+                str(self.port),
+                "--drain-timeout",
+                str(self.drain_timeout),
+            ],
+            cwd=ROOT,
+            env=dict(os.environ, KJB_WORKER_ID=worker_id(self.index), AUTO_INIT_DB="0"),
+        )
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+
+class Balancer:
+    def __init__(self, workers):
+        self.workers = {worker_id(worker.index): worker for worker in workers}
+        self._next = itertools.cycle(workers)
+
+    def pick(self, request_line):
+        match = SID_PATTERN.search(request_line)
+        if match:
+            worker = self.workers.get(match.group(1).decode("ascii"))
+            if worker is not None:
+                return worker
+        return next(self._next)
+
+    def handle(self, client):
+        try:
+            head = b""
+            while b"\r\n\r\n" not in head:
+                chunk = client.recv(8192)
+                if not chunk or len(head) > MAX_HEAD_BYTES:
+                    return
+                head += chunk
+            head, body = head.split(b"\r\n\r\n", 1)
+            lines = head.split(b"\r\n")
+            worker = self.pick(lines[0])
+            websocket = any(
+                line.lower().startswith(b"upgrade:") and b"websocket" in line.lower() for line in lines[1:]
+            )
+            if not websocket:
+                # One request per upstream connection, so the next request on
+                # this client connection gets routed on its own.
+                lines = [line for line in lines if not CONNECTION_HEADER.match(line)]
+                lines.append(b"Connection: close")
+            try:
+                upstream = socket.create_connection(("127.0.0.1", worker.port), timeout=5)
+            except OSError:
+                client.sendall(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            upstream.settimeout(None)
+            upstream.sendall(b"\r\n".join(lines) + b"\r\n\r\n" + body)
+            eventlet.spawn_n(_pipe, client, upstream, True)
+            _pipe(upstream, client, False)
+            upstream.close()
+        except OSError:
+            pass
+        finally:
+            client.close()
+
+
+def _pipe(source, target, half_close):
+    try:
+        while True:
+            data = source.recv(65536)
+            if not data:
+                break
+            target.sendall(data)
+    except (OSError, EOFError):
+        # EOFError: the other direction finished and closed this socket.
+        pass
+    if half_close:
+        try:
+            target.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def run_master(args):
+    if args.workers > 1 and not os.getenv("SOCKETIO_MESSAGE_QUEUE"):
+        sys.exit("serve.py: more than one worker needs SOCKETIO_MESSAGE_QUEUE")
+
+    subprocess.run([sys.executable, "-m", "flask", "--app", "run", "init"], cwd=ROOT, check=True)
+
+    workers = [
+        Worker(index, args.backend_port + index, args.drain_timeout) for index in range(1, args.workers + 1)
+    ]
+    for worker in workers:
+        worker.start()
+
+    balancer = Balancer(workers)
+    listener = eventlet.listen((args.host, args.port))
+    acceptor = eventlet.spawn(
+        eventlet.serve, listener, lambda client, _: balancer.handle(client), concurrency=10000
+    )
+    log.info("balancing %s workers on %s:%s", len(workers), args.host, args.port)
+
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.append(True))
+    while not stopping:
+        for worker in workers:
+            if not worker.alive() and time.monotonic() - worker.started_at > RESTART_BACKOFF:
+                log.warning("worker %s exited with %s; restarting", worker.index, worker.process.returncode)
+                worker.start()
+        eventlet.sleep(0.2)
+
+    log.info("draining")
+    acceptor.kill()
+    listener.close()
+    for worker in workers:
+        if worker.alive():
+            worker.process.send_signal(signal.SIGTERM)
+    deadline = time.monotonic() + args.drain_timeout + 5
+    clean = True
+    for worker in workers:
+        while worker.alive() and time.monotonic() < deadline:
+            eventlet.sleep(0.1)
+        if worker.alive():
+            log.warning("worker %s did not drain; killing", worker.index)
+            worker.process.kill()
+            worker.process.wait()
+            clean = False
+    if not clean:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=Config.SERVE_WORKERS)
+    parser.add_argument("--backend-port", type=int, default=None, help="workers listen on this + 1, + 2, ...")
+    parser.add_argument("--drain-timeout", type=float, default=Config.SERVE_DRAIN_TIMEOUT)
+    parser.add_argument("--worker", type=int, dest="index", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s[%(process)d] %(message)s")
+    if args.index is not None:
+        run_worker(args)
+        return
+    if args.backend_port is None:
+        args.backend_port = args.port + 100
+    run_master(args)
+
+
+if __name__ == "__main__":
+    main()
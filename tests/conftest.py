@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+# config.py reads the environment at import time.
+_workdir = tempfile.mkdtemp(prefix="kjb-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(_workdir, 'test.db')}",
+    UPLOAD_FOLDER=os.path.join(_workdir, "uploads"),
+    MESSAGE_ARCHIVE_FOLDER=os.path.join(_workdir, "archive"),
+    # Budgets must hold without the metrics hooks installed.
+    METRICS_ENABLED="0",
+    QUERY_TRACKING="1",
+    RATE_LIMIT_ENABLED="0",
+)
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db, socketio  # noqa: E402
+from app.models import User  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        # Enforce foreign keys as other databases do; SQLite leaves them off.
+        event.listen(db.engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+        db.engine.dispose()
+    return app
+
+
+def _signup(app, name):
+    client = app.test_client()
+    client.post(
+        "/signup",
+        data={
+            "email": f"{name}@test.local",
+            "name": name,
+            "username": name,
+            "password": "pw",
+            "password_confirm": "pw",
+        },
+    )
+    return client
+
+
+@pytest.fixture(scope="session")
+def clients(app):
+    """Signed-in test clients for alice (an admin), bob, carol and dave."""
+    clients = {name: _signup(app, name) for name in ("alice", "bob", "carol", "dave")}
+    with app.app_context():
+        User.query.filter_by(username="alice").update({"is_admin": True})
+        db.session.commit()
+    return clients
+
+
+@pytest.fixture(scope="session")
+def sockets(app, clients):
+    sockets = {name: socketio.test_client(app, flask_test_client=client) for name, client in clients.items()}
+    for socket in sockets.values():
+        socket.emit("join", {"channel": "general"}, callback=True)
+    yield sockets
+    for socket in sockets.values():
+        socket.disconnect()
+
+
+@pytest.fixture(scope="session")
+def history(sockets):
+    """Forty messages in #general from four authors, every third one a reply."""
+    names = list(sockets)
+    ids = []
+    for index in range(40):
+        payload = {"channel": "general", "content": f"message {index} **bold**", "client_id": f"seed-{index}"}
+        if ids and index % 3 == 0:
+            payload["reply_to"] = ids[-1]
+        ack = sockets[names[index % len(names)]].emit("send_message", payload, callback=True)
+        ids.append(ack["message"]["id"])
+    return ids
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.archive import MessageArchiver, archived_by_ids
+from app.extensions import db
+from app.models import Channel, Message, User
+from app.querytrack import query_budget
+
+
+def test_archived_ids_are_not_reused(app, clients):
+    config = {
+        **app.config,
+        "MESSAGE_ARCHIVE_KEEP_RECENT": 0,
+        "MESSAGE_ARCHIVE_SEGMENT_ROWS": 1,
+        "MESSAGE_ARCHIVE_PAUSE": 0,
+    }
+    with app.app_context():
+        author = User.query.filter_by(username="bob").first()
+        channel = Channel(slug="archive-reuse", name="archive-reuse", archive_after_days=1)
+        db.session.add(channel)
+        db.session.commit()
+        old = datetime.utcnow() - timedelta(days=30)
+        # The newest rows in the whole table, so archiving them removes its maximum id.
+        messages = [
+            Message(channel_id=channel.id, user_id=author.id, content=f"old {index}", created_at=old)
+            for index in range(3)
+        ]
+        db.session.add_all(messages)
+        db.session.commit()
+        archived_ids = [message.id for message in messages]
+
+        MessageArchiver(config).run()
+        assert Message.query.filter(Message.id.in_(archived_ids)).count() == 0
+
+        fresh = Message(channel_id=channel.id, user_id=author.id, content="new")
+        db.session.add(fresh)
+        db.session.commit()
+        assert fresh.id > max(archived_ids)
+
+        # One query for the segments and one for the authors, however many segments.
+        with query_budget(2):
+            found = archived_by_ids(archived_ids + [fresh.id])
+        assert {message_id: message.content for message_id, message in found.items()} == {
+            message_id: f"old {index}" for index, message_id in enumerate(archived_ids)
+        }
+
+
+def test_replies_keep_pointing_at_archived_messages(app, clients):
+    config = {**app.config, "MESSAGE_ARCHIVE_KEEP_RECENT": 0, "MESSAGE_ARCHIVE_PAUSE": 0}
+    with app.app_context():
+        assert db.session.execute(text("PRAGMA foreign_keys")).scalar() == 1
+        author = User.query.filter_by(username="carol").first()
+        channel = Channel(slug="archive-replies", name="archive-replies", archive_after_days=1)
+        db.session.add(channel)
+        db.session.commit()
+        old = datetime.utcnow() - timedelta(days=30)
+        root = Message(channel_id=channel.id, user_id=author.id, content="old root", created_at=old)
+        db.session.add(root)
+        db.session.commit()
+        reply = Message(channel_id=channel.id, user_id=author.id, content="recent reply", reply_to_id=root.id)
+        db.session.add(reply)
+        db.session.commit()
+
+        root_id, reply_id = root.id, reply.id
+
+        MessageArchiver(config).run()
+        assert Message.query.filter_by(id=root_id).count() == 0
+        assert Message.query.filter_by(id=reply_id).one().reply_to_id == root_id
+        assert archived_by_ids([root_id])[root_id].content == "old root"
@@ -0,0 +1,23 @@
+from flask import Response
+
+from app.compression import _compress_response
+
+
+def test_buffered_responses_are_compressed(app):
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = _compress_response(Response("x" * 4096, mimetype="text/plain"))
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_streamed_responses_pass_through(app):
+    pulled = []
+
+    def chunks():
+        for index in range(3):
+            pulled.append(index)
+            yield "x" * 4096
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = _compress_response(Response(chunks(), mimetype="text/plain"))
+    assert "Content-Encoding" not in response.headers
+    assert pulled == []
@@ -0,0 +1,63 @@
+from app.extensions import db
+from app.models import Accessory, Channel, ChannelPermission, Emoji, UserAccessoryPermission
+from app.permissions import apply_permission_rows
+
+
+def _rows(*rows):
+    return list(enumerate(rows, start=2))
+
+
+def test_reapplying_a_batch_grants_nothing(app, clients):
+    with app.app_context():
+        db.session.add_all(
+            [
+                Emoji(name="perm-wave", image_url="wave.png"),
+                Accessory(name="perm-hat", image_url="hat.png"),
+                Accessory(name="perm-cap", image_url="cap.png"),
+                Channel(slug="perm-room", name="perm-room"),
+            ]
+        )
+        db.session.commit()
+        rows = _rows(
+            {"action": "grant", "kind": "emoji", "user": "bob", "target": "perm-wave"},
+            {"action": "grant", "kind": "accessory", "user": "bob", "target": "perm-hat", "active": "yes"},
+            {"action": "grant", "kind": "accessory", "user": "bob", "target": "perm-cap"},
+            {"action": "grant", "kind": "channel", "user": "carol", "target": "perm-room", "can_send": "no"},
+        )
+
+        assert apply_permission_rows(rows) == {"granted": 4, "revoked": 0, "errors": []}
+        assert apply_permission_rows(rows) == {"granted": 0, "revoked": 0, "errors": []}
+
+        # Only the flags that differ count, and switching the worn accessory is one grant.
+        changed = _rows(
+            {"action": "grant", "kind": "channel", "user": "carol", "target": "perm-room"},
+            {"action": "grant", "kind": "accessory", "user": "bob", "target": "perm-cap", "active": "yes"},
+        )
+        assert apply_permission_rows(changed)["granted"] == 2
+        room = Channel.query.filter_by(slug="perm-room").one()
+        assert ChannelPermission.query.filter_by(channel_id=room.id, can_send=True).count() == 1
+        worn = UserAccessoryPermission.query.filter_by(is_active=True).join(Accessory).with_entities(Accessory.name)
+        assert [name for (name,) in worn] == ["perm-cap"]
+
+
+def test_row_errors_are_in_korean(app, clients):
+    with app.app_context():
+        report = apply_permission_rows(
+            _rows(
+                {"action": "give", "kind": "emoji", "user": "bob", "target": "x"},
+                {"action": "grant", "kind": "badge", "user": "bob", "target": "x"},
+                {"action": "grant", "kind": "emoji", "user": "", "target": "x"},
+                {"action": "grant", "kind": "channel", "user": "bob", "target": "general", "can_read": "maybe"},
+                {"action": "grant", "kind": "emoji", "user": "nobody", "target": "x"},
+                {"action": "revoke", "kind": "channel", "user": "bob", "target": "nowhere"},
+            )
+        )
+    assert report["granted"] == report["revoked"] == 0
+    assert report["errors"] == [
+        [2, "알 수 없는 작업입니다: 'give'"],
+        [3, "알 수 없는 종류입니다: 'badge'"],
+        [4, "사용자와 대상을 입력해주세요"],
+        [5, "예/아니오 값이 아닙니다: 'maybe'"],
+        [6, "사용자를 찾을 수 없습니다: 'nobody'"],
+        [7, "채널을 찾을 수 없습니다: 'nowhere'"],
+    ]
@@ -0,0 +1,71 @@
+"""Query budgets for the hot paths, as configured in ``QUERY_BUDGETS``."""
+import pytest
+
+from app.extensions import db
+from app.models import Accessory, Emoji, ShopItem, ShopRequest, User
+from app.permissions import apply_permission_rows
+from app.querytrack import QueryBudgetExceeded, query_budget
+
+
+def budget(app, label):
+    return app.config["QUERY_BUDGETS"][label]
+
+
+def test_chat_page(app, clients, history):
+    with query_budget(budget(app, "http:views.chat"), max_repeats=2):
+        response = clients["bob"].get("/chat?id=general")
+    assert response.status_code == 200
+
+
+@pytest.fixture
+def listed(app, clients):
+    """A pending shop request and one grant of each kind, so every list on the admin page has a row."""
+    with app.app_context():
+        item = ShopItem(name="budget-mug", kc_cost=1)
+        db.session.add_all(
+            [item, Emoji(name="budget-emoji", image_url="e.png"), Accessory(name="budget-hat", image_url="h.png")]
+        )
+        db.session.flush()
+        carol = User.query.filter_by(username="carol").one()
+        db.session.add(ShopRequest(user_id=carol.id, item_id=item.id, status="pending"))
+        db.session.commit()
+        apply_permission_rows(
+            [
+                (2, {"action": "grant", "kind": "emoji", "user": "bob", "target": "budget-emoji"}),
+                (3, {"action": "grant", "kind": "accessory", "user": "bob", "target": "budget-hat"}),
+                (4, {"action": "grant", "kind": "channel", "user": "bob", "target": "general"}),
+            ]
+        )
+
+
+def test_admin_page(app, clients, history, listed):
+    with query_budget(budget(app, "http:views.admin"), max_repeats=2):
+        response = clients["alice"].get("/admin")
+    assert response.status_code == 200
+    assert b'value="user_delete"' in response.data
+
+
+def test_send_message(app, sockets, history):
+    payload = {"channel": "general", "content": "a reply", "client_id": "budget-send", "reply_to": history[-1]}
+    with query_budget(budget(app, "socket:send_message")):
+        ack = sockets["bob"].emit("send_message", payload, callback=True)
+    assert ack["ok"]
+
+
+def test_edit_message(app, sockets, history):
+    ack = sockets["carol"].emit(
+        "send_message", {"channel": "general", "content": "draft", "client_id": "budget-edit"}, callback=True
+    )
+    with query_budget(budget(app, "socket:edit_message")):
+        sockets["carol"].emit("edit_message", {"message_id": ack["message"]["id"], "content": "edited"})
+    assert "message_updated" in [packet["name"] for packet in sockets["carol"].get_received()]
+
+
+def test_strict_budget_applies_without_metrics(app, clients, history, monkeypatch):
+    # The request's own label has to match QUERY_BUDGETS even with the
+    # metrics hooks off, or strict mode never fires.
+    assert not app.config["METRICS_ENABLED"]
+    monkeypatch.setitem(app.config, "QUERY_BUDGET_STRICT", True)
+    monkeypatch.setitem(app.config, "QUERY_BUDGETS", {**app.config["QUERY_BUDGETS"], "http:views.chat": 1})
+    with pytest.raises(QueryBudgetExceeded, match="http:views.chat"):
+        clients["bob"].get("/chat?id=general")
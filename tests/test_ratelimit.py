@@ -0,0 +1,104 @@
+import pytest
+
+from app.ratelimit import MemoryBuckets, RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def limiter(clock):
+    limiter = RateLimiter()
+    limiter.configure(
+        {
+            "RATE_LIMIT_ENABLED": True,
+            "RATE_LIMIT_COSTS": {"send_message": 1, "send_messages": 1},
+            "RATE_LIMIT_USER_RATE": 1.0,
+            "RATE_LIMIT_USER_BURST": 10,
+            "RATE_LIMIT_CONNECTION_RATE": 2.0,
+            "RATE_LIMIT_CONNECTION_BURST": 4,
+            "RATE_LIMIT_DISCONNECT_AFTER": 3,
+            "RATE_LIMIT_STORE": "",
+        }
+    )
+    limiter.connections = MemoryBuckets(clock)
+    limiter.users = limiter.fallback = MemoryBuckets(clock)
+    return limiter
+
+
+def test_bucket_refills_up_to_its_burst(clock):
+    buckets = MemoryBuckets(clock)
+    assert [buckets.take("k", 2.0, 3, 1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("k", 2.0, 3, 1) == pytest.approx(0.5)
+
+    clock.now += 1.0
+    assert buckets.take("k", 2.0, 3, 2) == 0.0
+    # An hour idle still only refills to the burst.
+    clock.now += 3600
+    assert [buckets.take("k", 2.0, 3, 1) for _ in range(4)][-1] == pytest.approx(0.5)
+
+
+def test_retry_after_is_the_time_until_the_tokens_are_back(clock):
+    buckets = MemoryBuckets(clock)
+    buckets.take("k", 4.0, 4, 4)
+    clock.now += 0.25
+    assert buckets.take("k", 4.0, 4, 3) == pytest.approx(0.5)
+
+
+def test_connection_bucket_refuses_first_and_flooding_counts_refusals(limiter, clock):
+    waits = [limiter.check("send_message", 1, "sid-1") for _ in range(7)]
+    assert waits[:4] == [0.0] * 4
+    assert all(wait > 0 for wait in waits[4:])
+    assert limiter.flooding("sid-1")
+    # The user bucket was only charged for the events the connection let through.
+    assert limiter.users.take("user:1", 1.0, 10, 6) == 0.0
+
+    clock.now += 10
+    assert limiter.check("send_message", 1, "sid-1") == 0.0
+    assert not limiter.flooding("sid-1")
+
+
+def test_user_bucket_is_shared_by_connections(limiter):
+    for index in range(10):
+        assert limiter.check("send_message", 1, f"tab-{index}") == 0.0
+    assert limiter.check("send_message", 1, "tab-10") == pytest.approx(1.0)
+    assert limiter.check("send_message", 2, "tab-10") == 0.0
+
+
+def test_weight_and_unlimited_events(limiter):
+    assert limiter.check("send_messages", 1, "sid-1", weight=4) == 0.0
+    assert limiter.check("send_messages", 1, "sid-1", weight=4) > 0
+    assert limiter.check("join", 1, "sid-1") == 0.0
+
+
+class DeadRedis:
+    calls = 0
+
+    def take(self, key, rate, burst, cost):
+        self.calls += 1
+        raise ConnectionError("redis is down")
+
+
+def test_user_buckets_fall_back_to_memory_when_redis_fails(limiter, monkeypatch):
+    monkeypatch.setattr("app.ratelimit.time.monotonic", lambda: 50.0)
+    limiter.users = DeadRedis()
+    limiter.connection_rate = 0
+
+    waits = [limiter.check("send_message", 1, "sid-1") for _ in range(11)]
+    assert waits[:10] == [0.0] * 10 and waits[10] > 0
+    # Redis isn't retried on every event after a failure.
+    assert limiter.users.calls == 1
+
+    monkeypatch.setattr("app.ratelimit.time.monotonic", lambda: 60.0)
+    limiter.check("send_message", 2, "sid-2")
+    assert limiter.users.calls == 2
@@ -0,0 +1,65 @@
+from app.extensions import db
+from app.models import ShopItem, ShopRequest, User
+from app.shop import reserve_item
+
+
+def _stock(app, item_id):
+    with app.app_context():
+        return db.session.get(ShopItem, item_id).quantity
+
+
+def _requests(app, item_id, **filters):
+    with app.app_context():
+        return ShopRequest.query.filter_by(item_id=item_id, **filters).all()
+
+
+def test_the_last_unit_is_reserved_once(app):
+    with app.app_context():
+        item = ShopItem(name="last-sticker", kc_cost=1, quantity=1)
+        db.session.add(item)
+        db.session.commit()
+        assert [reserve_item(item.id), reserve_item(item.id)] == [True, False]
+        db.session.commit()
+        assert db.session.get(ShopItem, item.id).quantity == 0
+
+
+def test_denied_and_dropped_requests_return_their_stock(app, clients):
+    with app.app_context():
+        # Dearer than anyone's balance, so approving is refused for want of KC.
+        item = ShopItem(name="last-hoodie", kc_cost=10**9, quantity=1)
+        db.session.add(item)
+        db.session.commit()
+        item_id = item.id
+
+    clients["bob"].post("/shop", data={"item_id": item_id})
+    clients["carol"].post("/shop", data={"item_id": item_id})
+    (request,) = _requests(app, item_id)
+    assert _stock(app, item_id) == 0
+
+    clients["alice"].post("/admin", data={"action": "shop_decision", "request_id": request.id, "decision": "deny"})
+    assert [row.status for row in _requests(app, item_id)] == ["denied"]
+    assert _stock(app, item_id) == 1
+
+    clients["carol"].post("/shop", data={"item_id": item_id})
+    (request,) = _requests(app, item_id, status="pending")
+    clients["alice"].post("/admin", data={"action": "shop_decision", "request_id": request.id, "decision": "approve"})
+    assert _requests(app, item_id, status="pending") == []
+    assert _stock(app, item_id) == 1
+
+    erin = app.test_client()
+    erin.post(
+        "/signup",
+        data={
+            "email": "erin@test.local",
+            "name": "erin",
+            "username": "erin",
+            "password": "pw",
+            "password_confirm": "pw",
+        },
+    )
+    erin.post("/shop", data={"item_id": item_id})
+    assert _stock(app, item_id) == 0
+    clients["alice"].post("/admin", data={"action": "user_delete", "target": "erin"})
+    with app.app_context():
+        assert User.query.filter_by(username="erin").count() == 0
+    assert _stock(app, item_id) == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from app.extensions import db, socketio
+from app.models import Emoji, KCLog, Message, User
+
+
+@pytest.mark.parametrize("cursor", [10**12, -1])
+def test_join_ignores_a_cursor_it_never_issued(app, clients, history, cursor):
+    socket = socketio.test_client(app, flask_test_client=clients["dave"])
+    try:
+        ack = socket.emit(
+            "join",
+            {"channel": "general", "last_id": history[-5], "first_id": history[0], "cursor": cursor},
+            callback=True,
+        )
+    finally:
+        socket.disconnect()
+    assert ack["ok"]
+    assert ack["updated"] == []
+    assert [message["id"] for message in ack["messages"]][:4] == history[-4:]
+
+
+def test_a_retried_send_is_stored_and_rewarded_once(app, sockets, history):
+    with app.app_context():
+        db.session.add(Emoji(name="retry-wave", image_url="wave.png", is_public=True))
+        db.session.commit()
+        bob = User.query.filter_by(username="bob").one()
+        rewards = KCLog.query.filter_by(user_id=bob.id).count()
+    payload = {"channel": "general", "content": "again :retry-wave:", "client_id": "retry-1", "reply_to": history[-1]}
+
+    first = sockets["bob"].emit("send_message", payload, callback=True)
+    retry = sockets["bob"].emit("send_message", payload, callback=True)
+
+    assert retry["duplicate"]
+    assert retry["message"] == first["message"]
+    assert "inline-emoji" in retry["message"]["h"] and retry["message"]["ri"] == history[-1]
+    with app.app_context():
+        assert Message.query.filter_by(user_id=bob.id, client_id="retry-1").count() == 1
+        assert KCLog.query.filter_by(user_id=bob.id).count() == rewards + 1